@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'consultations.middleware.MetricsMiddleware',  # задержки запросов для /metrics
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -124,6 +125,13 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / "consultations" / "static"]
 
+# Knowledge base
+# Структурированная база (popitka2/kb_store.py), если она уже собрана, иначе плоский файл.
+# Инвертированный индекс сохраняется рядом с KB (<KB_PATH>.index.pickle)
+
+KB_DB = BASE_DIR / "knowledge_base_aliyah_full.sqlite3"
+KB_PATH = os.getenv("KB_PATH", str(KB_DB if KB_DB.exists() else BASE_DIR / "knowledge_base_aliyah_full.txt"))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
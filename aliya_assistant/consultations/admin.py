@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import CrawlJob
+
+
+@admin.register(CrawlJob)
+class CrawlJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "full", "pages", "pdfs", "forms", "bytes", "created_at", "finished_at")
+    list_filter = ("status", "full")
+    readonly_fields = ("progress", "error", "worker", "started_at", "heartbeat_at", "finished_at")
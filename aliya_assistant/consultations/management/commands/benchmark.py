@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource  # только Unix: пиковый RSS процесса
+except ImportError:
+    resource = None
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from consultations.services import answer_cache, openai_clients, pipeline, semantic_cache
+from consultations.services.context_builder import build_context
+from consultations.services.kb_index import index_for_question
+from consultations.services.manager import process_query
+from consultations.services.metrics import REGISTRY
+from consultations.services.semantic_cache import report_questions
+
+TARGETS = ("retrieve", "process_query", "ask", "ask_stream")
+
+
+def percentile(values, q: float) -> float:
+    """Перцентиль с линейной интерполяцией (как numpy.percentile по умолчанию)."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Офлайн-бенчмарк: вопросы из report.txt прогоняются через retrieve (KB + контекст), "
+        "process_query и представления /ask/, /ask/stream/ поверх заглушки OpenAI с заданной задержкой. "
+        "Результат (пропускная способность, p50/p95/p99, пик памяти, токены) сохраняется в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions", default=str(settings.BASE_DIR / "report.txt"),
+                            help="report.txt (строки после «Вопрос:») или файл с вопросом на строку")
+        parser.add_argument("--limit", type=int, default=0, help="не больше N вопросов (0 — все)")
+        parser.add_argument("--rounds", type=int, default=1, help="сколько раз повторить набор вопросов")
+        parser.add_argument("--targets", default=",".join(TARGETS), help=f"через запятую из {', '.join(TARGETS)}")
+        parser.add_argument("--latency", type=float, default=0.2, help="задержка заглушки OpenAI, секунды")
+        parser.add_argument("--concurrency", type=int, default=1, help="одновременных запросов")
+        parser.add_argument("--mode", choices=("graph", "fused"), default=pipeline.MODE, help="режим пайплайна")
+        parser.add_argument("--cache", action="store_true",
+                            help="не отключать кэши ответов (по умолчанию каждый вопрос идёт в «модель»)")
+        parser.add_argument("--no-memory", dest="memory", action="store_false",
+                            help="не замерять пик памяти (отдельный проход набора под tracemalloc)")
+        parser.add_argument("--output", default=None, help="путь JSON (по умолчанию benchmarks/<время>-<коммит>.json)")
+        parser.add_argument("--compare", default=None, help="JSON прошлого прогона — показать разницу")
+
+    def handle(self, *args, **options):
+        targets = [t.strip() for t in options["targets"].split(",") if t.strip()]
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f"Неизвестные цели: {', '.join(sorted(unknown))}")
+        questions = self.load_questions(options["questions"], options["limit"])
+        if not questions:
+            raise CommandError(f"Нет вопросов в {options['questions']}")
+
+        self.configure(options)
+        self.stdout.write(
+            f"🏁 {len(questions)} вопросов × {options['rounds']} раунд(а), заглушка {options['latency']} с, "
+            f"параллельно {options['concurrency']}, режим {options['mode']}, "
+            f"кэши {'включены' if options['cache'] else 'отключены'}"
+        )
+
+        for question in questions:  # загрузка индексов (по языкам вопросов) — не часть замера
+            index_for_question(settings.KB_PATH, question)
+        workload = questions * options["rounds"]
+        results = {}
+        for target in targets:
+            results[target] = self.measure(target, workload, options["concurrency"],
+                                           questions if options["memory"] else None)
+            self.print_row(target, results[target])
+
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "config": {
+                "questions": len(questions), "rounds": options["rounds"], "latency": options["latency"],
+                "concurrency": options["concurrency"], "mode": options["mode"], "cache": options["cache"],
+                "kb": os.path.basename(str(settings.KB_PATH)),
+            },
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+            "targets": results,
+        }
+        path = options["output"] or os.path.join(
+            settings.BASE_DIR, "benchmarks", f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit'] or 'nogit'}.json"
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f"💾 {path}")
+
+        if options["compare"]:
+            self.compare(options["compare"], report)
+
+    # ----------- Подготовка -----------
+    @staticmethod
+    def load_questions(path: str, limit: int):
+        questions = report_questions(path)
+        if not questions:  # не report.txt — вопрос на строку
+            with open(path, "r", encoding="utf-8") as f:
+                questions = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        return questions[:limit] if limit else questions
+
+    @staticmethod
+    def configure(options) -> None:
+        """Только заглушка: бенчмарк не должен ходить в сеть и тратить ключ."""
+        openai_clients.STUB = True
+        openai_clients.STUB_LATENCY = options["latency"]
+        openai_clients.reset_clients()
+        pipeline.MODE = options["mode"]
+        if not options["cache"]:
+            answer_cache.ENABLED = False
+            semantic_cache.ENABLED = False
+
+    # ----------- Цели -----------
+    @staticmethod
+    def retrieve(question: str) -> None:
+        build_context(index_for_question(settings.KB_PATH, question), question)
+
+    @staticmethod
+    def ask(client: Client, question: str) -> None:
+        response = client.post("/ask/", {"question_text": question})
+        if response.status_code != 200:
+            raise RuntimeError(f"/ask/ → {response.status_code}")
+
+    @staticmethod
+    async def ask_stream(client: AsyncClient, question: str) -> None:
+        response = await client.post("/ask/stream/", {"question_text": question})
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        if response.status_code != 200 or b"event: error" in body:
+            raise RuntimeError(f"/ask/stream/ → {response.status_code}")
+
+    def run_sync(self, target: str, workload, concurrency: int):
+        if target == "retrieve":
+            call = self.retrieve
+        elif target == "process_query":
+            call = process_query
+        else:
+            client = Client()
+            call = lambda q: self.ask(client, q)  # noqa: E731
+
+        def timed(question):
+            started = time.perf_counter()
+            call(question)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(timed, workload))
+
+    def run_stream(self, workload, concurrency: int):
+        async def main():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(question):
+                async with semaphore:
+                    started = time.perf_counter()
+                    await self.ask_stream(client, question)
+                    return time.perf_counter() - started
+
+            return await asyncio.gather(*(one(q) for q in workload))
+
+        return asyncio.run(main())
+
+    def run(self, target: str, workload, concurrency: int):
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            if target == "ask_stream":
+                return self.run_stream(workload, concurrency)
+            return self.run_sync(target, workload, concurrency)
+
+    def measure(self, target: str, workload, concurrency: int, memory_sample) -> dict:
+        tokens_before = {kind: REGISTRY.total("tokens_total", kind=kind) for kind in ("prompt", "completion")}
+        started = time.perf_counter()
+        latencies = self.run(target, workload, concurrency)
+        wall = time.perf_counter() - started
+        tokens = {kind: int(REGISTRY.total("tokens_total", kind=kind) - before) for kind, before in tokens_before.items()}
+
+        # tracemalloc примерно вдвое замедляет Python-код, поэтому память — отдельным проходом
+        peak = None
+        if memory_sample:
+            tracemalloc.start()
+            self.run(target, memory_sample, concurrency)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        ms = [sec * 1000 for sec in latencies]
+        return {
+            "requests": len(ms),
+            "wall_s": round(wall, 3),
+            "throughput_rps": round(len(ms) / wall, 2) if wall > 0 else 0.0,
+            "mean_ms": round(statistics.fmean(ms), 2),
+            "p50_ms": round(percentile(ms, 50), 2),
+            "p95_ms": round(percentile(ms, 95), 2),
+            "p99_ms": round(percentile(ms, 99), 2),
+            "max_ms": round(max(ms), 2),
+            "memory_peak_mb": round(peak / 2**20, 2) if peak is not None else None,  # пик Python-аллокаций (tracemalloc)
+            "prompt_tokens": tokens["prompt"],
+            "completion_tokens": tokens["completion"],
+        }
+
+    # ----------- Вывод -----------
+    def print_row(self, target: str, r: dict) -> None:
+        self.stdout.write(
+            f"  {target:<14} {r['throughput_rps']:>8.2f} зап/с  p50 {r['p50_ms']:>8.1f}  p95 {r['p95_ms']:>8.1f}  "
+            f"p99 {r['p99_ms']:>8.1f} мс  память {r['memory_peak_mb'] or 0:>7.2f} МБ  "
+            f"токены {r['prompt_tokens']}/{r['completion_tokens']}"
+        )
+
+    def compare(self, path: str, report: dict) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        self.stdout.write(f"📊 Сравнение с {path} (коммит {baseline.get('commit')}):")
+        changed = {k: (baseline.get("config", {}).get(k), v) for k, v in report["config"].items()
+                   if baseline.get("config", {}).get(k) != v}
+        if changed:
+            self.stdout.write(self.style.WARNING(
+                "  ⚠ другие настройки прогона: " + ", ".join(f"{k} {old} → {new}" for k, (old, new) in changed.items())
+            ))
+        for target, r in report["targets"].items():
+            old = baseline.get("targets", {}).get(target)
+            if not old:
+                continue
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "memory_peak_mb", "prompt_tokens"):
+                if old.get(key):
+                    deltas.append(f"{key} {(r[key] - old[key]) / old[key] * 100:+.1f}%")
+            self.stdout.write(f"  {target:<14} " + ", ".join(deltas))
@@ -0,0 +1,63 @@
+import os
+import socket
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+
+from consultations.models import CrawlJob
+
+
+class Command(BaseCommand):
+    help = "Выполняет задания на обход сайтов (CrawlJob) в отдельном от веб-сервера процессе."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="выполнить одно задание (если есть) и выйти")
+        parser.add_argument("--poll", type=float, default=2.0, help="пауза между проверками очереди, секунды")
+        parser.add_argument("--cancel-check", type=float, default=2.0,
+                            help="как часто (секунды) отмечаться и проверять запрос на отмену")
+        parser.add_argument("--name", default=None,
+                            help="имя воркера (по умолчанию host:pid); с постоянным именем после "
+                                 "перезапуска его брошенные задания сразу помечаются ошибкой")
+
+    def handle(self, *args, once=False, poll=2.0, cancel_check=2.0, name=None, **options):
+        worker = name or f"{socket.gethostname()}:{os.getpid()}"
+        stale = CrawlJob.fail_stale(worker)
+        if stale:
+            self.stderr.write(f"⚠️ Брошенных заданий помечено ошибкой: {stale}")
+        self.stdout.write(f"🛠 Воркер {worker} ждёт задания…")
+        while True:
+            job = CrawlJob.claim_next(worker)
+            if job is not None:
+                self.run_job(job, cancel_check)
+            elif once:
+                self.stdout.write("Очередь пуста.")
+            if once:
+                return
+            if job is None:
+                time.sleep(poll)
+
+    def run_job(self, job, cancel_check: float) -> None:
+        # импорт здесь: парсер настраивает логирование и папку docs/ при импорте
+        from popitka2.parser2 import crawl
+
+        self.stdout.write(f"▶ Обход #{job.pk} ({'полный' if job.full else 'инкрементальный'})")
+        checked = {"at": 0.0, "cancel": False}
+
+        def should_stop() -> bool:
+            now = time.monotonic()
+            if now - checked["at"] >= cancel_check:
+                checked["at"] = now
+                checked["cancel"] = job.heartbeat()
+            return checked["cancel"]
+
+        try:
+            summary = crawl(full=job.full, on_progress=job.record_progress, should_stop=should_stop)
+        except Exception as e:
+            job.finish(CrawlJob.FAILED, f"{e}\n{traceback.format_exc()}")
+            self.stderr.write(f"❌ Обход #{job.pk}: {e}")
+            return
+
+        status = CrawlJob.CANCELLED if summary.get("cancelled") else CrawlJob.DONE
+        job.finish(status)
+        self.stdout.write(f"✅ Обход #{job.pk}: {job.get_status_display()}, страниц {job.pages}, PDF {job.pdfs}")
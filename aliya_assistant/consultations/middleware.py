@@ -0,0 +1,43 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .services import metrics
+
+
+class MetricsMiddleware:
+    """
+    Задержка каждого запроса → aliya_request_seconds{view, method, status}.
+    view — имя маршрута (ask, ask_stream, …), чтобы не плодить метки по URL.
+    Для потоковых ответов (SSE) учитывается время до начала потока.
+    Работает и под WSGI, и под ASGI (асинхронные представления не переводятся в поток).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    @staticmethod
+    def record(request, response, started: float) -> None:
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        metrics.observe("request_seconds", time.perf_counter() - started,
+                        view=view, method=request.method, status=response.status_code)
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
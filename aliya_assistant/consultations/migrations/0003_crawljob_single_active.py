@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-17 12:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def cancel_extra_active(apps, schema_editor):
+    """До ограничения могло остаться несколько активных заданий — оставляем самое старое."""
+    CrawlJob = apps.get_model('consultations', 'CrawlJob')
+    active = CrawlJob.objects.filter(status__in=['queued', 'running']).order_by('created_at')
+    extra = list(active.values_list('pk', flat=True)[1:])
+    CrawlJob.objects.filter(pk__in=extra).update(
+        status='cancelled', error='Дубликат активного задания', finished_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultations', '0002_crawljob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_extra_active, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='crawljob',
+            constraint=models.UniqueConstraint(models.Value(True), condition=models.Q(('status__in', ['queued', 'running'])), name='crawljob_single_active'),
+        ),
+    ]
@@ -1,3 +1,172 @@
-from django.db import models
+import os
+from datetime import timedelta
 
-# Create your models here.
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+# Выполняющееся задание без отметки воркера дольше этого (секунды) считается брошенным:
+# воркер убит или сервер перезагружен, а статус так и остался RUNNING.
+STALE_AFTER = int(os.getenv("CRAWL_STALE_AFTER", 300))
+
+
+class CrawlJob(models.Model):
+    """
+    Задание на обход сайтов (popitka2.parser2.crawl).
+    Веб-процесс только ставит задание в очередь; выполняет его отдельный
+    процесс `python manage.py crawl_worker`, так что парсер не отнимает
+    потоки у запросов, а статус переживает перезапуск и виден всем воркерам.
+
+    Воркер раз в несколько секунд обновляет heartbeat_at; задание, у которого
+    отметки нет дольше STALE_AFTER, помечается ошибкой (fail_stale), чтобы
+    умерший воркер не блокировал очередь навсегда.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    STATUS_CHOICES = [
+        (QUEUED, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Завершено"),
+        (FAILED, "Ошибка"),
+        (CANCELLED, "Отменено"),
+    ]
+    ACTIVE = (QUEUED, RUNNING)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    full = models.BooleanField(default=False)  # полный обход без условных запросов
+    cancel_requested = models.BooleanField(default=False)
+
+    # счётчики прогресса (обновляются воркером по ходу обхода)
+    pages = models.PositiveIntegerField(default=0)
+    pdfs = models.PositiveIntegerField(default=0)
+    forms = models.PositiveIntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    progress = models.JSONField(default=dict, blank=True)  # последний снимок счётчиков crawl()
+
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # последняя отметка воркера
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # не больше одного активного задания (QUEUED или RUNNING) — проверяет сама база,
+            # так что два одновременных enqueue не поставят два обхода даже на SQLite
+            models.UniqueConstraint(
+                models.Value(True),
+                condition=models.Q(status__in=["queued", "running"]),  # = CrawlJob.ACTIVE
+                name="crawljob_single_active",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Обход #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in self.ACTIVE
+
+    @classmethod
+    def enqueue(cls, full: bool = False):
+        """
+        (задание, создано ли новое): пока есть активное задание, второе не ставится.
+        Гонку двух запросов решает ограничение crawljob_single_active: проигравший
+        получает IntegrityError и возвращает задание победителя.
+        """
+        cls.fail_stale()
+        while True:
+            active = cls.objects.filter(status__in=cls.ACTIVE).first()
+            if active is not None:
+                return active, False
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(full=full), True
+            except IntegrityError:
+                continue  # задание победителя уже могло завершиться — проверяем заново
+
+    @classmethod
+    def claim_next(cls, worker: str):
+        """Забирает самое старое задание из очереди; None, если очередь пуста или его забрал другой воркер."""
+        job = cls.objects.filter(status=cls.QUEUED).order_by("created_at").first()
+        if job is None:
+            return None
+        claimed = cls.objects.filter(pk=job.pk, status=cls.QUEUED).update(
+            status=cls.RUNNING, worker=worker, started_at=timezone.now(), heartbeat_at=timezone.now()
+        )
+        if not claimed:
+            return None
+        job.refresh_from_db()
+        return job
+
+    @classmethod
+    def fail_stale(cls, worker: str = None) -> int:
+        """
+        Помечает ошибкой брошенные задания: RUNNING без отметки дольше STALE_AFTER,
+        а если передан worker — и все RUNNING этого воркера (он перезапущен и их уже не ведёт).
+        Возвращает число таких заданий.
+        """
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=STALE_AFTER)
+        stale = models.Q(heartbeat_at__lt=cutoff) | models.Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+        if worker:
+            stale |= models.Q(worker=worker)
+        return cls.objects.filter(stale, status=cls.RUNNING).update(
+            status=cls.FAILED, error="Воркер перестал отвечать — задание прервано", finished_at=now
+        )
+
+    def heartbeat(self) -> bool:
+        """Отметка «воркер жив»; возвращает, запрошена ли отмена."""
+        CrawlJob.objects.filter(pk=self.pk, status=self.RUNNING).update(heartbeat_at=timezone.now())
+        return CrawlJob.objects.filter(pk=self.pk, cancel_requested=True).exists()
+
+    def request_cancel(self) -> None:
+        """Задание из очереди отменяется сразу, выполняющееся — воркером при следующей проверке."""
+        CrawlJob.fail_stale()
+        self.refresh_from_db()
+        if self.status == self.QUEUED:
+            CrawlJob.objects.filter(pk=self.pk, status=self.QUEUED).update(
+                status=self.CANCELLED, cancel_requested=True, finished_at=timezone.now()
+            )
+        elif self.status == self.RUNNING:
+            CrawlJob.objects.filter(pk=self.pk).update(cancel_requested=True)
+        self.refresh_from_db()
+
+    def record_progress(self, counters: dict) -> None:
+        CrawlJob.objects.filter(pk=self.pk).update(
+            pages=counters.get("pages", 0),
+            pdfs=counters.get("pdfs", 0),
+            forms=counters.get("forms", 0),
+            bytes=counters.get("bytes", 0),
+            progress=counters,
+            heartbeat_at=timezone.now(),
+        )
+
+    def finish(self, status: str, error: str = "") -> None:
+        CrawlJob.objects.filter(pk=self.pk).update(status=status, error=error, finished_at=timezone.now())
+        self.refresh_from_db()
+
+    def as_dict(self) -> dict:
+        return {
+            "job": self.pk,
+            "status": self.status,
+            "running": self.status == self.RUNNING,
+            "done": self.status == self.DONE,
+            "full": self.full,
+            "cancel_requested": self.cancel_requested,
+            "pages": self.pages,
+            "pdfs": self.pdfs,
+            "forms": self.forms,
+            "bytes": self.bytes,
+            "error": self.error,
+            "progress": self.progress,  # очередь, ошибки по типам, страниц в секунду и т.д.
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "heartbeat_at": self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
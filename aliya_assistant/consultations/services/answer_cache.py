@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+answer_cache.py — кэш ответов модели
+
+Частые вопросы («корзина абсорбции», «ульпан») повторяются дословно или с
+точностью до регистра и знаков препинания, а каждый из них стоил вызова
+OpenAI. Кэш двухуровневый:
+- в памяти процесса — LRU на ANSWER_CACHE_MEMORY записей;
+- на диске — SQLite (ANSWER_CACHE_PATH), общий для перезапусков и процессов,
+  не больше ANSWER_CACHE_ROWS строк (вытесняются давно не использованные).
+
+Ключ — SHA-256 от нормализованного вопроса, модели, системного промпта роли и
+версии базы знаний (KBIndex.version), так что после пересборки KB или правки
+промпта старые ответы не используются. У записей есть срок жизни
+(ANSWER_CACHE_TTL, секунды). ANSWER_CACHE=0 отключает кэш.
+
+Ошибка SQLite (например, «database is locked», когда файл делят несколько
+воркеров Django) не роняет запрос: она пишется в лог и считается в
+disk_errors, а кэш в этот раз работает только с памятью.
+
+Используется в manager.process_query, views.ask_question и терминальном
+клиенте (vs_on_terminal2.call_model).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ANSWER_CACHE", "1") != "0"
+CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite3")
+TTL = int(os.getenv("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+MEMORY_SIZE = int(os.getenv("ANSWER_CACHE_MEMORY", 256))
+MAX_ROWS = int(os.getenv("ANSWER_CACHE_ROWS", 10000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key        TEXT PRIMARY KEY,
+    answer     TEXT NOT NULL,
+    model      TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_used_at ON answers (used_at);
+"""
+
+PUNCT_RE = re.compile(r"[^\w\s]+")
+SPACE_RE = re.compile(r"\s+")
+
+
+# ----------- Ключ -----------
+def normalize_question(text: str) -> str:
+    """Регистр, ё/е, знаки препинания и лишние пробелы на ответ не влияют."""
+    text = (text or "").lower().replace("ё", "е")
+    return SPACE_RE.sub(" ", PUNCT_RE.sub(" ", text)).strip()
+
+
+def cache_key(question: str, model: str, prompt: str = "", kb_version: str = "") -> str:
+    raw = "\x1f".join((normalize_question(question), model or "", prompt or "", kb_version or ""))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ----------- Кэш -----------
+class AnswerCache:
+    def __init__(self, path=CACHE_PATH, memory_size: int = MEMORY_SIZE,
+                 max_rows: int = MAX_ROWS, ttl: int = TTL):
+        self.memory = OrderedDict()  # key → (expires_at, answer)
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evicted": 0,
+                      "disk_errors": 0}
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(str(path), check_same_thread=False)
+            self.conn.executescript(SCHEMA)
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return item[1]
+                del self.memory[key]
+
+            if self.conn is not None:
+                try:
+                    row = self.conn.execute(
+                        "SELECT answer, expires_at FROM answers WHERE key = ? AND expires_at > ?", (key, now)
+                    ).fetchone()
+                    if row is not None:
+                        self.conn.execute("UPDATE answers SET used_at = ? WHERE key = ?", (now, key))
+                        self.conn.commit()
+                except sqlite3.Error as e:
+                    self._disk_error("чтение", e)
+                    row = None
+                if row is not None:
+                    self._remember(key, row[1], row[0])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, answer: str, model: str = None) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self._remember(key, expires_at, answer)
+            self.stats["stores"] += 1
+            if self.conn is not None:
+                try:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, answer, model, now, expires_at, now),
+                    )
+                    self._evict(now)
+                    self.conn.commit()
+                except sqlite3.Error as e:
+                    self._disk_error("запись", e)
+
+    def _disk_error(self, action: str, error: sqlite3.Error) -> None:
+        """Ошибка дискового уровня: в лог, откат незавершённой транзакции, дальше — только память."""
+        self.stats["disk_errors"] += 1
+        logger.warning("Кэш ответов: ошибка SQLite (%s: %s), используется память", action, error)
+        try:
+            self.conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, key: str, expires_at: float, answer: str) -> None:
+        self.memory[key] = (expires_at, answer)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        """Просроченные записи и всё сверх max_rows (начиная с давно не использованных)."""
+        removed = self.conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,)).rowcount
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        if count > self.max_rows:
+            removed += self.conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used_at LIMIT ?)",
+                (count - self.max_rows,),
+            ).rowcount
+        self.stats["evicted"] += removed
+
+    def get_or_compute(self, question: str, model: str, prompt: str, kb_version: str, compute):
+        """
+        Ответ из кэша или compute() с сохранением.
+        Пустой ответ или None (ошибка модели) не кэшируется.
+        """
+        key = cache_key(question, model, prompt, kb_version)
+        answer = self.get(key)
+        if answer is not None:
+            return answer
+        answer = compute()
+        if answer:
+            self.set(key, answer, model)
+        return answer
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM answers")
+                self.conn.commit()
+
+    def info(self) -> dict:
+        """Счётчики попаданий/промахов и размеры обоих уровней."""
+        with self.lock:
+            rows = 0
+            if self.conn is not None:
+                try:
+                    rows = self.conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+                except sqlite3.Error as e:
+                    self._disk_error("подсчёт строк", e)
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_size": len(self.memory),
+                "disk_rows": rows,
+            }
+
+
+# ----------- Общий кэш процесса -----------
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Кэш ответов процесса; None, если кэш отключён (ANSWER_CACHE=0)."""
+    global _cache
+    if not ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = AnswerCache()
+            except sqlite3.Error as e:
+                logger.warning("Дисковый кэш ответов недоступен (%s), только память", e)
+                _cache = AnswerCache(path=None)
+        return _cache
+
+
+def cached_answer(question: str, model: str, prompt: str, kb_version: str, compute):
+    """get_or_compute() общего кэша; без кэша — просто compute()."""
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(question, model, prompt, kb_version, compute)
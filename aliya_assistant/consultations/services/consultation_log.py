@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+consultation_log.py — журнал консультаций в SQLite
+
+Раньше терминальные клиенты дописывали в report.txt текстовые «отчёты»: файл
+нельзя было запросить, он рос без ограничений, а два процесса могли перемешать
+записи. Теперь каждая консультация — строка таблицы consultations
+(CONSULTATION_LOG_PATH): вопрос, модель, язык, ответы ролей, время по стадиям,
+задержка, токены. Индексы по времени и по (модель, время), так что сводки за
+месяцы трафика считаются запросом, а не разбором текста.
+
+Запись не задерживает ответ: log() кладёт запись в очередь, фоновый поток
+пишет пачками (до CONSULTATION_LOG_BATCH записей или раз в
+CONSULTATION_LOG_FLUSH секунд) одной транзакцией. Файл в режиме WAL —
+несколько процессов пишут и читают одновременно. При выходе процесса очередь
+дописывается (atexit). CONSULTATION_LOG=0 отключает журнал.
+
+Используется в vs_on_terminal.py и vs_on_terminal2.py.
+Сводка: python -m consultations.services.consultation_log [--days N]
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("CONSULTATION_LOG", "1") != "0"
+LOG_PATH = os.getenv("CONSULTATION_LOG_PATH", "consultations.sqlite3")
+BATCH_SIZE = int(os.getenv("CONSULTATION_LOG_BATCH", 100))
+FLUSH_INTERVAL = float(os.getenv("CONSULTATION_LOG_FLUSH", 1.0))
+
+SCHEMA = """
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS consultations (
+    id                INTEGER PRIMARY KEY,
+    created_at        REAL NOT NULL,
+    source            TEXT,
+    model             TEXT,
+    language          TEXT,
+    question          TEXT NOT NULL,
+    answer            TEXT,
+    roles             TEXT,
+    timings           TEXT,
+    latency           REAL,
+    prompt_tokens     INTEGER,
+    completion_tokens INTEGER,
+    error             TEXT
+);
+CREATE INDEX IF NOT EXISTS consultations_created_at ON consultations (created_at);
+CREATE INDEX IF NOT EXISTS consultations_model ON consultations (model, created_at);
+"""
+
+COLUMNS = ("created_at", "source", "model", "language", "question", "answer", "roles",
+           "timings", "latency", "prompt_tokens", "completion_tokens", "error")
+INSERT = f"INSERT INTO consultations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+
+def connect(path=LOG_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def to_row(record: dict) -> tuple:
+    """Словарь записи → строка таблицы; roles и timings хранятся как JSON."""
+    values = dict(record)
+    values.setdefault("created_at", time.time())
+    for name in ("roles", "timings"):
+        if values.get(name) is not None:
+            values[name] = json.dumps(values[name], ensure_ascii=False)
+    return tuple(values.get(name) for name in COLUMNS)
+
+
+# ----------- Фоновая запись -----------
+class ConsultationLog:
+    def __init__(self, path=LOG_PATH, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.stats = {"logged": 0, "written": 0, "batches": 0, "failed": 0}
+        self.lock = threading.Lock()  # stats пополняются из потоков клиента и писателя
+        connect(path).close()  # схема создаётся сразу: ошибки пути видны при старте, а не в потоке
+        self.thread = threading.Thread(target=self._run, name="consultation-log", daemon=True)
+        self.thread.start()
+
+    def log(self, question: str, **fields) -> None:
+        """
+        Не блокирует: запись уходит в очередь фонового потока.
+        fields — source, model, language, answer, roles {роль: текст}, timings {стадия: секунды},
+        latency, prompt_tokens, completion_tokens, error.
+        """
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise TypeError(f"Неизвестные поля журнала: {sorted(unknown)}")
+        with self.lock:
+            self.stats["logged"] += 1
+        self.queue.put(to_row({"question": question, **fields}))
+
+    def flush(self) -> None:
+        """Ждёт, пока всё поставленное в очередь окажется в базе."""
+        self.queue.join()
+
+    def _take_batch(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        conn = connect(self.path)
+        while True:
+            batch = self._take_batch(self.queue.get())
+            try:
+                with conn:
+                    conn.executemany(INSERT, batch)
+                with self.lock:
+                    self.stats["written"] += len(batch)
+                    self.stats["batches"] += 1
+            except sqlite3.Error as e:
+                with self.lock:
+                    self.stats["failed"] += len(batch)
+                logger.error("Журнал консультаций: не записано %d записей: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_log():
+    """Журнал процесса; None, если отключён (CONSULTATION_LOG=0) или файл недоступен."""
+    global _log
+    if not ENABLED:
+        return None
+    with _log_lock:
+        if _log is None:
+            try:
+                _log = ConsultationLog()
+            except sqlite3.Error as e:
+                logger.warning("Журнал консультаций недоступен: %s", e)
+                return None
+            atexit.register(_log.flush)
+        return _log
+
+
+def log_consultation(question: str, **fields) -> None:
+    log = get_log()
+    if log is not None:
+        log.log(question, **fields)
+
+
+# ----------- Аналитика -----------
+def summary(path=LOG_PATH, since: float = None):
+    """Консультаций, средняя задержка и токены по моделям (с момента since, unix-время)."""
+    conn = connect(path)
+    try:
+        return conn.execute(
+            """
+            SELECT model, COUNT(*), AVG(latency), SUM(prompt_tokens), SUM(completion_tokens),
+                   SUM(error IS NOT NULL)
+            FROM consultations
+            WHERE created_at >= ?
+            GROUP BY model
+            ORDER BY COUNT(*) DESC
+            """,
+            (since or 0,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сводка журнала консультаций")
+    parser.add_argument("--path", default=LOG_PATH)
+    parser.add_argument("--days", type=float, default=None, help="только за последние N дней")
+    args = parser.parse_args()
+
+    since = time.time() - args.days * 86400 if args.days else None
+    print(f"{'модель':<28} {'консультаций':>12} {'задержка, с':>12} {'prompt':>10} {'completion':>10} {'ошибок':>7}")
+    for model, count, latency, prompt, completion, errors in summary(args.path, since):
+        print(f"{model or '—':<28} {count:>12} {latency or 0:>12.2f} {prompt or 0:>10} {completion or 0:>10} {errors:>7}")
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+context_builder.py — сборка контекста для цепочки аналитик → коммуникатор → менеджер
+
+Раньше retrieve() склеивал 10 лучших абзацев целиком, а call_model() отправлял
+этот же контекст всем трём ролям. Здесь контекст собирается под бюджет токенов
+каждой роли:
+1. из абзацев (в порядке ранжирования) оставляются только предложения,
+   где есть термины вопроса;
+2. почти одинаковые предложения/абзацы отбрасываются (пересечение шинглов);
+3. предложения добавляются, пока не исчерпан бюджет роли.
+
+По умолчанию полный бюджет получает только аналитик; коммуникатор и менеджер
+работают по его фактам и контекст KB не получают. Бюджеты задаются через
+CTX_BUDGET_ANALYST / CTX_BUDGET_COMMUNICATOR / CTX_BUDGET_MANAGER.
+"""
+
+import math
+import os
+import re
+from dataclasses import dataclass, field
+
+from .metrics import timed
+from .ranking import analyze
+
+ROLES = ("analyst", "communicator", "manager")
+ROLE_BUDGETS = {
+    "analyst": int(os.getenv("CTX_BUDGET_ANALYST", 1500)),
+    "communicator": int(os.getenv("CTX_BUDGET_COMMUNICATOR", 0)),
+    "manager": int(os.getenv("CTX_BUDGET_MANAGER", 0)),
+}
+TOP_K = int(os.getenv("CTX_TOP_K", 10))
+CHARS_PER_TOKEN = float(os.getenv("CTX_CHARS_PER_TOKEN", 3.0))  # грубая оценка для кириллицы
+DUP_THRESHOLD = 0.8  # доля общих шинглов, начиная с которой фрагмент считается повтором
+
+SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+@dataclass
+class ContextPlan:
+    """Контексты по ролям и учёт токенов для одного вопроса."""
+    contexts: dict = field(default_factory=dict)
+    tokens: dict = field(default_factory=dict)
+    baseline_tokens: int = 0  # сколько ушло бы по-старому: топ-10 абзацев × 3 роли
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.baseline_tokens - self.total_tokens, 0)
+
+
+# ----------- Утилиты -----------
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def split_sentences(text: str):
+    return [s.strip() for s in SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def shingles(terms, n: int = 3) -> set:
+    if len(terms) < n:
+        return {tuple(terms)} if terms else set()
+    return {tuple(terms[i:i + n]) for i in range(len(terms) - n + 1)}
+
+
+def is_near_duplicate(sh: set, kept) -> bool:
+    """Повтор, если большая часть шинглов меньшего из фрагментов уже есть в другом."""
+    if not sh:
+        return True
+    for k in kept:
+        common = len(sh & k)
+        if common and common / min(len(sh), len(k)) >= DUP_THRESHOLD:
+            return True
+    return False
+
+
+# ----------- Сборка контекста -----------
+def pack_context(paragraphs, question: str, budget: int) -> str:
+    """Предложения абзацев, совпадающие с вопросом, без повторов и в пределах бюджета."""
+    if budget <= 0:
+        return ""
+    qterms = set(analyze(question))
+    if not qterms:
+        return ""
+    # основы — префиксы слов, поэтому дешёвый поиск подстроки отсекает почти всё
+    prefilter = re.compile("|".join(re.escape(t) for t in sorted(qterms, key=len, reverse=True)))
+    kept_shingles = []
+    blocks, used = [], 0
+    for p in paragraphs:
+        picked = []
+        for s in split_sentences(p):
+            if not prefilter.search(s.lower().replace("ё", "е")):
+                continue
+            terms = analyze(s)
+            if not qterms.intersection(terms):
+                continue
+            sh = shingles(terms)
+            if is_near_duplicate(sh, kept_shingles):
+                continue
+            cost = estimate_tokens(s) + 1
+            if used + cost > budget:
+                continue
+            kept_shingles.append(sh)
+            picked.append(s)
+            used += cost
+        if picked:
+            blocks.append("\n".join(picked))
+        if used >= budget:
+            break
+    return "\n\n".join(blocks)
+
+
+@timed("context")
+def build_context(index, question: str, budgets: dict = None, top_k: int = TOP_K) -> ContextPlan:
+    """Контексты для всех ролей по одному ранжированию KB."""
+    budgets = {**ROLE_BUDGETS, **(budgets or {})}
+    paragraphs = index.top_paragraphs(question, top_k)
+
+    plan = ContextPlan(baseline_tokens=estimate_tokens("\n\n".join(paragraphs)) * len(ROLES))
+    packed = {}
+    for role in ROLES:
+        budget = budgets.get(role, 0)
+        if budget not in packed:
+            packed[budget] = pack_context(paragraphs, question, budget)
+        plan.contexts[role] = packed[budget]
+        plan.tokens[role] = estimate_tokens(packed[budget])
+    return plan
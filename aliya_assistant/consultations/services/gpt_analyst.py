@@ -1,22 +1,27 @@
-import openai
+from .openai_clients import get_client
+from .metrics import record_usage, timed
 
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = (
+    "Ты - аналитическая модель Министерства алии и интеграции. "
+    "Выдели из запроса пользователя только ключевые факты и пункты, "
+    "без пояснений, в виде краткого списка. "
+)
+
+@timed("extract_facts")
 def extract_facts(questions_text: str) -> str:
     """GPT-1: извлекает факты из базы знаний министерства"""
-    client = openai.OpenAI()
-    system_prompt = (
-        "Ты - аналитическая модель Министерства алии и интеграции. "
-        "Выдели из запроса пользователя только ключевые факты и пункты, "
-        "без пояснений, в виде краткого списка. "
-    )
+    client = get_client()
     
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=MODEL,
         messages=[
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": questions_text},
         ],
         temperature=0.0,
     )
+    record_usage(response, MODEL)
     
     content = getattr(response.choices[0].message, "content", None)
     
@@ -1,24 +1,28 @@
-import openai
+from .openai_clients import get_client
+from .metrics import record_usage, timed
 
+MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = (
+    "Ты — нейро-сотрудник Министерства алии и интеграции. "
+    "На основе предоставленного списка фактов составь официальный, "
+    "но дружелюбный ответ для репатрианта. "
+    "Добавь приветствие, структурируй пункты и избегай воды."
+)
+
+@timed("generate_final_answer")
 def generate_final_answer(facts: str) -> str:
     """GPT-2: формирует вежливый и понятный ответ для пользователя."""
-    client = openai.OpenAI()
-
-    system_prompt = (
-        "Ты — нейро-сотрудник Министерства алии и интеграции. "
-        "На основе предоставленного списка фактов составь официальный, "
-        "но дружелюбный ответ для репатрианта. "
-        "Добавь приветствие, структурируй пункты и избегай воды."
-    )
+    client = get_client()
 
     response = client.chat.completions.create(
-        model="gpt-4o-mini",
+        model=MODEL,
         messages=[
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": facts},
         ],
         temperature=0.0,
     )
+    record_usage(response, MODEL)
 
     # Новый SDK возвращает строку
     text = getattr(response.choices[0].message, "content", "")
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+kb_index.py — инвертированный индекс базы знаний
+
+Индекс строится один раз по базе знаний — knowledge_base_aliyah_full.sqlite3
+(фрагменты из popitka2/kb_store.py) или старому плоскому .txt — и сохраняется рядом
+с ним (<KB>.index.pickle): матрица терминов в CSR-виде — для каждого термина
+номера абзацев и частоты, плюс длины абзацев для BM25 (см. ranking.py).
+Почти одинаковые абзацы (навигация, повторяющиеся вводные) в индекс не
+попадают — остаётся первый из кластера (near_dup.py, KB_DEDUP=0 отключает).
+Повторные запуски загружают его с диска за миллисекунды; перестройка
+происходит, только если у файла KB изменились mtime и SHA-256.
+
+Индексы по языкам: get_index(kb, "he") строится только по фрагментам на
+иврите (язык фрагмента — из kb_store, у старых баз определяется lang_id при
+сборке) и лежит в <KB>.he.index.pickle. index_for_question() выбирает индекс
+по языку вопроса — поиск идёт по корпусу одного языка, а не по смешанному;
+если язык вопроса не ясен (мало букв, русский вопрос с терминами латиницей
+вроде «sal klita» — см. ROUTE_MIN_MARGIN / ROUTE_MIN_COVERAGE) или на этом
+языке в KB ничего нет — по всей базе. KB_LANG_INDEX=0 отключает.
+
+Используется и терминальным клиентом (vs_on_terminal2.retrieve), и
+Django-представлением ask_question.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from popitka2 import detect, iter_chunks
+
+from . import near_dup
+from .metrics import timed
+from .ranking import analyze, get_ranker
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 4
+INDEX_SUFFIX = ".index.pickle"
+LANG_INDEXES = os.getenv("KB_LANG_INDEX", "1") != "0"
+# Вопрос уходит в индекс одного языка, только если язык определён уверенно:
+ROUTE_MIN_MARGIN = 1.0     # отрыв оценки lang_id от второго языка (у смешанных вопросов 0–0.6, у чистых от 1.7)
+ROUTE_MIN_COVERAGE = 0.8   # доля букв вопроса в алфавите этого языка
+KB_DB_SUFFIXES = {".sqlite3", ".db"}
+LINK_RE = re.compile(r"^Ссылка: (\S+)", re.M)
+
+
+# ----------- Утилиты -----------
+def read_kb(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        txt = f.read()
+    return re.sub(r"\r\n?", "\n", txt)
+
+
+def read_paragraphs(kb_path: str, lang: str = None):
+    """
+    (абзацы, url источника каждого абзаца); lang — только абзацы на этом языке.
+    SQLite-база читается курсором по фрагментам; плоский файл — как раньше,
+    url берётся из последнего встреченного заголовка «Ссылка:».
+    """
+    if Path(kb_path).suffix in KB_DB_SUFFIXES:
+        paragraphs, urls = [], []
+        for chunk in iter_chunks(kb_path):
+            if lang and (chunk.get("lang") or detect(chunk["text"])) != lang:
+                continue
+            paragraphs.append(chunk["text"])
+            urls.append(chunk["url"])
+        return paragraphs, urls
+
+    paragraphs, urls, url = [], [], ""
+    for part in re.split(r"\n\s*\n", read_kb(kb_path)):
+        links = LINK_RE.findall(part)
+        if links:
+            url = links[-1]
+        part = part.strip()
+        if len(part) > 40 and (not lang or detect(part) == lang):
+            paragraphs.append(part)
+            urls.append(url)
+    return paragraphs, urls
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dedup_config():
+    """Настройки удаления почти-повторов: при их смене индекс перестраивается."""
+    return [near_dup.THRESHOLD, near_dup.NUM_PERM, near_dup.BANDS] if near_dup.ENABLED else None
+
+
+def index_path_for(kb_path: str, lang: str = None) -> str:
+    return kb_path + (f".{lang}" if lang else "") + INDEX_SUFFIX
+
+
+# ----------- Индекс -----------
+class KBIndex:
+    """
+    Абзацы KB и матрица терминов в CSR-виде:
+    постинги термина t — doc_ids/tfs[indptr[vocab[t]]:indptr[vocab[t] + 1]].
+    """
+
+    def __init__(self, paragraphs, urls, vocab, indptr, doc_ids, tfs, doc_len, meta):
+        self.paragraphs = paragraphs
+        self.urls = urls  # url источника для каждого абзаца
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.meta = meta
+        self.cache = {}  # предрасчёты ранжировщиков (веса BM25 и т.п.)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.paragraphs)
+
+    def postings_slice(self, term: str):
+        i = self.vocab.get(term)
+        if i is None:
+            return None
+        return slice(self.indptr[i], self.indptr[i + 1])
+
+    @property
+    def version(self) -> str:
+        """SHA-256 файла KB, по которому построен индекс."""
+        return self.meta["kb_sha256"]
+
+    @timed("retrieval")
+    def search(self, question: str, top_k: int = 10, ranker=None):
+        """
+        Возвращает [(score, номер абзаца), ...] по убыванию score (только score > 0).
+        ranker — объект из ranking.py; по умолчанию get_ranker() (BM25).
+        """
+        ranker = ranker or get_ranker()
+        scores = ranker.score(self, analyze(question))
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.lexsort((hits, -scores[hits]))]
+        return [(float(scores[pid]), int(pid)) for pid in hits]
+
+    def top_paragraphs(self, question: str, top_k: int = 10, ranker=None):
+        return [self.paragraphs[pid] for _, pid in self.search(question, top_k, ranker)]
+
+
+def _kb_stat(kb_path: str) -> dict:
+    st = os.stat(kb_path)
+    return {"kb_size": st.st_size, "kb_mtime_ns": st.st_mtime_ns}
+
+
+def build_index(kb_path: str, lang: str = None) -> KBIndex:
+    """
+    Полный проход по KB: разбивка на абзацы, удаление почти-повторов, анализ текста и сборка CSR-матрицы.
+    lang — индекс только по абзацам на этом языке.
+    """
+    paragraphs, urls = read_paragraphs(kb_path, lang)
+    dedup_stats = None
+    if near_dup.ENABLED:
+        total = len(paragraphs)
+        paragraphs, urls, result = near_dup.dedup(paragraphs, urls)
+        dedup_stats = result.summary()
+        logger.info("Почти-повторы в KB: убрано %d из %d абзацев, размеры кластеров %s",
+                    result.removed, total, dedup_stats["sizes"])
+    postings = {}
+    doc_len = np.zeros(len(paragraphs), dtype=np.float32)
+    for pid, p in enumerate(paragraphs):
+        terms = analyze(p)
+        doc_len[pid] = len(terms)
+        for t, tf in Counter(terms).items():
+            postings.setdefault(t, []).append((pid, tf))
+
+    vocab, indptr, doc_ids, tfs = {}, [0], [], []
+    for i, (t, plist) in enumerate(sorted(postings.items())):
+        vocab[t] = i
+        doc_ids.extend(pid for pid, _ in plist)
+        tfs.extend(tf for _, tf in plist)
+        indptr.append(len(doc_ids))
+
+    meta = {"version": INDEX_VERSION, "kb_sha256": file_sha256(kb_path), "lang": lang, "dedup": dedup_config(),
+            "dedup_stats": dedup_stats, **_kb_stat(kb_path)}
+    return KBIndex(
+        paragraphs, urls, vocab,
+        np.asarray(indptr, dtype=np.int64),
+        np.asarray(doc_ids, dtype=np.int32),
+        np.asarray(tfs, dtype=np.float32),
+        doc_len, meta,
+    )
+
+
+INDEX_FIELDS = ("paragraphs", "urls", "vocab", "indptr", "doc_ids", "tfs", "doc_len")
+
+
+def save_index(index: KBIndex, path: str) -> None:
+    """Сначала пишется meta, затем данные — чтобы проверять свежесть, не читая весь индекс."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(index.meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump({k: getattr(index, k) for k in INDEX_FIELDS}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def _read_meta(path: str):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def load_index(kb_path: str, index_path: str = None, lang: str = None) -> KBIndex:
+    """
+    Загружает индекс с диска или перестраивает его.
+    - mtime и размер KB совпадают с сохранёнными — читаем индекс как есть;
+    - mtime изменился, но SHA-256 тот же — обновляем meta без перестройки;
+    - иначе строим индекс заново и сохраняем рядом с KB.
+    """
+    if not os.path.exists(kb_path):
+        raise FileNotFoundError(f"❌ KB not found: {kb_path}")
+    index_path = index_path or index_path_for(kb_path, lang)
+    stat = _kb_stat(kb_path)
+
+    meta = _read_meta(index_path)
+    if (meta and meta.get("version") == INDEX_VERSION and meta.get("dedup") == dedup_config()
+            and meta.get("lang") == lang):
+        fresh = all(meta.get(k) == v for k, v in stat.items())
+        touched = not fresh and meta.get("kb_sha256") == file_sha256(kb_path)
+        if touched:
+            meta.update(stat)
+        if fresh or touched:
+            with open(index_path, "rb") as f:
+                pickle.load(f)
+                data = pickle.load(f)
+            index = KBIndex(meta=meta, **data)
+            if touched:
+                save_index(index, index_path)
+            return index
+
+    logger.info("Перестраиваю индекс KB: %s%s", kb_path, f" ({lang})" if lang else "")
+    index = build_index(kb_path, lang)
+    try:
+        save_index(index, index_path)
+    except OSError as e:
+        logger.warning("Не удалось сохранить индекс %s: %s", index_path, e)
+    return index
+
+
+# ----------- Общий индекс процесса -----------
+_indexes = {}
+_lock = threading.Lock()
+
+
+@timed("kb_index")
+def get_index(kb_path: str, lang: str = None) -> KBIndex:
+    """
+    Индекс, общий для всего процесса (Django-воркер, CLI); lang — индекс одного языка.
+    На каждый вызов — только os.stat(); при изменении KB индекс перечитывается.
+    """
+    path = os.path.abspath(kb_path)
+    stat = _kb_stat(path)
+    with _lock:
+        index = _indexes.get((path, lang))
+        if index is None or any(index.meta.get(k) != v for k, v in stat.items()):
+            index = load_index(path, lang=lang)
+            _indexes[(path, lang)] = index
+        return index
+
+
+def question_language(question: str):
+    """Язык вопроса (ru / he / en); None — короткий, смешанный или непонятный вопрос."""
+    return detect(question, None, min_coverage=ROUTE_MIN_COVERAGE, min_margin=ROUTE_MIN_MARGIN)
+
+
+def index_for_question(kb_path: str, question: str) -> KBIndex:
+    """Индекс на языке вопроса; язык не ясен или в KB нет абзацев на нём — индекс всей базы."""
+    lang = question_language(question) if LANG_INDEXES else None
+    if lang is None:
+        return get_index(kb_path)
+    index = get_index(kb_path, lang)
+    return index if index.n_docs else get_index(kb_path)
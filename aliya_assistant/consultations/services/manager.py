@@ -1,39 +1,59 @@
-from .gpt_analyst import extract_facts
-from .gpt_communicator import generate_final_answer
+from . import gpt_analyst, gpt_communicator
+from .answer_cache import cache_key, get_cache
+from .semantic_cache import get_semantic_cache
+from . import pipeline
+from .metrics import timed
 
 import logging
 import openai
 
-#добавляю следущую функцию что бы использовать запрос на тест из плоской папки стр 9-16
-
-try:
-    from .gpt_analyst import extract_facts
-    from .gpt_communicator import generate_final_answer
-except ImportError:
-    # Фолбэк, если файлы лежат рядом без пакета 14 и 15 добавляю из-за запуска тестс
-    from aliya_assistant.consultations.services.gpt_analyst import extract_facts
-    from aliya_assistant.consultations.services.gpt_communicator import generate_final_answer
-    from gpt_analyst import extract_facts
-    from gpt_communicator import generate_final_answer
-
 logger = logging.getLogger(__name__)
 
-def process_query(questions_text: str) -> str:
+# ключ кэша ответов зависит от моделей и промптов обоих шагов (KB пайплайн не использует)
+PIPELINE_MODEL = f"{gpt_analyst.MODEL}+{gpt_communicator.MODEL}"
+PIPELINE_PROMPT = (
+    pipeline.FUSED_PROMPT if pipeline.MODE == "fused"
+    else gpt_analyst.SYSTEM_PROMPT + "\n" + gpt_communicator.SYSTEM_PROMPT
+)
+
+@timed("process_query")
+def process_query(questions_text: str, known: dict = None) -> str:
     """
         Основной алгоритм работы нейросотрудника.
         Шаг 1: GPT-1 (Аналитик) 
         Шаг 2: GPT-2 (Коммуникатор)
+        Шаги выполняет pipeline.run_query (граф ролей или один «fused»-вызов);
+        known — уже посчитанные стадии ({"facts": ..., "answer": ...}), они не пересчитываются.
+        Повторный вопрос отдаётся из кэша ответов (answer_cache.py) без вызова модели,
+        перефразированный — из семантического кэша (semantic_cache.py).
     """
+    cache = get_cache()
+    key = cache_key(questions_text, PIPELINE_MODEL, PIPELINE_PROMPT)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    similar = get_semantic_cache()
+    namespace = cache_key("", PIPELINE_MODEL, PIPELINE_PROMPT)
+    if similar is not None:
+        found = similar.lookup(questions_text, namespace)
+        if found is not None:
+            answer, score, source = found
+            logger.info("Ответ из семантического кэша (%.2f): %r ≈ %r", score, questions_text, source)
+            return answer
+
     try:
-        facts = extract_facts(questions_text)
-        if not facts:
+        result = pipeline.run_query(questions_text, known=known)
+        logger.info(result.report())
+        facts, answer = result.outputs["facts"], result.outputs["answer"]
+        if not facts and pipeline.MODE != "fused":
             logger.warning("GPT-1 не вернул фактов")
             return (
                 "Извините, ...."
                 "Попробуйте переформулировать вопрос."
             )
             
-        answer = generate_final_answer(facts)
         if not answer:
             logger.warning("GPT-2 не смог сформулировать ответ")
             return (
@@ -41,7 +61,12 @@ def process_query(questions_text: str) -> str:
                 "Попробуйте задать вопрос еще раз иначе. "
             )
             
-        return answer.strip()
+        answer = answer.strip()
+        if cache is not None:
+            cache.set(key, answer, PIPELINE_MODEL)
+        if similar is not None:
+            similar.store(questions_text, answer, namespace)
+        return answer
     
     except openai.AuthenticationError:
         logger.error("Ошибка авторизации: неверный или отсутствует OPENAI_API_KEY")
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py — задержки, токены и ошибки пайплайна консультаций
+
+Раньше о времени ответа можно было судить только по строке PipelineResult.report()
+в логе, а о расходе токенов — никак. Здесь реестр метрик процесса (без внешних
+зависимостей) и его выдача в текстовом формате Prometheus (представление /metrics):
+- aliya_request_seconds{view, method, status} — задержка запросов (MetricsMiddleware);
+- aliya_stage_seconds{stage} — задержка стадий (декоратор @timed): kb_index, retrieval,
+  context, extract_facts, generate_final_answer, fused_query, process_query;
+  ask_stream — генерация потокового ответа;
+- aliya_errors_total{stage, error} — исключения в стадиях по типам;
+- aliya_tokens_total{model, kind} — prompt/completion токены из response.usage
+  (record_usage; ответы из кэша токенов не тратят и не учитываются);
+- aliya_cache_total{cache, result} — попадания и промахи кэшей ответов
+  (снимаются со счётчиков answer_cache/semantic_cache в момент выдачи).
+
+Гистограммы — с фиксированными границами BUCKETS, как в Prometheus (le, _sum, _count).
+METRICS=0 отключает сбор (render() отдаёт только кэши).
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from .answer_cache import get_cache
+from .semantic_cache import get_semantic_cache
+
+ENABLED = os.getenv("METRICS", "1") != "0"
+PREFIX = "aliya_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "request_seconds": ("histogram", "Задержка HTTP-запросов по представлениям"),
+    "stage_seconds": ("histogram", "Задержка стадий пайплайна"),
+    "errors_total": ("counter", "Исключения в стадиях по типам"),
+    "tokens_total": ("counter", "Токены OpenAI (prompt/completion) из response.usage"),
+    "cache_total": ("counter", "Обращения к кэшам ответов по результату"),
+}
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """Счётчики по границам BUCKETS (не накопительные; накапливаются при выдаче), сумма и количество."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * (n_buckets + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}    # (имя, метки) → значение
+        self.histograms = {}  # (имя, метки) → Histogram
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, labels: dict = None, n: float = 1) -> None:
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name: str, value: float, labels: dict = None) -> None:
+        key = (name, _labels_key(labels))
+        slot = bisect_left(self.buckets, value)  # граница le включительно
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(len(self.buckets))
+            hist.counts[slot] += 1
+            hist.sum += value
+            hist.count += 1
+
+    def value(self, name: str, labels: dict = None) -> float:
+        with self.lock:
+            return self.counters.get((name, _labels_key(labels)), 0)
+
+    def total(self, name: str, **labels) -> float:
+        """Сумма счётчика name по всем меткам, совпадающим с labels (total("tokens_total", kind="prompt"))."""
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(v for (metric, key), v in self.counters.items() if metric == name and wanted <= set(key))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: (list(h.counts), h.sum, h.count) for k, h in self.histograms.items()}
+        return counters, histograms
+
+
+REGISTRY = Registry()
+
+
+# ----------- Запись -----------
+def observe(name: str, seconds: float, **labels) -> None:
+    if ENABLED:
+        REGISTRY.observe(name, seconds, labels)
+
+
+def inc(name: str, n: float = 1, **labels) -> None:
+    if ENABLED:
+        REGISTRY.inc(name, labels, n)
+
+
+def record_error(stage: str, exc: BaseException) -> None:
+    inc("errors_total", stage=stage, error=type(exc).__name__)
+
+
+def record_usage(response, model: str = None) -> None:
+    """Токены из ответа chat.completions (и последнего чанка потока с include_usage)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    model = model or getattr(response, "model", None) or "unknown"
+    inc("tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    inc("tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+
+def timed(stage: str):
+    """
+    Декоратор: время вызова → aliya_stage_seconds{stage}, исключение → aliya_errors_total.
+    Подходит и для обычных функций, и для корутин.
+    """
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except (Exception, asyncio.CancelledError) as e:
+                    record_error(stage, e)
+                    raise
+                finally:
+                    observe("stage_seconds", time.perf_counter() - started, stage=stage)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                record_error(stage, e)
+                raise
+            finally:
+                observe("stage_seconds", time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorate
+
+
+# ----------- Выдача (Prometheus text format 0.0.4) -----------
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def cache_counters() -> dict:
+    """Счётчики кэшей ответов: {(кэш, результат): значение}."""
+    counters = {}
+    cache = get_cache()
+    if cache is not None:
+        info = cache.info()
+        for result in ("memory_hits", "disk_hits", "misses", "stores", "evicted"):
+            counters[("exact", result)] = info.get(result, 0)
+    similar = get_semantic_cache()
+    if similar is not None:
+        info = similar.info()
+        for result in ("hits", "misses", "stores", "evicted"):
+            counters[("semantic", result)] = info.get(result, 0)
+    return counters
+
+
+def render(registry: Registry = REGISTRY) -> str:
+    counters, histograms = registry.snapshot()
+    for (cache, result), value in cache_counters().items():
+        counters[("cache_total", (("cache", cache), ("result", result)))] = value
+
+    lines = []
+    for name, (kind, text) in HELP.items():
+        lines.append(f"# HELP {PREFIX}{name} {text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+            continue
+        for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(registry.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
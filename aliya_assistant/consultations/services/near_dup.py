@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+near_dup.py — поиск почти одинаковых абзацев базы знаний (MinHash + LSH)
+
+Страницы kolzchut и gov.il повторяют одни и те же вводные абзацы и
+навигационные списки («На этом портале собрана информация...», «Содержание»),
+а cleaner.py убирает только дословные повторы строк. На фрагментах KB
+(kb_store) это ~40% абзацев: они раздувают индекс и попадают в контекст
+модели по нескольку раз.
+
+Как работает:
+1. абзац → множество шинглов (тройки терминов ranking.analyze, crc32);
+2. MinHash-подпись из NUM_PERM хэшей (a·x + b mod 2⁶¹−1, одним матричным
+   вычислением numpy на абзац);
+3. LSH: подпись режется на BANDS полос по ROWS значений, абзацы с совпавшей
+   полосой — кандидаты; пара подтверждается оценкой Жаккара ≥ threshold;
+4. подтверждённые пары собираются в кластеры (union-find), в каждом остаётся
+   первый абзац, остальные выбрасываются.
+
+Используется в kb_index.build_index (KB_DEDUP=0 отключает, порог —
+KB_DEDUP_THRESHOLD). Отчёт по кластерам:
+    python -m consultations.services.near_dup [--kb PATH] [--threshold 0.8]
+"""
+
+import argparse
+import os
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from .ranking import analyze
+
+ENABLED = os.getenv("KB_DEDUP", "1") != "0"
+THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", 0.8))
+NUM_PERM = 128
+BANDS, ROWS = 16, 8  # порог срабатывания LSH ≈ (1/BANDS)^(1/ROWS) ≈ 0.71, ниже THRESHOLD
+SHINGLE = 3
+SEED = 1
+
+MERSENNE = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingle_hashes(text: str, n: int = SHINGLE) -> np.ndarray:
+    terms = analyze(text)
+    if len(terms) < n:
+        grams = [" ".join(terms)] if terms else []
+    else:
+        grams = [" ".join(terms[i:i + n]) for i in range(len(terms) - n + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = SEED):
+        rng = np.random.default_rng(seed)
+        # a, b < 2³¹: a·x (x < 2³²) не переполняет uint64
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        if not len(hashes):
+            return np.full(len(self.a), MAX_HASH, dtype=np.uint64)
+        values = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE
+        return (values & MAX_HASH).min(axis=1)
+
+
+@dataclass
+class DedupResult:
+    keep: list                                     # номера оставленных абзацев, по порядку
+    clusters: list = field(default_factory=list)   # [[первый (оставлен), повтор, ...], ...] по убыванию размера
+
+    @property
+    def removed(self) -> int:
+        return sum(len(c) - 1 for c in self.clusters)
+
+    def size_histogram(self) -> dict:
+        """{размер кластера: сколько таких кластеров}."""
+        hist = defaultdict(int)
+        for c in self.clusters:
+            hist[len(c)] += 1
+        return dict(sorted(hist.items()))
+
+    def summary(self) -> dict:
+        return {
+            "removed": self.removed,
+            "clusters": len(self.clusters),
+            "largest": len(self.clusters[0]) if self.clusters else 0,
+            "sizes": self.size_histogram(),
+        }
+
+
+def find_duplicates(paragraphs, threshold: float = THRESHOLD, bands: int = BANDS, rows: int = ROWS) -> DedupResult:
+    hasher = MinHasher(bands * rows)
+    hashes = [shingle_hashes(p) for p in paragraphs]
+    sigs = np.stack([hasher.signature(h) for h in hashes]) if paragraphs else np.zeros((0, bands * rows), np.uint64)
+    empty = [not len(h) for h in hashes]  # без терминов — сравнивать не с чем, абзац остаётся
+
+    parent = list(range(len(paragraphs)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for pid, key in enumerate(map(bytes, sigs[:, band * rows:(band + 1) * rows])):
+            if not empty[pid]:
+                buckets[key].append(pid)
+        for members in buckets.values():
+            for i, first in enumerate(members):
+                for other in members[i + 1:]:
+                    ra, rb = find(first), find(other)
+                    if ra == rb or (first, other) in checked:
+                        continue
+                    checked.add((first, other))
+                    if np.mean(sigs[first] == sigs[other]) >= threshold:
+                        parent[max(ra, rb)] = min(ra, rb)  # корень — самый ранний абзац
+
+    groups = defaultdict(list)
+    for pid in range(len(paragraphs)):
+        groups[find(pid)].append(pid)
+    clusters = sorted((g for g in groups.values() if len(g) > 1), key=lambda g: (-len(g), g[0]))
+    keep = sorted(g[0] for g in groups.values())
+    return DedupResult(keep, clusters)
+
+
+def dedup(paragraphs, urls, threshold: float = THRESHOLD):
+    """(абзацы, urls, DedupResult) без почти-повторов; остаётся первый абзац кластера."""
+    result = find_duplicates(paragraphs, threshold)
+    return [paragraphs[i] for i in result.keep], [urls[i] for i in result.keep], result
+
+
+if __name__ == "__main__":
+    from .kb_index import read_paragraphs
+
+    default_kb = os.getenv("KB_PATH") or next(
+        (p for p in ("knowledge_base_aliyah_full.sqlite3", "knowledge_base_aliyah_full.txt") if os.path.exists(p)),
+        "knowledge_base_aliyah_full.txt",
+    )
+    parser = argparse.ArgumentParser(description="Кластеры почти одинаковых абзацев KB")
+    parser.add_argument("--kb", default=default_kb)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--top", type=int, default=10, help="сколько крупнейших кластеров показать")
+    args = parser.parse_args()
+
+    paragraphs, urls = read_paragraphs(args.kb)
+    result = find_duplicates(paragraphs, args.threshold)
+    chars_before = sum(map(len, paragraphs))
+    chars_after = sum(len(paragraphs[i]) for i in result.keep)
+    print(f"📚 {args.kb}: {len(paragraphs)} абзацев → {len(result.keep)} "
+          f"(убрано {result.removed} в {len(result.clusters)} кластерах, порог {args.threshold})")
+    print(f"📉 Объём: {chars_before} → {chars_after} символов ({(1 - chars_after / max(chars_before, 1)) * 100:.1f}% меньше)")
+    print("📊 Размеры кластеров: " + ", ".join(f"{size}×{n}" for size, n in result.size_histogram().items()))
+    for cluster in result.clusters[:args.top]:
+        head = paragraphs[cluster[0]].replace("\n", " ")[:90]
+        sources = len({urls[i] for i in cluster})
+        print(f"  {len(cluster):>3} абзацев, {sources} источников: {head}…")
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+openai_clients.py — общие клиенты OpenAI на процесс
+
+Раньше extract_facts(), generate_final_answer() и ask_question() создавали
+openai.OpenAI() на каждый вызов: новый пул соединений httpx, новое TLS-рукопожатие
+и разбор окружения на каждый запрос. Здесь по одному синхронному и асинхронному
+клиенту на процесс, поверх настроенного httpx:
+- лимиты пула и keep-alive (OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE,
+  OPENAI_KEEPALIVE_EXPIRY);
+- таймауты (OPENAI_TIMEOUT, OPENAI_CONNECT_TIMEOUT) и повторы (OPENAI_MAX_RETRIES);
+- HTTP/2, если установлен пакет h2 (OPENAI_HTTP2=0 отключает).
+
+OPENAI_STUB=1 подменяет сеть локальной заглушкой (httpx.MockTransport): модель
+«отвечает» эхом вопроса через OPENAI_STUB_LATENCY секунд, в том числе потоком
+(stream=True). Так весь пайплайн можно гонять под нагрузкой без сети и ключа.
+
+Асинхронный клиент привязан к циклу событий. Под ASGI цикл один на процесс и
+клиент общий; под WSGI у каждого асинхронного запроса свой цикл, который
+закрывается вместе с запросом, — там async_client(shared=False) даёт клиента
+на запрос и закрывает его на выходе из async with.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 10))
+KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 30))
+STUB = os.getenv("OPENAI_STUB", "0") == "1"
+STUB_LATENCY = float(os.getenv("OPENAI_STUB_LATENCY", 0.2))
+
+try:
+    import h2  # noqa: F401 — нужен httpx для HTTP/2
+    HTTP2 = os.getenv("OPENAI_HTTP2", "1") != "0"
+except ImportError:
+    HTTP2 = False
+
+
+# ----------- Заглушка -----------
+def stub_reply(payload: dict) -> str:
+    question = next((m["content"] for m in reversed(payload.get("messages", [])) if m["role"] == "user"), "")
+    return f"[заглушка {payload.get('model')}] {question[:200]}"
+
+
+def stub_response(request: httpx.Request) -> httpx.Response:
+    """Ответ в формате chat.completions: целиком или SSE-потоком."""
+    payload = json.loads(request.content or b"{}")
+    text = stub_reply(payload)
+    if (payload.get("response_format") or {}).get("type") == "json_object":
+        # «fused»-режим пайплайна ждёт JSON; заглушка кладёт эхо во все ожидаемые поля
+        text = json.dumps({k: text for k in ("facts", "answer", "explanation", "final")}, ensure_ascii=False)
+    completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 4
+    completion_tokens = len(text) // 4
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+             "total_tokens": prompt_tokens + completion_tokens}
+
+    if payload.get("stream"):
+        frames = []
+        for word in text.split(" "):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            frames.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            tail = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": payload.get("model"), "choices": [], "usage": usage}
+            frames.append(f"data: {json.dumps(tail)}\n\n")
+        frames.append("data: [DONE]\n\n")
+        return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                              content="".join(frames).encode("utf-8"))
+
+    return httpx.Response(200, json={
+        "id": completion_id, "object": "chat.completion", "created": created,
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": usage,
+    })
+
+
+def stub_transport(latency: float = None) -> httpx.MockTransport:
+    latency = STUB_LATENCY if latency is None else latency  # читается при создании клиента (бенчмарк меняет)
+
+    def handler(request):
+        time.sleep(latency)
+        return stub_response(request)
+    return httpx.MockTransport(handler)
+
+
+def async_stub_transport(latency: float = None) -> httpx.MockTransport:
+    latency = STUB_LATENCY if latency is None else latency
+
+    async def handler(request):
+        await asyncio.sleep(latency)
+        await request.aread()
+        return stub_response(request)
+    return httpx.MockTransport(handler)
+
+
+# ----------- Клиенты -----------
+def http_options() -> dict:
+    return {
+        "timeout": httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+        "limits": httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE,
+                               keepalive_expiry=KEEPALIVE_EXPIRY),
+    }
+
+
+def client_options() -> dict:
+    options = {"max_retries": MAX_RETRIES, "timeout": httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT)}
+    if STUB:
+        options["api_key"] = os.getenv("OPENAI_API_KEY") or "stub"
+    return options
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client() -> openai.OpenAI:
+    """Синхронный клиент процесса (пул соединений переиспользуется между запросами)."""
+    with _lock:
+        if "sync" not in _clients:
+            if STUB:
+                http_client = httpx.Client(transport=stub_transport(), **http_options())
+            else:
+                http_client = httpx.Client(http2=HTTP2, **http_options())
+            _clients["sync"] = openai.OpenAI(http_client=http_client, **client_options())
+        return _clients["sync"]
+
+
+def new_async_client() -> openai.AsyncOpenAI:
+    if STUB:
+        http_client = httpx.AsyncClient(transport=async_stub_transport(), **http_options())
+    else:
+        http_client = httpx.AsyncClient(http2=HTTP2, **http_options())
+    return openai.AsyncOpenAI(http_client=http_client, **client_options())
+
+
+def close_on_loop(loop, client: openai.AsyncOpenAI) -> None:
+    """
+    Закрывает асинхронный клиент в его собственном цикле: работающем в другом
+    потоке — через run_coroutine_threadsafe, остановленном — run_until_complete.
+    Соединения уже закрытого цикла закрыть нельзя — поэтому под WSGI клиент на запрос.
+    """
+    if loop.is_closed():
+        logger.warning("Асинхронный клиент OpenAI остался от закрытого цикла событий и не закрыт")
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.close(), loop)
+    else:
+        loop.run_until_complete(client.close())
+
+
+def get_async_client() -> openai.AsyncOpenAI:
+    """
+    Общий асинхронный клиент. httpx.AsyncClient привязан к циклу событий, поэтому
+    клиент свой у каждого цикла (под ASGI цикл один на процесс); клиент прежнего
+    цикла при смене закрывается (close_on_loop).
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entry = _clients.get("async")
+        stale = entry if entry is not None and entry[0] is not loop else None
+        if entry is None or stale is not None:
+            entry = (loop, new_async_client())
+            _clients["async"] = entry
+    if stale is not None:
+        close_on_loop(*stale)
+    return entry[1]
+
+
+@asynccontextmanager
+async def async_client(shared: bool = True):
+    """
+    async with async_client(shared) as client: ...
+    shared=True — общий клиент цикла (ASGI); False — клиент на один запрос,
+    закрывается на выходе (WSGI, где цикл живёт не дольше запроса).
+    """
+    if shared:
+        yield get_async_client()
+        return
+    client = new_async_client()
+    try:
+        yield client
+    finally:
+        await client.close()
+
+
+def reset_clients() -> None:
+    """Закрывает синхронный клиент и забывает оба (после смены настроек)."""
+    with _lock:
+        client = _clients.pop("sync", None)
+        stale = _clients.pop("async", None)
+    if client is not None:
+        client.close()
+    if stale is not None:
+        close_on_loop(*stale)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py — оркестратор ролей нейросотрудника
+
+Роли описываются графом зависимостей (Stage.deps). run_graph() запускает
+каждую стадию, как только готовы её зависимости: независимые стадии идут
+одновременно (asyncio), а синхронные вызовы модели выполняются в потоках
+поверх общего клиента (openai_clients.get_client). Уже посчитанные результаты
+передаются в known и не пересчитываются. Время каждой стадии попадает в
+PipelineResult.timings.
+
+Режим «fused» (PIPELINE_MODE=fused) заменяет цепочку одним вызовом модели,
+который возвращает JSON сразу с фактами и ответом, — вдвое меньше
+обращений к API ценой более длинного промпта.
+
+Используется в manager.process_query, consultations/tests.py и терминальном
+клиенте (vs_on_terminal2).
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from .gpt_analyst import extract_facts
+from .gpt_communicator import generate_final_answer
+from . import gpt_analyst, gpt_communicator
+from .openai_clients import get_client
+from .metrics import record_usage, timed
+
+logger = logging.getLogger(__name__)
+
+MODE = os.getenv("PIPELINE_MODE", "graph")  # graph | fused
+MAX_PARALLEL = int(os.getenv("PIPELINE_MAX_PARALLEL", 8))  # одновременных вопросов в run_many
+
+
+@dataclass
+class Stage:
+    name: str
+    run: object  # run(outputs) -> str; функция или корутина
+    deps: tuple = ()
+    skip_if_empty: bool = True  # пустой результат зависимости — стадия не вызывает модель
+
+
+@dataclass
+class PipelineResult:
+    outputs: dict
+    timings: dict = field(default_factory=dict)  # стадия → секунды (только реально выполненные)
+    total: float = 0.0
+    mode: str = "graph"
+
+    def report(self) -> str:
+        stages = ", ".join(f"{name} {sec:.2f} с" for name, sec in self.timings.items())
+        return f"⏱ {self.mode}: {stages or 'всё из готовых результатов'} — всего {self.total:.2f} с"
+
+
+# ----------- Граф -----------
+def check_graph(stages) -> None:
+    names = {s.name for s in stages}
+    for s in stages:
+        missing = [d for d in s.deps if d not in names]
+        if missing:
+            raise ValueError(f"Стадия {s.name}: неизвестные зависимости {missing}")
+
+
+async def run_graph(stages, known: dict = None, mode: str = "graph") -> PipelineResult:
+    """
+    Выполняет стадии по зависимостям. known — готовые результаты (вход пайплайна
+    и уже посчитанные стадии); такие стадии не запускаются.
+    """
+    check_graph(stages)
+    outputs = dict(known or {})
+    timings = {}
+    tasks = {}
+    started = time.perf_counter()
+
+    async def execute(stage: Stage):
+        for dep in stage.deps:
+            await tasks[dep]
+        if stage.skip_if_empty and any(not outputs.get(dep) for dep in stage.deps):
+            outputs[stage.name] = ""
+            return
+        t0 = time.perf_counter()
+        if inspect.iscoroutinefunction(stage.run):
+            result = await stage.run(outputs)
+        else:
+            result = await asyncio.to_thread(stage.run, outputs)
+        timings[stage.name] = time.perf_counter() - t0
+        outputs[stage.name] = result
+
+    async def done():
+        return None
+
+    for stage in stages:
+        if stage.name in outputs:
+            tasks[stage.name] = asyncio.ensure_future(done())
+    for stage in stages:
+        if stage.name not in tasks:
+            tasks[stage.name] = asyncio.ensure_future(execute(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+    return PipelineResult(outputs, timings, time.perf_counter() - started, mode)
+
+
+def run_sync(coro):
+    """
+    Запуск из синхронного кода (Django-представление, CLI). Если в этом потоке
+    уже идёт цикл событий (асинхронное представление, ASGI), asyncio.run упал бы
+    с RuntimeError — тогда корутина выполняется в отдельном потоке со своим циклом.
+    Асинхронному коду лучше сразу await run_query_async / run_graph.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+# ----------- Пайплайн process_query -----------
+QUERY_STAGES = [
+    Stage("facts", lambda o: extract_facts(o["question"])),
+    Stage("answer", lambda o: generate_final_answer(o["facts"]), deps=("facts",)),
+]
+
+FUSED_PROMPT = (
+    gpt_analyst.SYSTEM_PROMPT + "\n" + gpt_communicator.SYSTEM_PROMPT + "\n"
+    "Сделай оба шага за один ответ и верни JSON-объект с ключами "
+    "\"facts\" (краткий список фактов) и \"answer\" (ответ для репатрианта)."
+)
+
+
+def as_text(value) -> str:
+    """Поле JSON-ответа модели строкой: список (факты «списком») — строками «- пункт»."""
+    if isinstance(value, list):
+        return "\n".join(f"- {item}" for item in value)
+    return str(value or "").strip()
+
+
+def fused_fields(text: str, fallback: str) -> dict:
+    """
+    «fused»-ответ модели → {ключ: строка} (as_text). Если это не JSON-объект
+    (не JSON, список, строка) — весь текст кладётся в поле fallback.
+    Общая разборка для fused_query и терминального клиента (vs_on_terminal2.run_roles).
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        logger.warning("fused: модель вернула не JSON-объект, используем текст как %s", fallback)
+        return {fallback: text.strip()}
+    return {key: as_text(value) for key, value in data.items()}
+
+
+@timed("fused_query")
+def fused_query(question: str) -> dict:
+    """Один вызов модели вместо двух: факты и ответ в одном JSON."""
+    response = get_client().chat.completions.create(
+        model=gpt_communicator.MODEL,
+        messages=[
+            {"role": "system", "content": FUSED_PROMPT},
+            {"role": "user", "content": question},
+        ],
+        temperature=0.0,
+        response_format={"type": "json_object"},
+    )
+    record_usage(response, gpt_communicator.MODEL)
+    data = fused_fields(response.choices[0].message.content or "", fallback="answer")
+    return {"facts": data.get("facts", ""), "answer": data.get("answer", "")}
+
+
+async def run_query_async(question: str, mode: str = None, known: dict = None) -> PipelineResult:
+    mode = mode or MODE
+    if mode == "fused" and not (known or {}).get("answer"):
+        started = time.perf_counter()
+        outputs = await asyncio.to_thread(fused_query, question)
+        elapsed = time.perf_counter() - started
+        return PipelineResult({"question": question, **outputs}, {"fused": elapsed}, elapsed, mode)
+    return await run_graph(QUERY_STAGES, {"question": question, **(known or {})})
+
+
+def run_query(question: str, mode: str = None, known: dict = None) -> PipelineResult:
+    """Факты и ответ на вопрос; known — уже посчитанные стадии (например, {"facts": ...})."""
+    return run_sync(run_query_async(question, mode, known))
+
+
+async def run_many(questions, mode: str = None, limit: int = MAX_PARALLEL):
+    """Несколько вопросов одновременно (не больше limit в работе)."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def one(question):
+        async with semaphore:
+            return await run_query_async(question, mode)
+
+    return await asyncio.gather(*(one(q) for q in questions))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+ranking.py — анализ текста и ранжирование абзацев базы знаний
+
+💡 Что здесь:
+1. analyze() — токенизация, стоп-слова и лёгкий суффиксный стемминг (ru/he/en),
+   чтобы «репатрианту» и «репатриант» давали один термин
+2. Ранжировщики поверх матрицы терминов индекса (kb_index.KBIndex):
+   - "overlap" — прежний подсчёт совпавших токенов
+   - "bm25"    — BM25 с нормализацией по длине абзаца (k1/b настраиваются)
+
+Ранжировщик выбирается через get_ranker() или переменную окружения KB_RANKER.
+"""
+
+import os
+import re
+
+import numpy as np
+
+MIN_TERM_LEN = 3  # токены короче 3 символов не индексируются
+MIN_STEM_LEN = 4  # короче этого основа не обрезается
+
+TOKEN_RE = re.compile(r"[A-Za-zА-Яа-яЁёא-ת0-9\-']+")
+HEBREW_RE = re.compile(r"[א-ת]")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по
+только ее её мне было вот от меня еще ещё нет о из ему теперь когда даже ну вдруг ли
+если уже или ни быть был него до вас нибудь опять уж вам ведь там потом себя
+ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой
+совсем ним здесь этом один почти мой тем чтобы нее неё сейчас были куда зачем
+всех никогда можно при наконец два об другой хоть после над больше тот через
+эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой
+перед иногда лучше чуть том нельзя такой им более всегда конечно всю между
+это также который которые которых которая которой которого является либо
+the a an and or of to in on for with by is are was were be been this that these
+those it its as at from not no yes can will your you we our their them
+של את על עם אל זה זו הוא היא הם הן לא כי או גם אם יש אין כל מה אני אתה
+""".split())
+
+RU_SUFFIXES = sorted("""
+иями ями ами иях ях ах ией ей ой ий ый ого его ому ему ыми ими ую юю ая яя ое ее
+ие ые ом ем ам ям ов ев ью ия ию ии ться тся ется ются ает яет ить ать ять еть
+ешь ишь ует уют ют ут ат ят ит ет ала ило или ла ли ло а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+HE_PREFIXES = "ובלמהשכ"
+HE_SUFFIXES = ("יות", "ים", "ות")
+EN_SUFFIXES = ("ing", "ies", "ed", "es", "s")
+
+
+# ----------- Анализ текста -----------
+def stem(token: str) -> str:
+    """Лёгкий суффиксный стеммер: одно окончание с конца, основа не короче MIN_STEM_LEN."""
+    if CYRILLIC_RE.search(token):
+        for suf in RU_SUFFIXES:
+            if token.endswith(suf) and len(token) - len(suf) >= MIN_STEM_LEN:
+                return token[:-len(suf)]
+        return token
+    if HEBREW_RE.search(token):
+        if token[0] in HE_PREFIXES and len(token) - 1 >= MIN_STEM_LEN:
+            token = token[1:]
+        for suf in HE_SUFFIXES:
+            if token.endswith(suf) and len(token) - len(suf) >= MIN_TERM_LEN:
+                return token[:-len(suf)]
+        return token
+    for suf in EN_SUFFIXES:
+        if token.endswith(suf) and len(token) - len(suf) >= MIN_STEM_LEN:
+            return token[:-len(suf)]
+    return token
+
+
+def analyze(text: str):
+    """Текст → список терминов индекса (нижний регистр, без стоп-слов, со стеммингом)."""
+    terms = []
+    for t in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        t = t.strip("-'")
+        if len(t) >= MIN_TERM_LEN and t not in STOPWORDS:
+            terms.append(stem(t))
+    return terms
+
+
+# ----------- Ранжировщики -----------
+class OverlapRanker:
+    """Прежний алгоритм retrieve(): сумма вхождений терминов вопроса в абзац."""
+
+    name = "overlap"
+
+    def score(self, index, terms) -> np.ndarray:
+        scores = np.zeros(index.n_docs, dtype=np.float32)
+        for t in set(terms):
+            sl = index.postings_slice(t)
+            if sl is not None:
+                scores[index.doc_ids[sl]] += index.tfs[sl]
+        return scores
+
+
+class BM25Ranker:
+    """
+    Okapi BM25. Веса всех постингов считаются один раз на индекс,
+    запрос — это сумма срезов по терминам вопроса (без циклов по абзацам).
+    """
+
+    name = "bm25"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def weights(self, index) -> np.ndarray:
+        key = (self.name, self.k1, self.b)
+        w = index.cache.get(key)
+        if w is None:
+            df = np.diff(index.indptr).astype(np.float32)
+            idf = np.log1p((index.n_docs - df + 0.5) / (df + 0.5))
+            dl = index.doc_len[index.doc_ids]
+            avgdl = float(index.doc_len.mean()) if index.n_docs else 1.0
+            tf = index.tfs
+            norm = self.k1 * (1.0 - self.b + self.b * dl / max(avgdl, 1.0))
+            w = (np.repeat(idf, np.diff(index.indptr)) * tf * (self.k1 + 1.0) / (tf + norm))
+            w = w.astype(np.float32)
+            index.cache[key] = w
+        return w
+
+    def score(self, index, terms) -> np.ndarray:
+        w = self.weights(index)
+        scores = np.zeros(index.n_docs, dtype=np.float32)
+        for t in set(terms):
+            sl = index.postings_slice(t)
+            if sl is not None:
+                scores[index.doc_ids[sl]] += w[sl]
+        return scores
+
+
+RANKERS = {
+    "overlap": OverlapRanker,
+    "bm25": BM25Ranker,
+}
+
+
+def get_ranker(name: str = None):
+    """Ранжировщик по имени; по умолчанию KB_RANKER (bm25) с BM25_K1 / BM25_B из окружения."""
+    name = (name or os.getenv("KB_RANKER", "bm25")).lower()
+    if name not in RANKERS:
+        raise ValueError(f"Неизвестный ранжировщик: {name} (доступны: {', '.join(RANKERS)})")
+    if name == "bm25":
+        return BM25Ranker(k1=float(os.getenv("BM25_K1", 1.2)), b=float(os.getenv("BM25_B", 0.75)))
+    return RANKERS[name]()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+retrieval_eval.py — качество и скорость поиска по базе знаний
+
+Ускорение поиска ничего не стоит, если он начинает находить не то. Здесь
+набор пар «вопрос → ожидаемый url источника» и прогон любых ретриверов по
+нему с отчётом бок о бок:
+- recall@k — доля вопросов, у которых среди k лучших абзацев есть абзац
+  с ожидаемым url (url абзаца — KBIndex.urls, из заголовков «Ссылка:»);
+- MRR — средний 1/ранг первого такого абзаца (в пределах max k);
+- контекст — средний объём k лучших абзацев в токенах (оценка по
+  context_builder.CHARS_PER_TOKEN), то есть сколько уйдёт в модель;
+- задержка поиска — среднее и p95, мс.
+
+Набор по умолчанию строится из самой KB: вопрос — «Название:» страницы,
+ответ — её «Ссылка:». Это синтетика (заголовок может совпадать с текстом
+страницы или навигацией других страниц), годная для сравнения ретриверов
+между собой; живые пары задаются файлом --pairs
+([{"question": "...", "urls": ["https://..."]}, ...]).
+
+Ретривер — функция (index, question, k) → номера абзацев по убыванию
+релевантности. Встроенные — все ранжировщики ranking.RANKERS; новый
+добавляется через register_retriever().
+
+    python -m consultations.services.retrieval_eval [--kb PATH] [--pairs FILE] [--json OUT]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import unquote
+
+from popitka2 import iter_documents
+
+from .context_builder import CHARS_PER_TOKEN
+from .kb_index import KB_DB_SUFFIXES, get_index, read_kb
+from .ranking import RANKERS, get_ranker
+
+KS = (1, 3, 5, 10)
+HEADER_RE = re.compile(r"^Название: (.*)\nСсылка: (\S+)", re.M)
+
+
+@dataclass
+class EvalPair:
+    question: str
+    urls: tuple  # любой из url считается попаданием
+
+
+def normalize_url(url: str) -> str:
+    """В KB встречаются и %-кодированные, и «читаемые» url одной страницы."""
+    return unquote(url or "").strip().rstrip("/")
+
+
+# ----------- Набор вопросов -----------
+def pairs_from_kb(kb_path: str):
+    """Пары «Название → Ссылка» из заголовков KB (плоский файл или SQLite-база)."""
+    if Path(kb_path).suffix in KB_DB_SUFFIXES:
+        found = [(head["title"], head["doc_url"]) for head, _ in iter_documents(kb_path)]
+    else:
+        found = HEADER_RE.findall(read_kb(kb_path))
+    pairs, seen = [], set()
+    for title, url in found:
+        title = title.strip()
+        if len(title) < 3 or title in seen:
+            continue
+        seen.add(title)
+        pairs.append(EvalPair(title, (url,)))
+    return pairs
+
+
+def load_pairs(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return [EvalPair(item["question"], tuple(item.get("urls") or [item["url"]])) for item in data]
+
+
+# ----------- Ретриверы -----------
+RETRIEVERS = {}
+
+
+def register_retriever(name: str, retrieve) -> None:
+    """retrieve(index, question, k) -> [номер абзаца, ...] по убыванию релевантности."""
+    RETRIEVERS[name] = retrieve
+
+
+def ranker_retriever(name: str):
+    ranker = get_ranker(name)
+    return lambda index, question, k: [pid for _, pid in index.search(question, k, ranker)]
+
+
+for _name in RANKERS:
+    register_retriever(_name, ranker_retriever(_name))
+
+
+# ----------- Оценка -----------
+def evaluate(index, pairs, retrieve, ks=KS) -> dict:
+    max_k = max(ks)
+    hits = {k: 0 for k in ks}
+    reciprocal, context_tokens, latencies = [], [], []
+    for pair in pairs:
+        expected = {normalize_url(u) for u in pair.urls}
+        started = time.perf_counter()
+        pids = retrieve(index, pair.question, max_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        rank = next((i for i, pid in enumerate(pids, 1) if normalize_url(index.urls[pid]) in expected), None)
+        for k in ks:
+            hits[k] += rank is not None and rank <= k
+        reciprocal.append(1.0 / rank if rank else 0.0)
+        context_tokens.append(sum(len(index.paragraphs[pid]) for pid in pids) / CHARS_PER_TOKEN)
+
+    n = len(pairs) or 1
+    latencies.sort()
+    return {
+        **{f"recall@{k}": round(hits[k] / n, 3) for k in ks},
+        "mrr": round(sum(reciprocal) / n, 3),
+        f"ctx_tokens@{max_k}": round(statistics.fmean(context_tokens), 1) if context_tokens else 0.0,
+        "latency_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else 0.0,
+    }
+
+
+def compare(index, pairs, names=None, ks=KS) -> dict:
+    """{ретривер: метрики} для всех (или выбранных) ретриверов на одном наборе."""
+    names = names or list(RETRIEVERS)
+    unknown = [n for n in names if n not in RETRIEVERS]
+    if unknown:
+        raise ValueError(f"Неизвестные ретриверы: {unknown} (доступны: {', '.join(RETRIEVERS)})")
+    return {name: evaluate(index, pairs, RETRIEVERS[name], ks) for name in names}
+
+
+def print_table(results: dict) -> None:
+    columns = list(next(iter(results.values())).keys())
+    print(f"{'ретривер':<12}" + "".join(f"{c:>14}" for c in columns))
+    for name, row in results.items():
+        print(f"{name:<12}" + "".join(f"{row[c]:>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    default_kb = os.getenv("KB_PATH") or next(
+        (p for p in ("knowledge_base_aliyah_full.sqlite3", "knowledge_base_aliyah_full.txt") if os.path.exists(p)),
+        "knowledge_base_aliyah_full.txt",
+    )
+    parser = argparse.ArgumentParser(description="recall@k, MRR, объём контекста и задержка ретриверов KB")
+    parser.add_argument("--kb", default=default_kb)
+    parser.add_argument("--pairs", default=None, help="JSON с парами вопрос → urls (по умолчанию — из заголовков KB)")
+    parser.add_argument("--retrievers", default=None, help=f"через запятую (доступны: {', '.join(RETRIEVERS)})")
+    parser.add_argument("--json", default=None, help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    index = get_index(args.kb)
+    pairs = load_pairs(args.pairs) if args.pairs else pairs_from_kb(args.kb)
+    if not pairs:
+        raise SystemExit(f"Нет пар вопрос → url для {args.kb}")
+    print(f"📚 {args.kb}: {index.n_docs} абзацев, {len(pairs)} вопросов"
+          f"{'' if args.pairs else ' (синтетика: заголовки страниц)'}")
+    names = args.retrievers.split(",") if args.retrievers else None
+    results = compare(index, pairs, names)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"kb": args.kb, "pairs": len(pairs), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 {args.json}")
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+semantic_cache.py — кэш ответов для перефразированных вопросов
+
+Точный кэш (answer_cache.py) не узнаёт перефразировки: «как получить корзину
+абсорбции» и «корзина абсорбции — как оформить» дают разные ключи. Здесь
+вопрос превращается в вектор без внешней модели — хэшированные признаки
+основ слов (ranking.analyze) и их символьных триграмм, нормированные по L2, —
+а ближайший сохранённый вопрос ищется одним умножением матрицы NumPy.
+Если косинусная близость не ниже SEMANTIC_CACHE_THRESHOLD и у вопросов
+совпадают решающие слова (key_terms: числа, в том числе словами, имена
+собственные и отрицания/модальность — «можно»/«нельзя», «не»), возвращается
+сохранённый ответ. Без этой проверки длинные вопросы, отличающиеся одним
+фактом («…в 2024» / «…в 2025», «в Хайфе» / «в Эйлате»), близки на 0.92–1.0.
+
+Кэш живёт в памяти процесса: SEMANTIC_CACHE_SIZE записей, при переполнении
+вытесняется давно не использованная. Вопросы с разной моделью/промптом/версией
+KB (namespace) друг другу не отвечают. SEMANTIC_CACHE=0 отключает кэш.
+
+Запуск файлом — замер доли попаданий на вопросах из report.txt:
+    python -m consultations.services.semantic_cache [report.txt]
+"""
+
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from .answer_cache import normalize_question
+from .ranking import analyze
+
+ENABLED = os.getenv("SEMANTIC_CACHE", "1") != "0"
+CAPACITY = int(os.getenv("SEMANTIC_CACHE_SIZE", 1024))
+THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.85))  # см. замер в __main__
+DIM = 4096  # размер хэшированного пространства признаков
+NGRAM = 3
+NGRAM_WEIGHT = 0.5  # триграммы ловят другие словоформы, основы — сами слова
+
+# вежливые вставки не меняют смысла вопроса; синонимы сводятся к одной основе
+FILLER_STEMS = set(analyze("подскажите скажите пожалуйста хочу узнать привет здравствуйте спасибо"))
+SYNONYMS = {
+    analyze(word)[0]: analyze(canonical)[0]
+    for word, canonical in [("оформить", "получить"), ("оформление", "получение"),
+                            ("выдача", "получение"), ("положены", "полагается")]
+}
+
+# Решающие слова: analyze() выбрасывает их как стоп-слова, но они меняют ответ
+POLARITY_WORDS = frozenset("не нет нельзя ни без можно".split())
+NUMBER_WORDS = {
+    form: str(value)
+    for value, forms in enumerate([
+        "ноль нуля",
+        "один одна одно одного одной одному одним одном",
+        "два две двух двум двумя",
+        "три трех трем тремя",
+        "четыре четырех четырем четырьмя",
+        "пять пяти пятью",
+        "шесть шести шестью",
+        "семь семи семью",
+        "восемь восьми восемью",
+        "девять девяти девятью",
+        "десять десяти десятью",
+    ])
+    for form in forms.split()
+}
+WORD_RE = re.compile(r"\w+")
+NUMBER_RE = re.compile(r"^\d+$")
+
+
+# ----------- Векторы -----------
+def key_terms(text: str) -> frozenset:
+    """
+    Слова, которые должны совпасть у вопроса и найденного в кэше: числа (цифрами
+    и словами), отрицания/модальность и основы имён собственных (слово с заглавной
+    буквы не в начале вопроса: «в Хайфе», «через Misrad HaPnim»).
+    """
+    terms = set()
+    for i, word in enumerate(WORD_RE.findall(text or "")):
+        low = word.lower().replace("ё", "е")
+        if NUMBER_RE.match(low):
+            terms.add(low.lstrip("0") or "0")
+        elif low in NUMBER_WORDS:
+            terms.add(NUMBER_WORDS[low])
+        elif low in POLARITY_WORDS:
+            terms.add(low)
+        elif i > 0 and word[0].isupper():
+            terms.update("n:" + stem for stem in analyze(word))
+    return frozenset(terms)
+
+
+def features(text: str):
+    """Признаки вопроса: основы слов, символьные триграммы основ (с границами слова) и отрицания."""
+    feats = [("p:" + w, 1.0) for w in WORD_RE.findall(normalize_question(text)) if w in POLARITY_WORDS]
+    for stem in analyze(normalize_question(text)):
+        if stem in FILLER_STEMS:
+            continue
+        stem = SYNONYMS.get(stem, stem)
+        feats.append(("w:" + stem, 1.0))
+        padded = f"<{stem}>"
+        grams = [padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)]
+        for g in grams:
+            feats.append(("g:" + g, NGRAM_WEIGHT / len(grams) ** 0.5))
+    return feats
+
+
+def vectorize(text: str, dim: int = DIM) -> np.ndarray:
+    """L2-нормированный вектор; crc32 стабилен между процессами (в отличие от hash())."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for feat, weight in features(text):
+        h = zlib.crc32(feat.encode("utf-8"))
+        vec[h % dim] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+# ----------- Кэш -----------
+class SemanticCache:
+    def __init__(self, capacity: int = CAPACITY, threshold: float = THRESHOLD, dim: int = DIM):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dim = dim
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.used = np.zeros(capacity, dtype=np.int64)  # «время» последнего обращения, для LRU
+        self.entries = [None] * capacity  # (namespace, question, answer)
+        self.keys = [None] * capacity  # key_terms вопроса в каждой ячейке
+        self.spaces = np.full(capacity, -1, dtype=np.int64)  # номер namespace в каждой ячейке
+        self.space_ids = {}
+        self.size = 0
+        self.clock = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+
+    def lookup(self, question: str, namespace: str = ""):
+        """
+        (ответ, близость, исходный вопрос) ближайшего вопроса не ниже порога
+        с теми же key_terms, или None.
+        """
+        vec = vectorize(question, self.dim)
+        keys = key_terms(question)
+        with self.lock:
+            if self.size and vec.any():
+                sims = self.vectors[:self.size] @ vec
+                sims[self.spaces[:self.size] != self.space_ids.get(namespace, -2)] = -1.0
+                candidates = np.flatnonzero(sims >= self.threshold)
+                matching = [int(i) for i in candidates if self.keys[i] == keys]
+                if matching:
+                    best = max(matching, key=lambda i: sims[i])
+                    self.clock += 1
+                    self.used[best] = self.clock
+                    self.stats["hits"] += 1
+                    _, source, answer = self.entries[best]
+                    return answer, float(sims[best]), source
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, question: str, answer: str, namespace: str = "") -> None:
+        vec = vectorize(question, self.dim)
+        if not vec.any():
+            return  # одни стоп-слова — сравнивать не с чем
+        with self.lock:
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(np.argmin(self.used))
+                self.stats["evicted"] += 1
+            self.clock += 1
+            self.vectors[slot] = vec
+            self.spaces[slot] = self.space_ids.setdefault(namespace, len(self.space_ids))
+            self.used[slot] = self.clock
+            self.entries[slot] = (namespace, question, answer)
+            self.keys[slot] = key_terms(question)
+            self.stats["stores"] += 1
+
+    def info(self) -> dict:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                "size": self.size,
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+            }
+
+
+# ----------- Общий кэш процесса -----------
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Семантический кэш процесса; None, если он отключён (SEMANTIC_CACHE=0)."""
+    global _cache
+    if not ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache()
+        return _cache
+
+
+# ----------- Замер на report.txt -----------
+# Живые пары: перефразировки должны находиться, вопросы с другим решающим фактом — нет
+PARAPHRASE_PAIRS = [
+    ("как получить корзину абсорбции", "корзина абсорбции — как оформить"),
+    ("Сколько длится бесплатный ульпан для репатриантов?", "Сколько времени длится бесплатный ульпан для новых репатриантов?"),
+    ("Какие документы нужны для получения теудат зеута?", "Какие документы нужны, чтобы получить теудат зеут?"),
+    ("Положена ли репатрианту скидка на арнону?", "Полагается ли репатриантам скидка на арнону?"),
+    ("Как встать на учёт в больничную кассу после алии?", "Подскажите, как встать на учет в больничную кассу после алии"),
+    ("Можно ли получить помощь в оплате съёмной квартиры?", "Можно ли получить помощь с оплатой съемной квартиры?"),
+]
+DISTINCT_PAIRS = [
+    ("Какой размер корзины абсорбции для семьи с двумя детьми в 2024 году?",
+     "Какой размер корзины абсорбции для семьи с двумя детьми в 2025 году?"),
+    ("Какой размер корзины абсорбции для семьи с двумя детьми?",
+     "Какой размер корзины абсорбции для семьи с тремя детьми?"),
+    ("Где пройти бесплатный ульпан для репатриантов в Хайфе?",
+     "Где пройти бесплатный ульпан для репатриантов в Эйлате?"),
+    ("Можно ли получить корзину абсорбции после возвращения в Израиль?",
+     "Нельзя ли получить корзину абсорбции после возвращения в Израиль?"),
+    ("Положена ли скидка на арнону репатриантам старше 60 лет?",
+     "Положена ли скидка на арнону репатриантам старше 67 лет?"),
+    ("Можно ли работать во время учёбы в ульпане?",
+     "Можно ли не работать во время учёбы в ульпане?"),
+]
+PARAPHRASE_PREFIXES = ["", "подскажите, ", "скажите пожалуйста, ", "хочу узнать: "]
+
+
+def report_questions(path: str):
+    """Вопросы из report.txt (строка после «Вопрос:»), без повторов."""
+    questions, take = [], False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if take and line:
+                if line not in questions:
+                    questions.append(line)
+                take = False
+            elif line == "Вопрос:":
+                take = True
+    return questions
+
+
+def paraphrases(question: str):
+    """
+    Синтетические перефразировки: вежливые вставки, регистр, пунктуация,
+    перестановка слов. Это приближение к живым повторам, а не реальные логи.
+    """
+    base = question.rstrip("?!. ")
+    words = base.split()
+    variants = [p + base + "?" for p in PARAPHRASE_PREFIXES[1:]]
+    variants.append(base.upper())
+    if len(words) > 2:
+        variants.append(" ".join(words[1:] + words[:1]))
+        variants.append(" ".join(reversed(words)) + "?")
+    return variants
+
+
+def benchmark(path: str, thresholds=(0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95)) -> None:
+    import time
+
+    questions = report_questions(path)
+    if not questions:  # ниже вопросы перебираются по кругу (i % len(questions))
+        raise SystemExit(f"В {path} нет вопросов (строк после «Вопрос:») — замерять нечего")
+    print(f"📄 Вопросов в {path}: {len(questions)} (перефразировки синтетические); "
+          f"живых пар: {len(PARAPHRASE_PAIRS)} перефразировок, {len(DISTINCT_PAIRS)} разных вопросов")
+    print(f"{'порог':>6} {'попаданий':>10} {'ложных':>7} {'перефр.':>8} {'ложных пар':>11}")
+    for threshold in thresholds:
+        cache = SemanticCache(capacity=max(len(questions), 1), threshold=threshold)
+        for q in questions:
+            cache.store(q, q)
+        hits = wrong = total = 0
+        for q in questions:
+            for variant in paraphrases(q):
+                total += 1
+                found = cache.lookup(variant)
+                if found:
+                    hits += 1
+                    wrong += found[0] != q
+        # разные вопросы из отчёта не должны отвечать друг другу
+        for q in questions:
+            others = SemanticCache(capacity=len(questions), threshold=threshold)
+            for other in questions:
+                if other != q:
+                    others.store(other, other)
+            wrong += others.lookup(q) is not None
+        pair_hits = pair_wrong = 0
+        for pairs, should_hit in ((PARAPHRASE_PAIRS, True), (DISTINCT_PAIRS, False)):
+            for a, b in pairs:
+                for stored, asked in ((a, b), (b, a)):
+                    c = SemanticCache(capacity=1, threshold=threshold)
+                    c.store(stored, stored)
+                    found = c.lookup(asked) is not None
+                    if should_hit:
+                        pair_hits += found
+                    else:
+                        pair_wrong += found
+        print(f"{threshold:>6.2f} {hits:>4}/{total:<5} {wrong:>7} {pair_hits:>4}/{2 * len(PARAPHRASE_PAIRS):<3} "
+              f"{pair_wrong:>6}/{2 * len(DISTINCT_PAIRS)}")
+
+    cache = SemanticCache()
+    for i in range(cache.capacity):
+        cache.store(f"{questions[i % len(questions)]} {i}", "x")
+    start = time.perf_counter()
+    for q in questions * 20:
+        cache.lookup(q)
+    ms = (time.perf_counter() - start) * 1000 / (len(questions) * 20)
+    print(f"⏱ Поиск по {cache.capacity} записям: {ms:.2f} мс на вопрос")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "report.txt")
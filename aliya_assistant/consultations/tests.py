@@ -37,13 +37,11 @@ if PROJECT_ROOT not in sys.path:
 try:
     # Абсолютные импорты — работают и при запуске модулем, и файлом (после sys.path)
     from aliya_assistant.consultations.services.manager import process_query
-    from aliya_assistant.consultations.services.gpt_analyst import extract_facts
-    from aliya_assistant.consultations.services.gpt_communicator import generate_final_answer
+    from aliya_assistant.consultations.services.pipeline import run_query
 except Exception:
     # Резерв (если запущено строго как модуль и окружение уже пакетное)
     from .services.manager import process_query            # type: ignore
-    from .services.gpt_analyst import extract_facts        # type: ignore
-    from .services.gpt_communicator import generate_final_answer  # type: ignore
+    from .services.pipeline import run_query               # type: ignore
 # ---------------------------------------------------------------
 
 # Настройка логов, чтобы видеть предупреждения из manager.py и т.п.
@@ -87,25 +85,21 @@ def main() -> None:
             print("Выход.")
             break
 
-        # 1) GPT-Аналитик: сухие факты
+        # 1-2) GPT-Аналитик и GPT-Коммуникатор: один прогон пайплайна, без повторных вызовов
         try:
-            facts = extract_facts(question)
+            result = run_query(question)
+            facts, comm_answer = result.outputs["facts"], result.outputs["answer"]
         except Exception as e:
-            facts = ""
-            print_block("Ошибка в GPT-Аналитике", f"{e}")
+            result, facts, comm_answer = None, "", ""
+            print_block("Ошибка в пайплайне", f"{e}")
         print_block("GPT-Аналитик: извлечённые факты", facts or "")
-
-        # 2) GPT-Коммуникатор: понятный ответ из фактов
-        try:
-            comm_answer = generate_final_answer(facts or question)
-        except Exception as e:
-            comm_answer = ""
-            print_block("Ошибка в GPT-Коммуникаторе", f"{e}")
         print_block("GPT-Коммуникатор: понятный ответ", comm_answer or "")
+        if result is not None:
+            print(result.report())
 
-        # 3) Менеджер: сквозной пайплайн
+        # 3) Менеджер: сквозной пайплайн (кэш, обработка ошибок API) с готовыми результатами
         try:
-            manager_answer = process_query(question)
+            manager_answer = process_query(question, known=result.outputs if result else None)
         except Exception as e:
             manager_answer = ""
             print_block("Ошибка Менеджера (пайплайн)", f"{e}")
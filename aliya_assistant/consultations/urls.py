@@ -7,7 +7,10 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path("ask/", views.ask_question, name="ask"),
-    path('start-parser/', views.start_parser, name='start_parser'),
+    path("ask/stream/", views.ask_stream, name="ask_stream"),
     path("start-parser/", views.start_parser, name="start_parser"),
+    path("cancel-parser/", views.cancel_parser, name="cancel_parser"),
     path("parser-status/", views.parser_status_view, name="parser_status"),
+    path("answer-cache/", views.answer_cache_stats, name="answer_cache_stats"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
\ No newline at end of file
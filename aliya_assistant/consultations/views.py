@@ -1,77 +1,239 @@
 import openai
 import os
+import json
+import asyncio
+import logging
+import time
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
+from django.conf import settings
 from django.shortcuts import render
 import sys
 
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-import threading
-from popitka2.parser2 import crawl  # импорт функции из твоего парсера
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import threading
-from django.http import JsonResponse
-
-parser_status = {"running": False, "done": False}
-
-def crawl_wrapper():
-    from popitka2 import crawl  # или откуда у тебя парсер
-    parser_status["running"] = True
-    parser_status["done"] = False
-    try:
-        crawl()
-    finally:
-        parser_status["running"] = False
-        parser_status["done"] = True
+from .models import CrawlJob
 
 
+# ----------- Парсер: очередь заданий (выполняет `python manage.py crawl_worker`) -----------
 @csrf_exempt
 def start_parser(request):
     if request.method == "POST":
-        if parser_status["running"]:
-            return JsonResponse({"status": "already_running"})
-        thread = threading.Thread(target=crawl_wrapper)
-        thread.start()
-        return JsonResponse({"status": "started"})
+        job, created = CrawlJob.enqueue(full=request.POST.get("full") == "1")
+        if not created:
+            return JsonResponse({"status": "already_running", "job": job.pk})
+        return JsonResponse({"status": "queued", "job": job.pk})
     return JsonResponse({"error": "Invalid method"}, status=405)
 
 
-def parser_status_view(request):
-    return JsonResponse(parser_status)
-
-
-
 @csrf_exempt
-def start_parser(request):
+def cancel_parser(request):
     if request.method == "POST":
-        thread = threading.Thread(target=crawl)
-        thread.start()
-        return JsonResponse({"status": "started"})
+        job = CrawlJob.objects.filter(status__in=CrawlJob.ACTIVE).first()
+        if job is None:
+            return JsonResponse({"status": "not_running"})
+        job.request_cancel()
+        return JsonResponse({"status": "cancel_requested", "job": job.pk})
     return JsonResponse({"error": "Invalid method"}, status=405)
 
+
+PARSER_STATUS_IDLE = {"status": None, "running": False, "done": False}
+PARSER_STREAM_INTERVAL = 1.0  # секунды между проверками прогресса в SSE
+PARSER_STREAM_IDLE = 60.0     # статус не меняется столько секунд (в очереди, а воркер не запущен) — поток закрывается
+PARSER_STREAM_MAX = 300.0     # поток дольше не держим — клиент переподключается
+
+
+def latest_job_status() -> dict:
+    job = CrawlJob.objects.first()
+    return job.as_dict() if job is not None else PARSER_STATUS_IDLE
+
+
+async def stream_parser_status():
+    """
+    SSE: новый кадр при каждом изменении прогресса, поток закрывается, когда обход закончился.
+    Если статус не меняется PARSER_STREAM_IDLE секунд или поток идёт дольше PARSER_STREAM_MAX —
+    последний кадр event: timeout (reason "idle" / "max"), и поток закрывается.
+    """
+    last = None
+    started = changed = time.monotonic()
+    while True:
+        status = await sync_to_async(latest_job_status)()
+        now = time.monotonic()
+        if status != last:
+            yield sse(status)
+            last, changed = status, now
+        if status["status"] not in CrawlJob.ACTIVE:
+            yield sse(status, event="done")
+            return
+        if now - changed >= PARSER_STREAM_IDLE or now - started >= PARSER_STREAM_MAX:
+            reason = "idle" if now - changed >= PARSER_STREAM_IDLE else "max"
+            yield sse({**status, "reason": reason}, event="timeout")
+            return
+        await asyncio.sleep(PARSER_STREAM_INTERVAL)
+
+
+async def parser_status_view(request):
+    """
+    Статус последнего обхода с прогрессом; ?stream=1 — поток Server-Sent Events.
+    Вид асинхронный, как ask_stream: под ASGI кадры уходят по мере готовности.
+    """
+    if request.GET.get("stream") == "1":
+        response = StreamingHttpResponse(stream_parser_status(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+    return JsonResponse(await sync_to_async(latest_job_status)())
+
+
+from .services.kb_index import index_for_question
+from .services.context_builder import ROLE_BUDGETS, build_context
+from .services.answer_cache import cache_key, cached_answer, get_cache
+from .services.semantic_cache import get_semantic_cache
+from .services.openai_clients import async_client, get_client
+from .services import metrics
+
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+ASK_MODEL = "gpt-4o-mini"
+ASK_PROMPT = "Ты — сотрудник Министерства алии и интеграции, отвечай кратко и по делу."
+# бюджет контекста KB для /ask/ и /ask/stream/, токены (как у аналитика в vs_on_terminal2)
+ASK_CONTEXT_BUDGET = int(os.getenv("ASK_CONTEXT_BUDGET", ROLE_BUDGETS["analyst"]))
 
 def index(request):
     return render(request, "consultations/index.html")
 
+def build_messages(question: str):
+    """
+    Сообщения для модели с контекстом из базы знаний и версия KB.
+    Контекст — предложения лучших абзацев под вопрос в пределах ASK_CONTEXT_BUDGET токенов
+    (context_builder), а не абзацы целиком: абзац KB бывает размером со страницу.
+    """
+    messages = [
+        {"role": "system", "content": ASK_PROMPT},
+    ]
+    try:
+        kb = index_for_question(settings.KB_PATH, question)
+        plan = build_context(kb, question, {"analyst": ASK_CONTEXT_BUDGET, "communicator": 0, "manager": 0})
+        context = plan.contexts["analyst"]
+        kb_version = kb.version
+    except OSError as e:
+        logger.warning("База знаний недоступна: %s", e)
+        context, kb_version = "", ""
+    if context:
+        messages.append({"role": "system", "content": f"КОНТЕКСТ:\n{context}"})
+    messages.append({"role": "user", "content": question})
+    return messages, kb_version
+
+
 def ask_question(request):
     if request.method == "POST":
         question = request.POST.get("question_text")
+        messages, kb_version = build_messages(question)
+
+        def ask_model():
+            # общий клиент OpenAI процесса (пул соединений, keep-alive)
+            response = get_client().chat.completions.create(
+                model=ASK_MODEL,
+                messages=messages,
+            )
+            metrics.record_usage(response, ASK_MODEL)
+            return response.choices[0].message.content
+
+        # повторный вопрос по той же версии KB — из кэша, без вызова модели
+        answer = cached_answer(question, ASK_MODEL, ASK_PROMPT, kb_version, ask_model)
+        return render(request, "consultations/result.html", {"question": question, "answer": answer})
+
+    return render(request, "consultations/index.html")
 
-        # создаем клиент OpenAI
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Ты — сотрудник Министерства алии и интеграции, отвечай кратко и по делу."},
-                {"role": "user", "content": question},
-            ],
-        )
+# ----------- Потоковый ответ (ASGI) -----------
+def sse(data: dict, event: str = None) -> str:
+    """Один кадр Server-Sent Events."""
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        answer = response.choices[0].message.content
-        return render(request, "consultations/result.html", {"question": question, "answer": answer})
 
-    return render(request, "consultations/index.html")
+def lookup_cached(question: str, kb_version: str):
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(cache_key(question, ASK_MODEL, ASK_PROMPT, kb_version))
+
+
+def store_cached(question: str, kb_version: str, answer: str) -> None:
+    cache = get_cache()
+    if cache is not None and answer:
+        cache.set(cache_key(question, ASK_MODEL, ASK_PROMPT, kb_version), answer, ASK_MODEL)
+
+
+async def stream_answer(question: str, shared_client: bool = True):
+    """
+    Токены ответа по мере генерации (SSE): поиск по KB и кэш — в потоке,
+    запрос к модели — через AsyncOpenAI, без блокировки воркера.
+    shared_client=False (WSGI) — клиент на этот запрос, закрывается вместе с потоком.
+    """
+    messages, kb_version = await sync_to_async(build_messages, thread_sensitive=False)(question)
+    cached = await sync_to_async(lookup_cached, thread_sensitive=False)(question, kb_version)
+    if cached is not None:
+        yield sse({"token": cached})
+        yield sse({"cached": True}, event="done")
+        return
+
+    parts = []
+    started = time.perf_counter()
+    try:
+        async with async_client(shared_client) as client:
+            stream = await client.chat.completions.create(
+                model=ASK_MODEL, messages=messages, stream=True,
+                stream_options={"include_usage": True},  # последний чанк — с usage, для метрик токенов
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    metrics.record_usage(chunk, ASK_MODEL)
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    parts.append(token)
+                    yield sse({"token": token})
+    except openai.OpenAIError as e:
+        metrics.record_error("ask_stream", e)
+        logger.error("Ошибка потокового ответа: %s", e)
+        yield sse({"error": "Сервис временно недоступен. Попробуйте позже."}, event="error")
+        return
+
+    metrics.observe("stage_seconds", time.perf_counter() - started, stage="ask_stream")
+    await sync_to_async(store_cached, thread_sensitive=False)(question, kb_version, "".join(parts))
+    yield sse({"cached": False}, event="done")
+
+
+async def ask_stream(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid method"}, status=405)
+    question = (request.POST.get("question_text") or "").strip()
+    if not question:
+        return JsonResponse({"error": "Пустой вопрос"}, status=400)
+
+    # под WSGI цикл событий живёт не дольше запроса — общий клиент ему не подходит
+    shared_client = isinstance(request, ASGIRequest)
+    response = StreamingHttpResponse(stream_answer(question, shared_client), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx не должен копить ответ целиком
+    return response
+
+
+def answer_cache_stats(request):
+    """Счётчики кэшей ответов: точного (память/диск) и семантического."""
+    cache, similar = get_cache(), get_semantic_cache()
+    return JsonResponse({
+        "exact": cache.info() if cache is not None else {"enabled": False},
+        "semantic": similar.info() if similar is not None else {"enabled": False},
+    })
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus (задержки, токены, кэши, ошибки)."""
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
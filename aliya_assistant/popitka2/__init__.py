@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+popitka2 — сбор базы знаний: обход сайтов (parser2.py), хранилище фрагментов
+(kb_store.py), определение языка (lang_id.py) и разбор PDF/HTML.
+
+Django-часть (consultations/services) читает базу только через то, что
+экспортировано здесь, а не через внутренние модули пакета:
+- iter_chunks / iter_documents — чтение фрагментов KB_DB (kb_store.py);
+- detect — язык текста (lang_id.py), общий для фрагментов и вопросов.
+
+parser2 здесь не импортируется: при импорте он настраивает логирование и
+папку docs/ — обход запускается отдельно (manage.py crawl_worker).
+"""
+
+from .kb_store import iter_chunks, iter_documents
+from .lang_id import detect
+
+__all__ = ["detect", "iter_chunks", "iter_documents"]
@@ -1,10 +1,33 @@
+"""
+cleaner.py — очистка базы знаний (строки без мусора и повторов)
+
+💡 Как работает (потоково, память не растёт с размером корпуса):
+1. Вход читается блоками по CHUNK_SIZE символов (или фрагментами из SQLite-базы kb_store),
+   лишние символы вырезаются одним re.sub на весь блок, а не на каждую строку
+2. Все EXCLUDE_SUBSTRINGS проверяются одним скомпилированным выражением (альтернация),
+   регистр блока приводится один раз — а не .lower() строки на каждую подстроку
+3. Повторы отсекаются по 64-битному хэшу строки, а не по самим строкам
+4. Результат пишется блоками по CHUNK_SIZE
+
+clean_file() — файл → файл; clean_kb() — этап парсера (parser2.crawl):
+после обновления базы знаний пересобирает очищенную выгрузку прямо из SQLite.
+"""
+
 import re
+import sys
 from pathlib import Path
 
+try:
+    from .kb_store import iter_chunks
+except ImportError:
+    from kb_store import iter_chunks  # запуск файлом из папки popitka2
+
 # === НАСТРОЙКИ ===
-INPUT_FILE = "knowledge_base_aliyah_full.txt"   # исходный файл
+INPUT_FILE = "knowledge_base_aliyah_full.txt"   # исходный файл (или knowledge_base_aliyah_full.sqlite3)
 OUTPUT_FILE = "cleaned_base.txt"                # выходной файл
 MIN_LENGTH = 10                                 # минимальная длина строки
+CHUNK_SIZE = 1 << 20                            # размер блока чтения/записи, символов
+KB_DB_SUFFIXES = {".sqlite3", ".db"}
 
 # Подстроки, которые нужно удалить (строки с ними не попадут в результат)
 EXCLUDE_SUBSTRINGS = [
@@ -17,24 +40,26 @@ EXCLUDE_SUBSTRINGS = [
     "Узники Сиона",
 ]
 
+NOT_ALLOWED_RE = re.compile(r"[^А-Яа-яЁё0-9\s\.,!\?\-:;\"'()\[\]]+")
+CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+# одна альтернация по подстрокам в нижнем регистре: регистр текста приводится один раз на блок
+# (с re.IGNORECASE по кириллице поиск на порядок медленнее)
+EXCLUDE_RE = re.compile("|".join(re.escape(s.lower()) for s in EXCLUDE_SUBSTRINGS))
+
 # --- 1. Функции фильтрации ---
 
 def clean_line(line: str) -> str:
     """
     Удаляет все символы, кроме русских букв, цифр, пробелов и базовых знаков препинания.
     """
-    cleaned = re.sub(r"[^А-Яа-яЁё0-9\s\.,!\?\-:;\"'()\[\]]+", "", line)
-    return cleaned.strip()
+    return NOT_ALLOWED_RE.sub("", line).strip()
 
 
 def should_exclude(line: str) -> bool:
     """
     Проверяет, содержит ли строка нежелательные подстроки.
     """
-    for substr in EXCLUDE_SUBSTRINGS:
-        if substr.lower() in line.lower():
-            return True
-    return False
+    return EXCLUDE_RE.search(line.lower()) is not None
 
 
 def is_valid_line(line: str) -> bool:
@@ -46,45 +71,121 @@ def is_valid_line(line: str) -> bool:
     """
     if not line or len(line) < MIN_LENGTH:
         return False
-    if not re.search(r"[А-Яа-яЁё]", line):
+    if not CYRILLIC_RE.search(line):
         return False
     if should_exclude(line):
         return False
     return True
 
 
-# --- 2. Основная функция очистки ---
+# --- 2. Потоковый движок ---
 
-def clean_file(input_path: str, output_path: str):
-    seen = set()
-    cleaned_lines = []
+class LineCleaner:
+    """
+    Очистка потока текстовых блоков (каждый блок — целые строки).
+    Повторы ищутся по hash() строки (64 бита): на строку в памяти одно число,
+    вероятность ложного совпадения ~n²/2⁶⁵ — для миллионов строк пренебрежимо мала.
+    """
 
+    def __init__(self):
+        self.seen = set()
+        self.stats = {"lines": 0, "kept": 0, "invalid": 0, "duplicates": 0}
+
+    def feed(self, block: str):
+        """Очищенные строки блока (без повторов с уже виденными); проверки is_valid_line, но на весь блок."""
+        block = NOT_ALLOWED_RE.sub("", block)
+        lines = block.split("\n")
+        seen = self.seen
+        invalid = duplicates = 0
+        for line, low in zip(lines, block.lower().split("\n")):  # lower() не трогает переводы строк — строки совпадают
+            line = line.strip()
+            if len(line) < MIN_LENGTH or not CYRILLIC_RE.search(line) or EXCLUDE_RE.search(low):
+                invalid += 1
+                continue
+            h = hash(line)
+            if h in seen:
+                duplicates += 1
+                continue
+            seen.add(h)
+            yield line
+        self.stats["lines"] += len(lines)
+        self.stats["invalid"] += invalid
+        self.stats["duplicates"] += duplicates
+        self.stats["kept"] += len(lines) - invalid - duplicates
+
+    def run(self, blocks):
+        for block in blocks:
+            yield from self.feed(block)
+
+
+def read_blocks(input_path, chunk_size: int = CHUNK_SIZE):
+    """Блоки текста по ~chunk_size символов, разрезанные по концу строки."""
+    if Path(input_path).suffix in KB_DB_SUFFIXES:
+        for chunk in iter_chunks(input_path):
+            yield chunk["text"]
+        return
+    with open(input_path, "r", encoding="utf-8") as f:
+        tail = ""
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = tail + data
+            cut = data.rfind("\n")
+            if cut < 0:
+                tail = data
+                continue
+            tail = data[cut + 1:]
+            yield data[:cut]
+    if tail:
+        yield tail
+
+
+def write_lines(lines, output_path, chunk_size: int = CHUNK_SIZE) -> int:
+    """Строки через "\\n" (без перевода строки в конце, как раньше), запись блоками. Возвращает число строк."""
+    count, size, buf = 0, 0, []
+    tmp = Path(str(output_path) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for line in lines:
+            piece = line if count == 0 else "\n" + line
+            buf.append(piece)
+            size += len(piece)
+            count += 1
+            if size >= chunk_size:
+                f.write("".join(buf))
+                buf, size = [], 0
+        f.write("".join(buf))
+    tmp.replace(output_path)
+    return count
+
+
+# --- 3. Основная функция очистки ---
+
+def clean_file(input_path: str, output_path: str, quiet: bool = False):
     # Проверяем существование исходного файла
     if not Path(input_path).exists():
         print(f"❌ Ошибка: файл '{input_path}' не найден.")
-        return
+        return None
 
-    # Чтение и очистка
-    with open(input_path, "r", encoding="utf-8") as infile:
-        for raw_line in infile:
-            line = clean_line(raw_line)
-            if not is_valid_line(line):
-                continue
-            if line not in seen:
-                seen.add(line)
-                cleaned_lines.append(line)
+    cleaner = LineCleaner()
+    count = write_lines(cleaner.run(read_blocks(input_path)), output_path)
+
+    if not quiet:
+        print("✅ Очистка завершена.")
+        print(f"📄 Исходный файл: {input_path}")
+        print(f"💾 Очищенный файл: {output_path}")
+        print(f"📊 Итог: {count} строк сохранено "
+              f"(повторов {cleaner.stats['duplicates']}, отброшено {cleaner.stats['invalid']}).")
+    return cleaner.stats
 
-    # Запись результата
-    with open(output_path, "w", encoding="utf-8") as outfile:
-        outfile.write("\n".join(cleaned_lines))
 
-    print("✅ Очистка завершена.")
-    print(f"📄 Исходный файл: {input_path}")
-    print(f"💾 Очищенный файл: {output_path}")
-    print(f"📊 Итог: {len(cleaned_lines)} строк сохранено.")
+def clean_kb(kb_db, output_path=OUTPUT_FILE):
+    """Этап парсера: очищенная выгрузка прямо из SQLite-базы знаний (без промежуточного .txt)."""
+    return clean_file(str(kb_db), str(output_path), quiet=True)
 
 
-# --- 3. Точка входа ---
+# --- 4. Точка входа ---
 
 if __name__ == "__main__":
-    clean_file(INPUT_FILE, OUTPUT_FILE)
+    args = sys.argv[1:]
+    clean_file(args[0] if args else INPUT_FILE, args[1] if len(args) > 1 else OUTPUT_FILE)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+crawl_engine.py — вежливость и параллелизм для parser2.crawl()
+
+💡 Что здесь:
+1. TokenBucket  — ограничение частоты запросов (запросов в секунду + запас)
+2. HostLimiter  — для каждого хоста свой лимит одновременных запросов и свой
+                  TokenBucket; хост сопоставляется по суффиксу
+                  (www.kolzchut.org.il → kolzchut.org.il, govextra.gov.il → gov.il)
+3. thread_session() — отдельная requests.Session на поток пула
+4. CrawlProgress — счётчики обхода (страницы, очередь, байты, PDF, ошибки по типам,
+                  страниц в секунду), общие для потоков; error_kind() — тип ошибки запроса
+5. clean_url()  — адрес для запроса: без #якоря и служебных параметров (utm_*, action=…);
+   canonical_url() — ключ посещённых страниц: одна форма для вариантов одного адреса
+                  (регистр хоста, %-кодирование, слэш в конце, порядок параметров);
+                  host_allowed() — проверка хоста по списку суффиксов
+6. Frontier     — очередь обхода по приоритету (heapq) вместо обхода в ширину
+"""
+
+import heapq
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, quote, urlencode, urlparse, urlsplit, urlunsplit
+
+import requests
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+
+class TokenBucket:
+    """Классический token bucket: rate жетонов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """
+    limits = {"kolzchut.org.il": (одновременных запросов, запросов в секунду), ...}
+    Хосты, которых нет в limits, получают default.
+    """
+
+    def __init__(self, limits: dict, default: tuple):
+        self.limits = limits
+        self.default = default
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _key(self, host: str) -> str:
+        for suffix in self.limits:
+            if host == suffix or host.endswith("." + suffix):
+                return suffix
+        return host
+
+    def _get(self, url: str):
+        key = self._key(urlparse(url).hostname or "")
+        with self.lock:
+            if key not in self.hosts:
+                concurrency, rate = self.limits.get(key, self.default)
+                self.hosts[key] = (threading.BoundedSemaphore(concurrency), TokenBucket(rate, concurrency))
+            return self.hosts[key]
+
+    @contextmanager
+    def limit(self, url: str):
+        sem, bucket = self._get(url)
+        with sem:
+            bucket.acquire()
+            yield
+
+
+_local = threading.local()
+
+
+def thread_session(headers: dict = None) -> requests.Session:
+    """requests.Session не потокобезопасна — у каждого потока пула своя."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        if headers:
+            session.headers.update(headers)
+        _local.session = session
+    return session
+
+
+def error_kind(exc: Exception) -> str:
+    """Тип ошибки для статистики: http_404, timeout, connection или имя исключения."""
+    if isinstance(exc, HTTPError) and exc.response is not None:
+        return f"http_{exc.response.status_code}"
+    if isinstance(exc, Timeout):
+        return "timeout"
+    if isinstance(exc, ConnectionError):
+        return "connection"
+    return type(exc).__name__
+
+
+class CrawlProgress:
+    """
+    Счётчики обхода: пополняются из потоков пула, читаются снимком (snapshot).
+    processed — страницы с полученным результатом (любым), по ним считается pages_per_sec.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.errors = Counter()
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.counts[key] += n
+
+    def error(self, kind: str) -> None:
+        with self.lock:
+            self.errors[kind] += 1
+
+    def set(self, key: str, value) -> None:
+        with self.lock:
+            self.counts[key] = value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            data = dict(self.counts)
+            data["errors"] = dict(self.errors)
+        elapsed = time.time() - self.started
+        data["elapsed"] = round(elapsed, 1)
+        data["pages_per_sec"] = round(data.get("processed", 0) / elapsed, 2) if elapsed > 0 else 0.0
+        return data
+
+
+# ----------- Адреса -----------
+PATH_SAFE = "/:@!$&'()*+,;=-._~%"
+UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+SLASHES_RE = re.compile(r"/{2,}")
+PERCENT_RE = re.compile(r"%([0-9A-Fa-f]{2})")
+STRAY_PERCENT_RE = re.compile(r"%(?![0-9A-Fa-f]{2})")
+
+
+def query_dropped(name: str, drop_query) -> bool:
+    """Параметр из drop_query; имя с * на конце — префикс (utm_* → utm_source, utm_medium …)."""
+    return any(name.startswith(d[:-1]) if d.endswith("*") else name == d for d in drop_query)
+
+
+def clean_url(url: str, drop_query=()) -> str:
+    """
+    Адрес, который реально запрашивается: без #якоря и параметров из drop_query
+    (utm_*, action=, oldid= … — та же страница или её служебный вид); путь,
+    %-кодирование, слэш в конце и остальные параметры (title=, page=) не трогаются.
+    """
+    parts = urlsplit(url.strip())
+    query = parts.query
+    if query and drop_query:
+        pairs = parse_qsl(query, keep_blank_values=True)
+        query = urlencode([(k, v) for k, v in pairs if not query_dropped(k, drop_query)])
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+
+def normalize_percent(path: str) -> str:
+    """%-кодирование пути в одной форме: не-ASCII кодируется, %xx — в верхнем регистре,
+    незарезервированные символы (%41 → A) раскодируются, а %2F, %3F и т.п. остаются как есть."""
+    path = quote(STRAY_PERCENT_RE.sub("%25", path), safe=PATH_SAFE)
+
+    def fix(m):
+        ch = chr(int(m.group(1), 16))
+        return ch if ch in UNRESERVED else "%" + m.group(1).upper()
+
+    return PERCENT_RE.sub(fix, path)
+
+
+def canonical_url(url: str, drop_query=()) -> str:
+    """
+    Каноническая форма адреса — ключ, по которому обход помнит посещённые страницы
+    (запрашивается сам адрес, см. clean_url): схема и хост в нижнем регистре, без
+    порта по умолчанию и #якоря; путь в одной %-кодировке (normalize_percent —
+    «читаемый» и закодированный варианты совпадают, %2F остаётся %2F), без повторных
+    и завершающего слэшей; параметры запроса без drop_query, в порядке имён.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    path = SLASHES_RE.sub("/", normalize_percent(parts.path)) or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    pairs = parse_qsl(parts.query, keep_blank_values=True)
+    query = urlencode(sorted((k, v) for k, v in pairs if not query_dropped(k, drop_query)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def host_allowed(url: str, hosts) -> bool:
+    """Хост совпадает с одним из hosts или это его поддомен (www.gov.il, govextra.gov.il → gov.il)."""
+    host = urlparse(url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in hosts)
+
+
+class Frontier:
+    """
+    Очередь обхода: первым выдаётся адрес с наибольшим score, при равенстве —
+    найденный раньше. Адрес в очереди один раз — по key (каноническая форма,
+    по умолчанию сам адрес); если он найден снова с большим score — приоритет
+    повышается (старая запись в куче пропускается при выдаче).
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.best = {}  # адрес → score в очереди
+        self.seq = 0
+
+    def push(self, url: str, depth: int, score: float, key: str = None) -> bool:
+        key = url if key is None else key
+        if key in self.best and self.best[key] >= score:
+            return False
+        self.best[key] = score
+        heapq.heappush(self.heap, (-score, self.seq, key, url, depth))
+        self.seq += 1
+        return True
+
+    def pop(self):
+        """(адрес, глубина, score) с наибольшим score."""
+        while self.heap:
+            neg_score, _, key, url, depth = heapq.heappop(self.heap)
+            if self.best.get(key) == -neg_score:
+                del self.best[key]
+                return url, depth, -neg_score
+        raise IndexError("pop from empty frontier")
+
+    def clear(self) -> None:
+        self.heap.clear()
+        self.best.clear()
+
+    def __len__(self) -> int:
+        return len(self.best)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+crawl_state.py — состояние обхода между запусками crawl()
+
+Для каждого URL (страница или PDF) хранится:
+- ETag и Last-Modified последнего ответа — для If-None-Match / If-Modified-Since;
+- хэш извлечённого содержимого — чтобы отличать реальные изменения;
+- время последнего запроса и последнего изменения;
+- payload — разобранный результат (текст, ссылки, PDF, формы),
+  чтобы неизменившийся документ попал в KB без повторного скачивания и разбора.
+
+Работа с базой — только из основного потока crawl().
+"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    url           TEXT PRIMARY KEY,
+    kind          TEXT NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    content_hash  TEXT,
+    fetched_at    TEXT,
+    changed_at    TEXT,
+    payload       TEXT
+);
+"""
+
+
+def now() -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CrawlState:
+    def __init__(self, path: Path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def get(self, url: str):
+        row = self.conn.execute("SELECT * FROM documents WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        doc = dict(row)
+        doc["payload"] = json.loads(doc["payload"]) if doc["payload"] else None
+        return doc
+
+    def save(self, url: str, kind: str, validators: dict, content_hash: str, payload) -> str:
+        """Новый или изменившийся документ. Возвращает время изменения."""
+        ts = now()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, kind, validators.get("etag"), validators.get("last_modified"),
+             content_hash, ts, ts, json.dumps(payload, ensure_ascii=False)),
+        )
+        return ts
+
+    def touch(self, url: str, validators: dict = None) -> None:
+        """Документ не изменился: обновляем время запроса и, если пришли, валидаторы."""
+        validators = validators or {}
+        self.conn.execute(
+            "UPDATE documents SET fetched_at = ?, "
+            "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+            (now(), validators.get("etag"), validators.get("last_modified"), url),
+        )
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+def conditional_headers(doc) -> dict:
+    """Заголовки условного запроса по сохранённому состоянию документа."""
+    headers = {}
+    if doc and doc.get("payload") is not None:
+        if doc.get("etag"):
+            headers["If-None-Match"] = doc["etag"]
+        if doc.get("last_modified"):
+            headers["If-Modified-Since"] = doc["last_modified"]
+    return headers
+
+
+def response_validators(response) -> dict:
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
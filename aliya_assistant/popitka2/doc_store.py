@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+doc_store.py — хранилище документов по содержимому (content-addressed)
+
+Раньше PDF сохранялись под именем страницы, и одинаковые файлы лежали в docs/
+под разными именами, а pdfminer разбирал каждую копию заново. Теперь:
+
+docs/
+  blobs/ab/<sha256>.pdf   — один файл на уникальное содержимое
+  text/<sha256>.txt       — извлечённый текст, общий для parser2 и docs_to_txt
+  manifest.json           — {"titles": {название: sha256}, "urls": {url: sha256}}
+
+Запуск файлом переносит уже скачанные файлы из docs/ в хранилище:
+    python doc_store.py
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class DocStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.text_dir = self.root / "text"
+        self.manifest_path = self.root / "manifest.json"
+        self.lock = threading.Lock()
+        self.text_locks = {}  # sha → Lock: один и тот же документ разбирается один раз
+        self.manifest = self._load_manifest()
+
+    # ----------- Манифест -----------
+    def _load_manifest(self) -> dict:
+        manifest = {"titles": {}, "urls": {}}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest.update(json.load(f))
+        return manifest
+
+    def save_manifest(self) -> None:
+        with self.lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.manifest_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(tmp, self.manifest_path)
+
+    def link(self, sha: str, title: str = None, url: str = None) -> None:
+        with self.lock:
+            if title:
+                self.manifest["titles"][title] = sha
+            if url:
+                self.manifest["urls"][url] = sha
+
+    # ----------- Файлы -----------
+    def blob_path(self, sha: str, ext: str = ".pdf") -> Path:
+        return self.blobs_dir / sha[:2] / (sha + ext)
+
+    def find_blob(self, sha: str):
+        return next((self.blobs_dir / sha[:2]).glob(sha + ".*"), None)
+
+    def put(self, content: bytes, ext: str = ".pdf") -> str:
+        """Сохраняет содержимое, если такого ещё нет. Возвращает SHA-256."""
+        sha = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(sha, ext)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(content)
+            os.replace(tmp, path)
+        return sha
+
+    # ----------- Кэш текста -----------
+    def text_path(self, sha: str) -> Path:
+        return self.text_dir / (sha + ".txt")
+
+    def get_text(self, sha: str):
+        path = self.text_path(sha)
+        return path.read_text(encoding="utf-8") if path.exists() else None
+
+    def put_text(self, sha: str, text: str) -> None:
+        self.text_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.text_path(sha).with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.text_path(sha))
+
+    def text(self, sha: str, extract) -> str:
+        """
+        Текст документа: из кэша или extract(путь к blob) с сохранением в кэш.
+        Параллельные запросы одного sha ждут первый разбор, а не повторяют его.
+        Если extract вернул None (разбор прерван досрочно), в кэш ничего не пишется.
+        """
+        with self.lock:
+            lock = self.text_locks.setdefault(sha, threading.Lock())
+        with lock:
+            text = self.get_text(sha)
+            if text is None:
+                text = extract(self.find_blob(sha))
+                if text is None:
+                    return ""
+                self.put_text(sha, text)
+            return text
+
+
+def import_dir(store: DocStore, directory: Path) -> None:
+    """Переносит файлы из directory в хранилище; имя файла становится названием в манифесте."""
+    files = [p for p in Path(directory).iterdir() if p.is_file() and p.suffix.lower() != ".json"]
+    unique = set()
+    for path in files:
+        sha = store.put(path.read_bytes(), path.suffix.lower())
+        store.link(sha, title=path.stem)
+        unique.add(sha)
+    store.save_manifest()
+    print(f"📦 Файлов: {len(files)}, уникальных: {len(unique)}, дубликатов: {len(files) - len(unique)}")
+
+
+if __name__ == "__main__":
+    import_dir(DocStore(Path("docs")), Path("docs"))
@@ -6,7 +6,7 @@ extract_docs_to_txt.py
 Извлекает текст из всех документов в папке docs/ и сохраняет их в docs_text/.
 
 Поддерживаемые форматы:
-- PDF (pdfminer.six)
+- PDF (pdfminer.six, постранично — pdf_stream.py)
 - DOCX, DOC (python-docx)
 - RTF (чтение как текст)
 - TXT (копируется как есть)
@@ -14,20 +14,42 @@ extract_docs_to_txt.py
 Результат:
 - Для каждого документа создаётся .txt-файл с тем же названием.
 - Все результаты сохраняются в папку docs_text/
+
+Документы берутся и из docs/, и из хранилища парсера (docs/manifest.json).
+Извлечённый текст кэшируется по SHA-256 содержимого (doc_store.py), поэтому
+одинаковые файлы разбираются один раз и не разбираются повторно между запусками.
+Ошибка разбора (extract_* вернул None) в кэш не пишется — файл разбирается снова
+при следующем запуске, а не остаётся пустым навсегда.
+
+Запуск:
+    python docs_to_txt.py              # все ядра, только новые/изменившиеся файлы
+    python docs_to_txt.py --jobs 4     # 4 процесса
+    python docs_to_txt.py --force      # полная переконвертация без кэша
 """
 
 import os
 import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from pdfminer.high_level import extract_text as pdf_extract_text
 from docx import Document
 
+try:
+    from . import pdf_stream
+    from .doc_store import DocStore
+except ImportError:
+    # запуск файлом из папки popitka2
+    import pdf_stream
+    from doc_store import DocStore
+
 # ----------- Настройки -----------
 DOCS_DIR = Path("docs")
 OUTPUT_DIR = Path("docs_text")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 SUPPORTED = {".pdf", ".doc", ".docx", ".rtf", ".txt"}
+STORE = DocStore(DOCS_DIR)
 
 
 # ----------- Утилиты -----------
@@ -38,34 +60,34 @@ def clean_text(s: str) -> str:
     return s
 
 
-def extract_pdf(path: Path) -> str:
+def extract_pdf(path: Path):
     try:
-        return clean_text(pdf_extract_text(path))
+        return pdf_stream.extract_text(path)
     except Exception as e:
         print(f"⚠️ Ошибка PDF {path.name}: {e}")
-        return ""
+        return None
 
 
-def extract_docx(path: Path) -> str:
+def extract_docx(path: Path):
     try:
         doc = Document(path)
         text = "\n".join(p.text for p in doc.paragraphs)
         return clean_text(text)
     except Exception as e:
         print(f"⚠️ Ошибка DOCX {path.name}: {e}")
-        return ""
+        return None
 
 
-def extract_txt(path: Path) -> str:
+def extract_txt(path: Path):
     try:
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
             return clean_text(f.read())
     except Exception as e:
         print(f"⚠️ Ошибка TXT {path.name}: {e}")
-        return ""
+        return None
 
 
-def extract_rtf(path: Path) -> str:
+def extract_rtf(path: Path):
     try:
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
             content = f.read()
@@ -73,41 +95,108 @@ def extract_rtf(path: Path) -> str:
         return clean_text(text)
     except Exception as e:
         print(f"⚠️ Ошибка RTF {path.name}: {e}")
-        return ""
+        return None
 
 
 # ----------- Основная логика -----------
-def main():
-    files = [f for f in DOCS_DIR.iterdir() if f.is_file() and f.suffix.lower() in SUPPORTED]
-    print(f"📂 Найдено файлов: {len(files)}")
-
-    for file_path in files:
-        ext = file_path.suffix.lower()
-        print(f"📄 Обработка: {file_path.name}")
-
-        if ext == ".pdf":
-            text = extract_pdf(file_path)
-        elif ext in {".doc", ".docx"}:
-            text = extract_docx(file_path)
-        elif ext == ".rtf":
-            text = extract_rtf(file_path)
-        elif ext == ".txt":
-            text = extract_txt(file_path)
-        else:
-            print(f"⏭ Пропуск: неподдерживаемый формат {ext}")
+def extract(path: Path):
+    """Текст документа; None — ошибка разбора (не кэшируется)."""
+    ext = path.suffix.lower()
+    if ext == ".pdf":
+        return extract_pdf(path)
+    elif ext in {".doc", ".docx"}:
+        return extract_docx(path)
+    elif ext == ".rtf":
+        return extract_rtf(path)
+    elif ext == ".txt":
+        return extract_txt(path)
+    return ""
+
+
+def extract_job(path: str):
+    """Выполняется в процессе пула: (текст, секунды)"""
+    start = time.perf_counter()
+    text = extract(Path(path))
+    return text, time.perf_counter() - start
+
+
+def collect_documents():
+    """[(название, sha256, исходный файл)] — файлы из docs/ (заносятся в хранилище) и документы из манифеста"""
+    docs = {}
+    for f in DOCS_DIR.iterdir():
+        if f.is_file() and f.suffix.lower() in SUPPORTED:
+            docs[f.stem] = (STORE.put(f.read_bytes(), f.suffix.lower()), f)
+    for title, sha in STORE.manifest["titles"].items():
+        if title not in docs:
+            blob = STORE.find_blob(sha)
+            if blob is not None:
+                docs[title] = (sha, blob)
+    return sorted((name, sha, path) for name, (sha, path) in docs.items())
+
+
+def is_up_to_date(output_file: Path, source: Path) -> bool:
+    return output_file.exists() and output_file.stat().st_mtime >= source.stat().st_mtime
+
+
+def save_text(name: str, text: str) -> bool:
+    if not text.strip():
+        print(f"⚠️ Пустой текст в {name}")
+        return False
+    with open(OUTPUT_DIR / (name + ".txt"), "w", encoding="utf-8") as out:
+        out.write(text)
+    return True
+
+
+def main(jobs: int = None, force: bool = False):
+    started = time.perf_counter()
+    docs = collect_documents()
+    print(f"📂 Найдено файлов: {len(docs)}, уникальных: {len(set(sha for _, sha, _ in docs))}")
+
+    skipped, cached, failed = 0, 0, 0
+    pending = {}  # sha → [(название, файл), ...]: одинаковые документы разбираются один раз
+    for name, sha, source in docs:
+        if not force and is_up_to_date(OUTPUT_DIR / (name + ".txt"), source):
+            skipped += 1
             continue
-
-        if not text.strip():
-            print(f"⚠️ Пустой текст в {file_path.name}")
+        text = None if force else STORE.get_text(sha)
+        if text is not None:
+            cached += 1
+            save_text(name, text)
             continue
-
-        # сохраняем
-        output_file = OUTPUT_DIR / (file_path.stem + ".txt")
-        with open(output_file, "w", encoding="utf-8") as out:
-            out.write(text)
-
+        pending.setdefault(sha, []).append((name, source))
+
+    timings = []  # (название, байт, секунд)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(extract_job, str(items[0][1])): sha for sha, items in pending.items()}
+        for fut in as_completed(futures):
+            sha = futures[fut]
+            text, seconds = fut.result()
+            if text is None:
+                failed += 1
+                print(f"⚠️ {pending[sha][0][0]}: не разобран — попробую снова при следующем запуске")
+                continue
+            STORE.put_text(sha, text)
+            for name, source in pending[sha]:
+                size = source.stat().st_size
+                print(f"📄 {name}: {seconds:.2f} с, {size / 1024 / max(seconds, 1e-6):.0f} КБ/с")
+                save_text(name, text)
+            timings.append((pending[sha][0][0], pending[sha][0][1].stat().st_size, seconds))
+
+    wall = time.perf_counter() - started
+    total_bytes = sum(size for _, size, _ in timings)
+    cpu = sum(seconds for _, _, seconds in timings)
+    print("\n📊 Итог:")
+    print(f"   разобрано: {len(timings)}, из кэша: {cached}, актуальных (пропущено): {skipped}, ошибок: {failed}")
+    print(f"   время: {wall:.2f} с (суммарно по процессам {cpu:.2f} с, x{cpu / max(wall, 1e-6):.1f})")
+    print(f"   пропускная способность: {total_bytes / 1024 / 1024 / max(wall, 1e-6):.2f} МБ/с")
+    for name, size, seconds in sorted(timings, key=lambda t: -t[2])[:5]:
+        print(f"   🐢 {name}: {seconds:.2f} с ({size / 1024:.0f} КБ)")
     print("\n✅ Готово! Все тексты сохранены в папку docs_text/")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Извлечение текста из документов docs/")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="число процессов (по умолчанию — все ядра)")
+    parser.add_argument("--force", action="store_true", help="переконвертировать всё, игнорируя кэш и даты")
+    args = parser.parse_args()
+    main(jobs=args.jobs, force=args.force)
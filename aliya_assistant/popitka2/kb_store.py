@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+kb_store.py — структурированная база знаний (SQLite, одна строка на фрагмент)
+
+Раньше crawl() писал записи в один knowledge_base_aliyah_full.txt через
+баннеры "=" * 80, а каждый потребитель (load_kb, cleaner.py, split_paragraphs)
+разбирал этот файл регулярками заново. Теперь:
+
+chunks(id, doc_url, url, title, source, fetched_at, section, text, lang)
+  doc_url — страница, к которой относится фрагмент (по ней документ заменяется целиком)
+  url     — откуда фрагмент: сама страница или PDF со страницы
+  section — "page" | "forms" | "pdf"
+  lang    — язык фрагмента (lang_id.py: ru / he / en), по нему строятся индексы по языкам
+
+- KBWriter — запись/замена документов (используется crawl());
+- iter_chunks() — ленивое чтение курсором, без загрузки всей базы в память;
+- export_text() — старый плоский формат для инструментов, которым он ещё нужен.
+
+Запуск файлом:
+    python kb_store.py import knowledge_base_aliyah_full.txt   # перенос старого файла в SQLite
+    python kb_store.py export knowledge_base_aliyah_full.txt   # выгрузка в плоский текст
+"""
+
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+try:
+    from .lang_id import detect
+except ImportError:
+    from lang_id import detect  # запуск файлом из папки popitka2
+
+KB_DB = Path("knowledge_base_aliyah_full.sqlite3")
+CHUNK_CHARS = 1200  # примерный размер фрагмента в символах
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id         INTEGER PRIMARY KEY,
+    doc_url    TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    title      TEXT,
+    source     TEXT,
+    fetched_at TEXT,
+    section    TEXT,
+    text       TEXT NOT NULL,
+    lang       TEXT
+);
+CREATE INDEX IF NOT EXISTS chunks_doc_url ON chunks (doc_url);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+# ----------- Нарезка на фрагменты -----------
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS):
+    """Строки (а слишком длинные строки — по предложениям) собираются во фрагменты до max_chars."""
+    pieces = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) <= max_chars:
+            pieces.append(line)
+        else:
+            pieces.extend(s for s in SENTENCE_RE.split(line) if s)
+
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + len(piece) > max_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+# ----------- Запись -----------
+class KBWriter:
+    def __init__(self, path: Path = KB_DB):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(chunks)")}
+        if "lang" not in columns:  # база, собранная до появления языков
+            self.conn.execute("ALTER TABLE chunks ADD COLUMN lang TEXT")
+        self.changed = 0
+
+    def has_document(self, doc_url: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM chunks WHERE doc_url = ? LIMIT 1", (doc_url,)).fetchone() is not None
+
+    def write_document(self, url: str, title: str, source: str, fetched_at: str,
+                       content: str, forms=(), pdfs=(), lang: str = None) -> int:
+        """
+        Заменяет все фрагменты страницы url. pdfs — [(pdf_url, текст), ...].
+        lang — язык страницы: он же у фрагментов, язык которых не определился
+        (у PDF на странице язык бывает другим — он определяется по фрагменту).
+        Возвращает число записанных фрагментов.
+        """
+        lang = lang or detect(content)
+        rows = [(url, url, title, source, fetched_at, "page", c, detect(c, lang)) for c in chunk_text(content)]
+        if forms:
+            rows.append((url, url, title, source, fetched_at, "forms", "\n".join(forms), lang))
+        for pdf_url, pdf_text in pdfs:
+            rows.extend((url, pdf_url, title, source, fetched_at, "pdf", c, detect(c, lang))
+                        for c in chunk_text(pdf_text))
+
+        self.conn.execute("DELETE FROM chunks WHERE doc_url = ?", (url,))
+        self.conn.executemany(
+            "INSERT INTO chunks (doc_url, url, title, source, fetched_at, section, text, lang) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows,
+        )
+        self.changed += 1
+        return len(rows)
+
+    def prune(self, keep_urls) -> int:
+        """Удаляет документы, которых нет в keep_urls (страница больше не попала в обход)."""
+        keep = set(keep_urls)
+        stale = [u for (u,) in self.conn.execute("SELECT DISTINCT doc_url FROM chunks") if u not in keep]
+        for u in stale:
+            self.conn.execute("DELETE FROM chunks WHERE doc_url = ?", (u,))
+        self.changed += len(stale)
+        return len(stale)
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        if self.changed:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('updated_at', ?)", (time.strftime("%Y-%m-%d %H:%M:%S"),)
+            )
+        self.conn.commit()
+        self.conn.close()
+
+
+# ----------- Чтение -----------
+def iter_chunks(path: Path = KB_DB):
+    """
+    Фрагменты по одному (dict), в порядке записи; курсор читает базу порциями.
+    В базе, собранной до появления языков, ключа "lang" нет (или он None).
+    """
+    conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        for row in conn.execute("SELECT * FROM chunks ORDER BY id"):
+            yield dict(row)
+    finally:
+        conn.close()
+
+
+def iter_documents(path: Path = KB_DB):
+    """Фрагменты, сгруппированные по страницам: (первый фрагмент, [фрагменты])."""
+    current, group = None, []
+    for chunk in iter_chunks(path):
+        if current is not None and chunk["doc_url"] != current:
+            yield group[0], group
+            group = []
+        current = chunk["doc_url"]
+        group.append(chunk)
+    if group:
+        yield group[0], group
+
+
+def format_document(head: dict, chunks) -> str:
+    """Документ в старом плоском формате knowledge_base_aliyah_full.txt."""
+    parts = [
+        "=" * 80 + "\n",
+        f"Название: {head['title']}\n",
+        f"Ссылка: {head['doc_url']}\n",
+        f"Источник: {head['source']}\n",
+        f"Дата парсинга: {head['fetched_at']}\n",
+        "-" * 80 + "\n",
+        "\n".join(c["text"] for c in chunks if c["section"] == "page") + "\n\n",
+    ]
+    forms = [c["text"] for c in chunks if c["section"] == "forms"]
+    if forms:
+        parts.append("Формы для заполнения:\n")
+        parts.extend(f"📄 {form}\n" for form in "\n".join(forms).split("\n"))
+        parts.append("\n")
+    pdf_texts = {}
+    for c in chunks:
+        if c["section"] == "pdf":
+            pdf_texts.setdefault(c["url"], []).append(c["text"])
+    for pdf_url, texts in pdf_texts.items():
+        parts.append(f"Правовой документ (PDF):\n📑 {pdf_url}\n{' '.join(t.replace(chr(10), ' ') for t in texts)}\n\n")
+    return "".join(parts)
+
+
+def export_text(db_path: Path, txt_path: Path) -> None:
+    tmp = Path(str(txt_path) + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for head, chunks in iter_documents(db_path):
+            f.write(format_document(head, chunks))
+    tmp.replace(txt_path)
+
+
+# ----------- Перенос старого формата -----------
+RECORD_RE = re.compile(r"^={80}\n", re.M)
+FIELD_RE = re.compile(r"^(Название|Ссылка|Источник|Дата парсинга): (.*)$", re.M)
+
+
+def import_text(txt_path: Path, db_path: Path = KB_DB) -> int:
+    """Разбирает плоский файл (один раз) и записывает документы в SQLite."""
+    with open(txt_path, "r", encoding="utf-8") as f:
+        records = RECORD_RE.split(f.read())
+    writer = KBWriter(db_path)
+    count = 0
+    for record in records:
+        if "-" * 80 not in record:
+            continue
+        header, body = record.split("-" * 80 + "\n", 1)
+        fields = dict(FIELD_RE.findall(header))
+        if "Ссылка" not in fields:
+            continue
+        body, _, pdf_part = body.partition("Правовой документ (PDF):\n")
+        content, _, forms_part = body.partition("Формы для заполнения:\n")
+        forms = [line[2:].strip() for line in forms_part.splitlines() if line.startswith("📄")]
+        pdfs = []
+        if pdf_part:
+            for block in ("Правовой документ (PDF):\n" + pdf_part).split("Правовой документ (PDF):\n"):
+                if block.startswith("📑 "):
+                    pdf_url, _, pdf_text = block[2:].partition("\n")
+                    pdfs.append((pdf_url.strip(), pdf_text.strip()))
+        writer.write_document(fields["Ссылка"], fields.get("Название", ""), fields.get("Источник", ""),
+                              fields.get("Дата парсинга", ""), content.strip(), forms, pdfs)
+        count += 1
+    writer.close()
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 3 and sys.argv[1] == "import":
+        n = import_text(Path(sys.argv[2]))
+        print(f"✅ Перенесено документов: {n} → {KB_DB}")
+    elif len(sys.argv) == 3 and sys.argv[1] == "export":
+        export_text(KB_DB, Path(sys.argv[2]))
+        print(f"✅ Выгружено: {KB_DB} → {sys.argv[2]}")
+    else:
+        print(__doc__)
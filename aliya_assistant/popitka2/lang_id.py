@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+lang_id.py — определение языка текста (ru / he / en) по символьным n-граммам
+
+Раньше язык проверялся только одним способом — «не меньше 25% кириллицы»
+(parser2.is_russian_text), поэтому страницы /he/ и /en/ в базу не попадали,
+а вопрос на иврите нельзя было отличить от «непонятного».
+
+Как работает (наивный байесовский классификатор, без внешних моделей):
+1. из образцов SAMPLES для каждого языка считаются частоты n-грамм символов
+   (1–3 символа, слова обрамлены пробелами: « ул», «пан », «ים »);
+2. у текста берутся первые MAX_CHARS символов, считаются его n-граммы
+   и средний log P(n-грамма | язык) со сглаживанием;
+3. побеждает язык с наибольшей оценкой — если его алфавит покрывает хотя бы
+   MIN_COVERAGE букв текста (иначе это другой язык, например арабский → None);
+   для коротких смешанных текстов (русский вопрос с «sal klita» латиницей)
+   detect() принимает и более строгие min_coverage / min_margin — отрыв
+   победителя от второго языка; не дотянул — тоже default.
+
+Фрагмент базы знаний (~1200 символов) — около миллисекунды.
+Используется в parser2.py (какие страницы и PDF брать), kb_store.py (язык
+фрагмента) и consultations/services/kb_index.py (индекс по языку вопроса).
+"""
+
+import math
+import re
+from collections import Counter
+from operator import add
+
+LANGUAGES = ("ru", "he", "en")
+MAX_CHARS = 2000      # для определения языка хватает начала текста
+MIN_LETTERS = 3       # короче — язык не определяется
+MIN_COVERAGE = 0.5    # доля букв текста, которые встречаются в образце языка-победителя
+SMOOTHING = 0.5
+
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+# Образцы — тематические тексты плюс панграммы, чтобы в каждом были все буквы алфавита
+SAMPLES = {
+    "ru": """
+        Министерство алии и интеграции помогает репатриантам и вернувшимся жителям
+        в первые годы жизни в Израиле. Новый репатриант имеет право на корзину
+        абсорбции, бесплатное обучение ивриту в ульпане, скидку на муниципальный
+        налог и помощь в оплате съёмной квартиры. Чтобы получить права, нужно
+        обратиться в отделение министерства с удостоверением репатрианта и
+        теудат зеут. Дополнительная информация о правах, льготах и услугах
+        собрана на портале Коль Зхут и на сайте правительства. Дети репатриантов
+        учатся в школе и получают дополнительные часы. Вернувшийся житель имеет
+        право на льготы по подоходному налогу и в Институте национального
+        страхования после проживания за границей. Съешь же ещё этих мягких
+        французских булок, да выпей чаю. Широкая электрификация южных губерний
+        даст мощный толчок подъёму сельского хозяйства.
+    """,
+    "he": """
+        משרד העלייה והקליטה מסייע לעולים חדשים ולתושבים חוזרים בשנים הראשונות
+        בישראל. עולה חדש זכאי לסל קליטה, ללימודי עברית באולפן, להנחה בארנונה
+        ולסיוע בשכר דירה. כדי לקבל את הזכויות יש לפנות לסניף המשרד עם תעודת עולה
+        ותעודת זהות. מידע נוסף על זכויות, הטבות ושירותים לעולים נמצא באתר כל זכות
+        ובאתר הממשלתי. ילדים של עולים לומדים בבית הספר ומקבלים שעות תגבור. תושב
+        חוזר זכאי להטבות במס הכנסה ובביטוח לאומי לאחר שהייה בחוץ לארץ. דג סקרן
+        שט בים מאוכזב ולפתע מצא חברה. מלך, כף, ארץ, שלום ואמן.
+    """,
+    "en": """
+        The Ministry of Aliyah and Integration helps new immigrants and returning
+        residents during their first years in Israel. A new immigrant is entitled
+        to an absorption basket, free Hebrew lessons in an ulpan, a discount on
+        municipal tax and rent assistance. To receive these rights, contact a
+        branch of the ministry with your immigrant certificate and identity card.
+        More information about rights, benefits and services for olim can be found
+        on the Kol Zchut portal and on the government website. Children of
+        immigrants study at school and receive additional hours. A returning
+        resident is entitled to income tax and National Insurance benefits after
+        living abroad. The quick brown fox jumps over the lazy dog; pack my box
+        with five dozen liquor jugs.
+    """,
+}
+
+
+def ngrams(text: str, max_chars: int = MAX_CHARS) -> Counter:
+    """n-граммы символов слов текста (нижний регистр, ё → е, слова в пробелах)."""
+    # слова через два пробела: n-граммы на стыке слов содержат "  " и выбрасываются
+    s = " " + "  ".join(WORD_RE.findall(text[:max_chars].lower().replace("ё", "е"))) + " "
+    grams = Counter(s)
+    grams.update(map(add, s, s[1:]))
+    grams.update(map("".join, zip(s, s[1:], s[2:])))
+    for g in [g for g in grams if g == " " or "  " in g]:
+        del grams[g]
+    return grams
+
+
+class NgramModel:
+    def __init__(self, samples: dict):
+        counts = {lang: ngrams(text, max_chars=None) for lang, text in samples.items()}
+        vocab = len(set().union(*counts.values())) + 1
+        self.log_probs, self.unseen, self.letters = {}, {}, {}
+        for lang, c in counts.items():
+            total = sum(c.values()) + SMOOTHING * vocab
+            self.log_probs[lang] = {g: math.log((k + SMOOTHING) / total) for g, k in c.items()}
+            self.unseen[lang] = math.log(SMOOTHING / total)
+            self.letters[lang] = frozenset(g for g in c if len(g) == 1)
+
+    def scores(self, text: str, grams: Counter = None) -> dict:
+        """{язык: средний log-вероятности n-граммы текста}; {} — букв слишком мало."""
+        grams = ngrams(text) if grams is None else grams
+        if sum(k for g, k in grams.items() if len(g) == 1) < MIN_LETTERS:
+            return {}
+        n = sum(grams.values())
+        result = {}
+        for lang, log_probs in self.log_probs.items():
+            unseen = self.unseen[lang]
+            result[lang] = sum(k * log_probs.get(g, unseen) for g, k in grams.items()) / n
+        return result
+
+    def detect(self, text: str, default: str = None, min_coverage: float = MIN_COVERAGE, min_margin: float = 0.0):
+        grams = ngrams(text)
+        scores = self.scores(text, grams)
+        if not scores:
+            return default
+        best, second = sorted(scores, key=scores.get, reverse=True)[:2]
+        if scores[best] - scores[second] < min_margin:
+            return default
+        letters = [(g, k) for g, k in grams.items() if len(g) == 1]
+        known = sum(k for g, k in letters if g in self.letters[best])
+        return best if known / sum(k for _, k in letters) >= min_coverage else default
+
+
+MODEL = NgramModel(SAMPLES)
+
+
+def detect(text: str, default: str = None, min_coverage: float = MIN_COVERAGE, min_margin: float = 0.0):
+    """Язык текста из LANGUAGES или default, если он не определился (мало букв, чужой алфавит, смесь)."""
+    return MODEL.detect(text or "", default, min_coverage, min_margin)
+
+
+def language_scores(text: str) -> dict:
+    return MODEL.scores(text or "")
+
+
+if __name__ == "__main__":
+    import sys
+    for line in (sys.argv[1:] or sys.stdin):
+        print(f"{detect(line) or '—'}\t{line.strip()}")
@@ -2,84 +2,182 @@
 # -*- coding: utf-8 -*-
 
 """
-parser3.py — расширенный сбор русскоязычных материалов по теме алии и интеграции
+parser3.py — расширенный сбор материалов по теме алии и интеграции (ru / he / en)
 
 💡 Что делает:
 1. Парсит сайты KolZchut и Gov.il, включая скрытые подразделы
 2. Находит страницы даже если ключевые слова только в тексте (а не в URL)
-3. Извлекает текст, PDF, формы и сохраняет всё в единый knowledge_base_aliyah_full.txt
+3. Извлекает текст (html_extract.py — один проход по дереву, lxml при наличии), PDF, формы
+   и сохраняет всё в базу знаний (SQLite, по фрагментам)
 4. Отсеивает нерелевантные темы (армия, налоги, медицина и т.п.)
-5. Проверяет язык содержимого (только русские тексты)
+5. Определяет язык содержимого (lang_id.py) и берёт только языки CRAWL_LANGUAGES;
+   у каждого фрагмента базы свой язык — по нему строятся индексы по языкам
 6. Сохраняет PDF-документы и формы отдельно в папку docs/
 7. Отображает прогресс и счётчики
+8. Качает страницы параллельно (пул потоков) с лимитами на каждый хост,
+   PDF скачиваются и разбираются в отдельном пуле и не тормозят обход
+9. Повторный запуск — инкрементальный: условные запросы (If-None-Match /
+   If-Modified-Since) по сохранённому состоянию, неизменившиеся документы
+   берутся из crawl_state.sqlite3 без скачивания и разбора
+10. Посещённые адреса сравниваются в канонической форме (без дублей из-за
+   %-кодирования, слэшей и служебных параметров DROP_QUERY), запрашивается сам
+   адрес без #якоря и DROP_QUERY; обход не выходит за ALLOWED_HOSTS, а очередь —
+   по приоритету: сначала ссылки с ключевыми словами в тексте и адресе
 
 📦 Выход:
-- knowledge_base_aliyah_full.txt  — объединённая база
-- docs/                           — скачанные PDF, DOC и т.д.
+- knowledge_base_aliyah_full.sqlite3 — база знаний по фрагментам (kb_store.py)
+- knowledge_base_aliyah_full.txt  — плоская выгрузка базы
+- cleaned_base.txt                — очищенные строки без повторов (cleaner.py, этап после записи базы)
+- docs/                           — скачанные PDF по хэшу содержимого + кэш текста (doc_store.py)
 - parser3.log                     — лог-файл
+- crawl_state.sqlite3             — состояние обхода (ETag, Last-Modified, хэши)
 """
 
 import os
 import re
+import json
 import time
+import hashlib
 import logging
-import requests
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
-from pdfminer.high_level import extract_text as pdf_extract_text
+from urllib.parse import unquote, urljoin, urlparse
+
+try:
+    from . import pdf_stream
+    from .crawl_engine import CrawlProgress, Frontier, HostLimiter, canonical_url, clean_url, error_kind, host_allowed, thread_session
+    from .crawl_state import CrawlState, conditional_headers, response_validators
+    from .doc_store import DocStore
+    from .kb_store import KBWriter, KB_DB, export_text
+    from .cleaner import clean_kb
+    from .html_extract import parse_html
+    from .lang_id import detect
+except ImportError:
+    # запуск файлом из папки popitka2
+    from crawl_engine import CrawlProgress, Frontier, HostLimiter, canonical_url, clean_url, error_kind, host_allowed, thread_session
+    from crawl_state import CrawlState, conditional_headers, response_validators
+    from doc_store import DocStore
+    from kb_store import KBWriter, KB_DB, export_text
+    from cleaner import clean_kb
+    from html_extract import parse_html
+    from lang_id import detect
+    import pdf_stream
 
 
 # ----------- Настройки -----------
 OUTPUT_FILE = Path("knowledge_base_aliyah_full.txt")
+CLEANED_FILE = Path("cleaned_base.txt")  # очищенная выгрузка (cleaner.py); None — этап отключён
+STATE_FILE = Path("crawl_state.sqlite3")
 DOCS_DIR = Path("docs")
 DOCS_DIR.mkdir(exist_ok=True)
+DOC_STORE = DocStore(DOCS_DIR)
 
 LOG_FILE = Path("parser3.log")
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format="%(asctime)s - %(message)s")
 logger = logging.getLogger("parser3")
 
-# Основные страницы
-START_URLS = [
-    "https://www.kolzchut.org.il/ru/Репатрианты",
-    "https://www.kolzchut.org.il/ru/New_Olim",
-    "https://www.kolzchut.org.il/ru/category/Олим_Хадашим",
-    "https://www.kolzchut.org.il/ru/Тошав_хозер",
-    "https://www.gov.il/ru/subjects/immigration_and_absorption",
-    "https://www.gov.il/ru/subjects/returning_residents",
-    "https://www.gov.il/ru/subjects/learning_hebrew",
-    "https://www.gov.il/ru/departments/ministry_of_aliyah_and_integration",
-    "https://govextra.gov.il/moia/your-place-in-israel-lang/home-ru/",
-]
+# Языки обхода: страницы и PDF на других языках пропускаются
+CRAWL_LANGUAGES = tuple(l.strip() for l in os.getenv("CRAWL_LANGUAGES", "ru,he,en").split(",") if l.strip())
+
+# Основные страницы по языкам
+START_URLS = {
+    "ru": [
+        "https://www.kolzchut.org.il/ru/Репатрианты",
+        "https://www.kolzchut.org.il/ru/New_Olim",
+        "https://www.kolzchut.org.il/ru/category/Олим_Хадашим",
+        "https://www.kolzchut.org.il/ru/Тошав_хозер",
+        "https://www.gov.il/ru/subjects/immigration_and_absorption",
+        "https://www.gov.il/ru/subjects/returning_residents",
+        "https://www.gov.il/ru/subjects/learning_hebrew",
+        "https://www.gov.il/ru/departments/ministry_of_aliyah_and_integration",
+        "https://govextra.gov.il/moia/your-place-in-israel-lang/home-ru/",
+    ],
+    "he": [
+        "https://www.kolzchut.org.il/he/עולים_חדשים",
+        "https://www.kolzchut.org.il/he/תושבים_חוזרים",
+        "https://www.gov.il/he/subjects/immigration_and_absorption",
+        "https://www.gov.il/he/subjects/returning_residents",
+        "https://www.gov.il/he/departments/ministry_of_aliyah_and_integration",
+    ],
+    "en": [
+        "https://www.kolzchut.org.il/en/New_Immigrants",
+        "https://www.gov.il/en/subjects/immigration_and_absorption",
+        "https://www.gov.il/en/subjects/returning_residents",
+        "https://www.gov.il/en/departments/ministry_of_aliyah_and_integration",
+    ],
+}
 
 KEYWORDS = [
     "алия", "алим", "репатриант", "репатрианты", "возвращающ",
     "министерство алии", "министерство интеграции", "абсорбц",
     "интеграция", "ульпан", "еврей", "тошав хозер", "olim", "aliyah",
-    "absorption", "integration", "returning"
+    "absorption", "integration", "returning",
+    "immigra", "new immigrant", "returning resident", "ulpan", "oleh",
+    "עלייה", "עולים", "עולה חדש", "קליטה", "תושב חוזר", "תושבים חוזרים", "אולפן",
 ]
 
 EXCLUDE = ["army", "tax", "covid", "pension", "violence", "lawyer", "children", "business"]
 
+# Обход страниц не выходит за эти сайты (и их поддомены: www., govextra.); PDF и формы — с любых
+ALLOWED_HOSTS = ["kolzchut.org.il", "gov.il"]
+# Параметры запроса, которые не меняют содержимое страницы (метки, служебные виды вики) —
+# отбрасываются; остальные (title=, page=, skip=) различают страницы. * — префикс
+DROP_QUERY = ("utm_*", "fbclid", "gclid", "action", "oldid", "diff", "curid", "returnto", "printable", "mobileaction")
+
+# Приоритет ссылки в очереди обхода (crawl_engine.Frontier): сначала — вероятнее всего по теме
+ANCHOR_WEIGHT = 2.0    # за каждое ключевое слово в тексте ссылки
+URL_WEIGHT = 1.0       # за каждое ключевое слово в адресе
+DEPTH_PENALTY = 0.5    # за каждый уровень глубины
+START_SCORE = 100.0    # стартовые страницы — вне конкуренции
+
 PDF_EXT = {".pdf"}
 FORM_EXT = {".doc", ".docx", ".xls", ".xlsx", ".rtf", ".odt", ".zip"}
-MAX_PAGES = 150
+MAX_PAGES = 150  # всего страниц в KB за обход
+# Сколько из них может занять один язык CRAWL_LANGUAGES; None — поровну (MAX_PAGES / число языков)
+MAX_PAGES_PER_LANG = None
 MAX_DEPTH = 4
-DELAY = 0.5
+DELAY = 0.5  # пауза между запросами к хосту, которого нет в HOST_LIMITS
+
+# Параллельность: потоки для страниц и отдельные потоки для PDF
+PAGE_WORKERS = 6
+PDF_WORKERS = 2
+# хост: (одновременных запросов, запросов в секунду)
+HOST_LIMITS = {
+    "kolzchut.org.il": (3, 4.0),
+    "gov.il": (2, 2.0),
+}
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+LIMITER = HostLimiter(HOST_LIMITS, default=(1, 1 / DELAY))
+
+NOT_MODIFIED = "not_modified"  # документ не изменился с прошлого обхода
+FETCH_FAILED = "fetch_failed"  # временная ошибка запроса (таймаут, 5xx) — документ в KB остаётся
+GONE_STATUSES = (404, 410)     # только эти ответы означают, что страницы больше нет
+PROGRESS_INTERVAL = 1.0  # как часто (секунды) crawl() отдаёт счётчики в on_progress
 
 
 # ----------- Утилиты -----------
-def clean_text(s: str) -> str:
-    return re.sub(r"\s+", " ", s or "").strip()
+def page_language(text: str):
+    """Язык текста (lang_id.py), если он из CRAWL_LANGUAGES, иначе None"""
+    lang = detect(text)
+    return lang if lang in CRAWL_LANGUAGES else None
+
+
+LANG_SEGMENT_RE = re.compile(r"^/([a-z]{2})(?:/|$)")
+URL_WORDS_RE = re.compile(r"[/_\-+.]+")
+
 
+def url_language(url: str):
+    """Язык из первого сегмента пути (/ru/..., /he/..., /en/...) или None."""
+    m = LANG_SEGMENT_RE.match(urlparse(url).path)
+    return m.group(1) if m else None
 
-def is_russian_text(text: str) -> bool:
-    """Проверяем, что в тексте хотя бы 25% кириллицы"""
-    letters = [c for c in text if c.isalpha()]
-    if not letters:
-        return False
-    cyr = sum(1 for c in letters if "а" <= c.lower() <= "я" or c.lower() == "ё")
-    return cyr / len(letters) > 0.25
+
+def lang_quota() -> int:
+    """Квота страниц одного языка: MAX_PAGES_PER_LANG или поровну от MAX_PAGES, не больше MAX_PAGES."""
+    if MAX_PAGES_PER_LANG is not None:
+        return min(MAX_PAGES_PER_LANG, MAX_PAGES)
+    return -(-MAX_PAGES // max(len(CRAWL_LANGUAGES), 1))
 
 
 def has_keywords(text: str) -> bool:
@@ -87,24 +185,56 @@ def has_keywords(text: str) -> bool:
     return any(k in t for k in KEYWORDS)
 
 
+# Досрочная остановка разбора PDF: (проверка, за сколько первых страниц она должна пройти)
+PDF_CHECKS = [(page_language, 3), (has_keywords, 20)]
+
+
+def link_score(url: str, anchor: str = "", depth: int = 0) -> float:
+    """Чем больше KEYWORDS в тексте ссылки и в адресе и чем ближе к стартовым страницам — тем раньше её обойдём."""
+    words = URL_WORDS_RE.sub(" ", unquote(urlparse(url).path).lower())
+    anchor = anchor.lower()
+    return (ANCHOR_WEIGHT * sum(k in anchor for k in KEYWORDS)
+            + URL_WEIGHT * sum(k in words for k in KEYWORDS)
+            - DEPTH_PENALTY * depth)
+
+
 def file_ext(url: str) -> str:
     return Path(urlparse(url).path).suffix.lower()
 
 
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def download(session, url: str, timeout: int, doc=None, progress=None):
+    """GET с лимитами хоста; если есть сохранённое состояние doc — условный. None при 304."""
+    with LIMITER.limit(url):
+        r = session.get(url, timeout=timeout, headers=conditional_headers(doc))
+    if progress is not None:
+        progress.add("bytes", len(r.content))
+    if r.status_code == 304:
+        return None
+    r.raise_for_status()
+    return r
+
+
+def pdf_file_text(content: bytes, name_hint: str = "", url: str = None) -> str:
+    """
+    Сохраняет PDF в хранилище docs/ (по SHA-256) и возвращает текст, если он на языке обхода и по теме.
+    Одинаковые PDF хранятся и разбираются один раз — текст берётся из кэша по хэшу.
+    """
+    sha = DOC_STORE.put(content, ".pdf")
+    DOC_STORE.link(sha, title=re.sub(r'[^\w\-]+', '_', name_hint)[:60], url=url)
+    text = DOC_STORE.text(sha, lambda path: pdf_stream.extract_text(path, PDF_CHECKS))
+    if text and page_language(text) and has_keywords(text):
+        return text
+    return ""
+
+
 def extract_pdf(session, url: str, name_hint: str = "") -> str:
     """Извлекает текст из PDF и сохраняет файл"""
     try:
-        r = session.get(url, timeout=40)
-        r.raise_for_status()
-        filename = DOCS_DIR / (re.sub(r'[^\w\-]+', '_', name_hint)[:60] + ".pdf")
-        with open(filename, "wb") as f:
-            f.write(r.content)
-
-        text = pdf_extract_text(filename)
-        text = clean_text(text)
-        if is_russian_text(text) and has_keywords(text):
-            return text
-        return ""
+        return pdf_file_text(download(session, url, 40).content, name_hint, url)
     except Exception as e:
         logger.warning(f"Ошибка PDF {url}: {e}")
         return ""
@@ -113,105 +243,319 @@ def extract_pdf(session, url: str, name_hint: str = "") -> str:
 def extract_page(session, url: str):
     """Извлекает контент страницы и ссылки"""
     try:
-        r = session.get(url, timeout=30)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.content, "html.parser")
+        r = download(session, url, 30)
     except Exception as e:
         logger.warning(f"Ошибка запроса: {url} ({e})")
         return None
+    return parse_page(url, r.content)
 
-    title_tag = soup.find("h1") or soup.find("title")
-    title = clean_text(title_tag.get_text()) if title_tag else "Без названия"
 
-    main = soup.find("main") or soup.body
-    text_blocks = []
-    if main:
-        for el in main.find_all(["p", "li", "h2", "h3", "div"]):
-            txt = clean_text(el.get_text())
-            if txt and len(txt) > 25:
-                text_blocks.append(txt)
+def parse_page(url: str, html: bytes):
+    """
+    Заголовок, текст, формы, PDF, ссылки [(адрес, текст ссылки), ...] и язык страницы
+    (None — не по теме или не на языке обхода). Адреса — без #якоря и DROP_QUERY (crawl_engine.clean_url),
+    повторы сравниваются по canonical_url.
+    """
+    # один проход по <main>: каждый текст — один раз, без повторов на каждом уровне вложенных div
+    title, text_blocks, anchors = parse_html(html)
 
     content = "\n".join(text_blocks)
-    if not is_russian_text(content) or not has_keywords(content):
+    lang = page_language(content)
+    if not lang or not has_keywords(content):
         return None
 
     forms, pdfs, links = [], [], []
-    for a in soup.find_all("a", href=True):
-        full_url = urljoin(url, a["href"])
-        ext = file_ext(full_url)
-        if any(x in full_url for x in ["#", "javascript:", "mailto:"]):
+    seen = set()
+    for href, anchor in anchors:
+        if any(x in href for x in ["javascript:", "mailto:"]) or href.startswith("#"):
             continue
+        full_url = clean_url(urljoin(url, href), DROP_QUERY)  # без #якоря, utm_* и т.п.
+        key = canonical_url(full_url, DROP_QUERY)
+        if key in seen:
+            continue
+        seen.add(key)
+        ext = file_ext(full_url)
         if ext in FORM_EXT:
             forms.append(full_url)
         elif ext in PDF_EXT:
             pdfs.append(full_url)
-        elif full_url.startswith("https://") and not any(x in full_url for x in EXCLUDE):
-            links.append(full_url)
+        elif (full_url.startswith("https://") and host_allowed(full_url, ALLOWED_HOSTS)
+              and not any(x in full_url for x in EXCLUDE)
+              and url_language(full_url) in (None, *CRAWL_LANGUAGES)):  # /ar/, /fr/ и т.п. не качаем
+            links.append((full_url, anchor))
 
-    return title, content, forms, pdfs, links
+    return title, content, forms, pdfs, links, lang
 
 
 # ----------- Основная логика -----------
-def crawl():
-    session = requests.Session()
-    session.headers.update({"User-Agent": "Mozilla/5.0"})
-
-    visited = {}
-    queue = [(url, 0) for url in START_URLS]
+def fetch_page(url: str, doc=None, progress=None):
+    """(результат parse_page | NOT_MODIFIED | FETCH_FAILED | None, валидаторы ответа)"""
+    progress = progress or CrawlProgress()
+    session = thread_session(HEADERS)
+    try:
+        r = download(session, url, 30, doc, progress)
+    except Exception as e:
+        logger.warning(f"Ошибка запроса: {url} ({e})")
+        progress.error(error_kind(e))
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        return (None if status in GONE_STATUSES else FETCH_FAILED), {}
+    if r is None:
+        progress.add("not_modified")
+        return NOT_MODIFIED, {}
+    progress.add("fetched")
+    result = parse_page(url, r.content)
+    if result is None:
+        progress.add("skipped")  # не по теме или не на языке обхода
+    return result, response_validators(r)
+
+
+def fetch_pdf(url: str, name_hint: str, doc=None, progress=None):
+    """(текст | NOT_MODIFIED, валидаторы ответа, хэш файла)"""
+    progress = progress or CrawlProgress()
+    session = thread_session(HEADERS)
+    try:
+        r = download(session, url, 40, doc, progress)
+        if r is None:
+            progress.add("pdf_not_modified")
+            return NOT_MODIFIED, {}, None
+        content_hash = sha256(r.content)
+        if doc and doc["content_hash"] == content_hash:
+            progress.add("pdf_not_modified")
+            return NOT_MODIFIED, response_validators(r), content_hash
+        text = pdf_file_text(r.content, name_hint, url)
+        progress.add("pdf_parsed")
+        return text, response_validators(r), content_hash
+    except Exception as e:
+        logger.warning(f"Ошибка PDF {url}: {e}")
+        progress.error("pdf_" + error_kind(e))
+        return "", {}, None
+
+
+def crawl(full: bool = False, on_progress=None, should_stop=None):
+    """
+    Обход по приоритету с теми же MAX_PAGES / MAX_DEPTH, что и раньше: в KB попадает
+    не больше MAX_PAGES страниц, глубже MAX_DEPTH не идём. Внутри общего лимита у
+    каждого языка CRAWL_LANGUAGES своя квота (lang_quota: MAX_PAGES_PER_LANG или
+    поровну) — счётчик по языку страницы; ссылки /ru/, /he/, /en/ на уже набранный
+    язык не качаются, а страница сверх квоты своего языка не записывается.
+    Очередь — crawl_engine.Frontier: сначала стартовые
+    страницы, затем ссылки с наибольшим link_score (KEYWORDS в тексте ссылки и
+    адресе, минус глубина) — лимит уходит на страницы, которые скорее пройдут
+    has_keywords. Посещённые адреса сравниваются по canonical_url (запрашиваются как есть), ссылки
+    за пределы ALLOWED_HOSTS не обходятся.
+    Одновременно в работе не больше PAGE_WORKERS страниц (и не больше, чем
+    осталось до лимита); запись страницы откладывается, пока не готовы
+    все её PDF, и страница с PDF записывается в KB_DB одним документом. PDF, на
+    который ссылаются несколько страниц, качается, записывается и считается один
+    раз — с первой сославшейся страницей.
+
+    Без full=True запросы условные: неизменившиеся страницы и PDF берутся из
+    STATE_FILE, а в KB_DB переписываются только изменившиеся документы.
+    Плоский OUTPUT_FILE выгружается из KB_DB, только если что-то изменилось.
+
+    on_progress(счётчики) вызывается не чаще раза в PROGRESS_INTERVAL секунд и в конце;
+    should_stop() — отмена: новые страницы не берутся, ждущие PDF отменяются,
+    уже скачанное записывается, а удаление «пропавших» страниц из KB пропускается.
+    Возвращает итоговые счётчики (+ "cancelled").
+    """
+    state = CrawlState(STATE_FILE)
+    progress = CrawlProgress()
+    reported = 0.0
+    cancelled = False
+    writer = KBWriter(KB_DB)
+
+    visited = set()
+    written = set()     # страницы, попавшие в KB в этом обходе
+    failed = set()      # страницы с временной ошибкой запроса — их документы prune не удаляет
+    quota = lang_quota()
+    per_lang = Counter()  # страниц в KB по языкам, каждый — не больше quota
+    frontier = Frontier()
+    for lang in CRAWL_LANGUAGES:
+        for url in START_URLS.get(lang, []):
+            frontier.push(url, 0, START_SCORE, canonical_url(url, DROP_QUERY))
     count, pdf_count, form_count = 0, 0, 0
-
-    with OUTPUT_FILE.open("w", encoding="utf-8") as f:
-        while queue and count < MAX_PAGES:
-            url, depth = queue.pop(0)
-            if url in visited or depth > MAX_DEPTH:
-                continue
-            visited[url] = True
-
-            logger.info(f"[{count+1}] {url}")
-            print(f"→ [{count+1}] {url}")
-            result = extract_page(session, url)
-            if not result:
-                continue
-            title, content, forms, pdfs, links = result
-
-            source = "kolzchut" if "kolzchut" in url else "gov.il"
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-
-            f.write("=" * 80 + "\n")
-            f.write(f"Название: {title}\n")
-            f.write(f"Ссылка: {url}\n")
-            f.write(f"Источник: {source}\n")
-            f.write(f"Дата парсинга: {timestamp}\n")
-            f.write("-" * 80 + "\n")
-            f.write(content + "\n\n")
-
-            if forms:
-                form_count += len(forms)
-                f.write("Формы для заполнения:\n")
-                for form in forms:
-                    f.write(f"📄 {form}\n")
-                f.write("\n")
-
-            for pdf_url in pdfs:
-                pdf_text = extract_pdf(session, pdf_url, title)
-                if pdf_text:
-                    pdf_count += 1
-                    f.write("Правовой документ (PDF):\n")
-                    f.write(f"📑 {pdf_url}\n")
-                    f.write(pdf_text + "\n\n")
-
-            count += 1
-            for u in links:
-                if u not in visited:
-                    queue.append((u, depth + 1))
-
-            time.sleep(DELAY)
-
-    logger.info(f"✅ Парсинг завершён: {count} страниц, {pdf_count} PDF, {form_count} форм")
-    print(f"\n✅ Готово! {count} страниц, {pdf_count} PDF, {form_count} форм.")
-    print(f"📂 Результат: {OUTPUT_FILE}")
+    changed, unchanged = 0, 0
+
+    in_flight = {}      # future страницы → (url, depth, сохранённое состояние)
+    pdf_seen = set()    # PDF уже привязан к первой сославшейся странице — остальным не достаётся
+    records = deque()   # (url, страница, время, изменилась ли, [(pdf_url, состояние, future), ...])
+
+    with ThreadPoolExecutor(PAGE_WORKERS) as page_pool, ThreadPoolExecutor(PDF_WORKERS) as pdf_pool:
+        while True:
+            if not cancelled and should_stop is not None and should_stop():
+                cancelled = True
+                frontier.clear()
+                for *_, pdfs in records:
+                    for _, _, fut in pdfs:
+                        fut.cancel()
+                logger.info("⏹ Обход отменён")
+                print("⏹ Обход отменён — дописываю уже скачанное")
+
+            while frontier and len(in_flight) < PAGE_WORKERS and count + len(in_flight) < MAX_PAGES:
+                url, depth, score = frontier.pop()
+                key = canonical_url(url, DROP_QUERY)
+                url_lang = url_language(url)
+                if key in visited or (url_lang and per_lang[url_lang] >= quota):
+                    continue
+                visited.add(key)
+                logger.info(f"[{count+1}] {url} (приоритет {score:.1f})")
+                print(f"→ [{count+1}] {url}")
+                doc = None if full else state.get(url)
+                in_flight[page_pool.submit(fetch_page, url, doc, progress)] = (url, depth, doc)
+
+            pdf_futures = [fut for *_, pdfs in records for _, _, fut in pdfs if not fut.done()]
+            if not in_flight and not pdf_futures and not records:
+                break
+            if in_flight or pdf_futures:
+                # с таймаутом: отмена и on_progress (отметка воркера) не ждут медленной загрузки
+                done, _ = wait(list(in_flight) + pdf_futures, timeout=PROGRESS_INTERVAL,
+                               return_when=FIRST_COMPLETED)
+            else:
+                done = ()
+
+            for fut in done:
+                if fut not in in_flight:
+                    continue
+                url, depth, doc = in_flight.pop(fut)
+                result, validators = fut.result()
+                progress.add("processed")
+                page_changed = False
+                if result == FETCH_FAILED:
+                    failed.add(url)
+                    continue
+                if result == NOT_MODIFIED:
+                    page = doc["payload"]
+                elif result:
+                    title, content, forms, pdfs, links, lang = result
+                    page = {"title": title, "content": content, "forms": forms, "pdfs": pdfs, "links": links,
+                            "lang": lang}
+                else:
+                    continue
+
+                # в состоянии старых обходов языка страницы нет
+                lang = page.get("lang") or page_language(page["content"])
+                if per_lang[lang] >= quota:
+                    progress.add("lang_limit")  # язык уже набран, страница скачана параллельно с последней
+                    continue
+                per_lang[lang] += 1
+
+                if result == NOT_MODIFIED:
+                    state.touch(url, validators)
+                    timestamp = doc["changed_at"]
+                    unchanged += 1
+                else:
+                    content_hash = sha256(json.dumps(page, ensure_ascii=False).encode("utf-8"))
+                    if doc and doc["content_hash"] == content_hash:
+                        state.touch(url, validators)
+                        timestamp = doc["changed_at"]
+                        unchanged += 1
+                    else:
+                        timestamp = state.save(url, "page", validators, content_hash, page)
+                        page_changed = True
+                        changed += 1
+
+                form_count += len(page["forms"])
+                pdf_jobs = []
+                for pdf_url in ([] if cancelled else page["pdfs"]):
+                    if pdf_url in pdf_seen:
+                        continue  # текст PDF уже войдёт в документ другой страницы
+                    pdf_seen.add(pdf_url)
+                    pdf_doc = None if full else state.get(pdf_url)
+                    pdf_jobs.append((pdf_url, pdf_doc, pdf_pool.submit(
+                        fetch_pdf, pdf_url, page["title"], pdf_doc, progress)))
+                records.append((url, page, timestamp, page_changed, pdf_jobs))
+
+                count += 1
+                for link in ([] if cancelled or depth >= MAX_DEPTH else page["links"]):
+                    # в состоянии прошлых обходов ссылки — просто адреса, без текста
+                    u, anchor = (link, "") if isinstance(link, str) else link
+                    key = canonical_url(u, DROP_QUERY)
+                    if key not in visited and host_allowed(u, ALLOWED_HOSTS):
+                        frontier.push(u, depth + 1, link_score(u, anchor, depth + 1), key)
+
+            # пишем страницы, у которых готовы все PDF
+            while records and all(fut.done() for _, _, fut in records[0][4]):
+                url, page, timestamp, page_changed, pdfs = records.popleft()
+                pdf_texts = []
+                for pdf_url, pdf_doc, fut in pdfs:
+                    if fut.cancelled():
+                        continue
+                    pdf_text, validators, content_hash = fut.result()
+                    if pdf_text == NOT_MODIFIED:
+                        pdf_text = pdf_doc["payload"]["text"]
+                        state.touch(pdf_url, validators)
+                    elif content_hash:
+                        state.save(pdf_url, "pdf", validators, content_hash, {"text": pdf_text})
+                        page_changed = True
+                    if pdf_text:
+                        pdf_count += 1
+                        pdf_texts.append((pdf_url, pdf_text))
+                if page_changed or not writer.has_document(url):
+                    source = "kolzchut" if "kolzchut" in url else "gov.il"
+                    writer.write_document(url, page["title"], source, timestamp,
+                                          page["content"], page["forms"], pdf_texts, page.get("lang"))
+                written.add(url)
+                writer.commit()
+                state.commit()
+
+            if on_progress is not None and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                reported = time.monotonic()
+                progress.set("queue", len(frontier))
+                progress.set("in_flight", len(in_flight))
+                progress.set("pdf_pending", len(pdf_futures))
+                on_progress(crawl_counters(progress, count, pdf_count, form_count, changed, unchanged))
+
+    if not cancelled:
+        # после отмены обход неполный — «пропавшие» страницы не удаляем; удаляются только
+        # страницы, которые обход не нашёл, ответившие 404/410 или больше не подходящие по теме
+        writer.prune(written | failed)
+    kb_changed = writer.changed
+    writer.close()
+    state.close()
+    DOC_STORE.save_manifest()
+
+    if kb_changed or not OUTPUT_FILE.exists():
+        export_text(KB_DB, OUTPUT_FILE)
+    else:
+        print("ℹ️ База знаний не изменилась — файлы не перезаписаны.")
+    if CLEANED_FILE is not None and (kb_changed or not CLEANED_FILE.exists()):
+        stats = clean_kb(KB_DB, CLEANED_FILE)  # потоково из SQLite, память не зависит от размера базы
+        progress.set("cleaned_lines", stats["kept"])
+        logger.info(f"🧹 Очищенная выгрузка: {stats['kept']} строк из {stats['lines']} → {CLEANED_FILE}")
+
+    logger.info(f"✅ Парсинг завершён: {count} страниц ({changed} изменилось, {unchanged} без изменений), "
+                f"{pdf_count} PDF, {form_count} форм")
+    print(f"\n✅ Готово! {count} страниц ({changed} изменилось, {unchanged} без изменений), "
+          f"{pdf_count} PDF, {form_count} форм.")
+    print("🌐 По языкам: " + ", ".join(f"{lang} {per_lang[lang]}/{quota}" for lang in CRAWL_LANGUAGES))
+    print(f"📂 Результат: {KB_DB} (плоская выгрузка: {OUTPUT_FILE})")
+
+    for key in ("queue", "in_flight", "pdf_pending"):
+        progress.set(key, 0)
+    summary = crawl_counters(progress, count, pdf_count, form_count, changed, unchanged)
+    summary["cancelled"] = cancelled
+    summary["languages"] = dict(per_lang)
+    if on_progress is not None:
+        on_progress(summary)
+    return summary
+
+
+def crawl_counters(progress, pages, pdfs, forms, changed, unchanged) -> dict:
+    for key, value in (("pages", pages), ("pdfs", pdfs), ("forms", forms),
+                       ("changed", changed), ("unchanged", unchanged)):
+        progress.set(key, value)
+    return progress.snapshot()
+
+
+def print_progress(counters: dict) -> None:
+    errors = ", ".join(f"{k} {v}" for k, v in sorted(counters.get("errors", {}).items())) or "нет"
+    print(f"📊 страниц {counters.get('processed', 0)} ({counters.get('pages_per_sec', 0)}/с), "
+          f"очередь {counters.get('queue', 0)}, в работе {counters.get('in_flight', 0)}, "
+          f"пропущено {counters.get('skipped', 0)}, 304 {counters.get('not_modified', 0)}, "
+          f"PDF {counters.get('pdf_parsed', 0)}, {counters.get('bytes', 0) // 1024} КБ, ошибки: {errors}")
 
 
 if __name__ == "__main__":
-    crawl()
+    import sys
+    crawl(full="--full" in sys.argv, on_progress=print_progress)
 
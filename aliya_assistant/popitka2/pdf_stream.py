@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+pdf_stream.py — постраничное извлечение текста из PDF
+
+pdfminer.high_level.extract_text() собирает весь документ в одну строку, и
+только потом по ней проходит re.sub(r"\\s+", ...). На больших правовых PDF это
+пик памяти. Здесь страницы идут генератором (extract_pages отдаёт LTPage по
+одной), каждая чистится отдельно, а разбор останавливается:
+- после max_pages страниц или max_bytes текста;
+- досрочно, если проверка (язык, ключевые слова) не прошла за свои первые N страниц.
+
+Используется в parser2.py и docs_to_txt.py.
+"""
+
+import os
+import re
+
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+
+MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 500))
+MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", 8 * 1024 * 1024))  # предел извлечённого текста (UTF-8)
+
+WS_RE = re.compile(r"\s+")
+
+
+def iter_pages(path, max_pages: int = MAX_PAGES):
+    """Текст страниц по одной, без лишних пробелов; пустые страницы пропускаются."""
+    for page in extract_pages(path, maxpages=max_pages):
+        parts = [el.get_text() for el in page if isinstance(el, LTTextContainer)]
+        text = WS_RE.sub(" ", " ".join(parts).replace("\x0c", "")).strip()
+        if text:
+            yield text
+
+
+def extract_text(path, checks=(), max_pages: int = MAX_PAGES, max_bytes: int = MAX_BYTES):
+    """
+    Текст PDF, собранный постранично.
+
+    checks — [(predicate(text) -> bool, pages), ...]: predicate проверяется на
+    накопленном тексте, пока не вернёт True; если за первые `pages` страниц
+    (или до конца документа) он так и не прошёл — разбор прекращается и
+    возвращается None.
+    """
+    pending = list(checks)
+    pages, size = [], 0
+    for n, text in enumerate(iter_pages(path, max_pages), start=1):
+        pages.append(text)
+        size += len(text.encode("utf-8"))
+        if pending:
+            acc = " ".join(pages)
+            pending = [(pred, window) for pred, window in pending if not pred(acc)]
+            if any(n >= window for _, window in pending):
+                return None
+        if size >= max_bytes:
+            break
+    if pending:
+        return None
+    return " ".join(pages)
@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 from datetime import datetime
 from colorama import Fore, Style, init
 
+from consultations.services.consultation_log import log_consultation
+
 # Инициализация colorama
 init(autoreset=True)
 
@@ -72,7 +74,7 @@ def generate_response(model, lang_code, question):
     )
     duration = (datetime.now() - start_time).total_seconds()
     answer = (response.choices[0].message.content or "").strip()
-    return answer, duration
+    return answer, duration, response.usage
 
 # === Основной цикл ===
 def main():
@@ -107,30 +109,23 @@ def main():
             print(Fore.CYAN + f"Отправка запроса к модели {model}...\n")
 
             try:
-                answer, duration = generate_response(model, lang_code, question)
-
-
-                # === Формирование отчёта ===
-                report = (
-                    f"ОТЧЁТ О РАБОТЕ МОДЕЛИ\n"
-                    f"{'='*60}\n"
-                    f"Дата и время: {datetime.now():%Y-%m-%d %H:%M:%S}\n"
-                    f"Модель: {model}\n"
-                    f"Язык: {lang_name}\n"
-                    f"Время отклика: {duration:.2f} секунд\n"
-                    f"{'-'*60}\n"
-                    f"Вопрос:\n{question}\n\n"
-                    f"Ответ:\n{answer}\n"
-                    f"{'='*60}\n"
+                answer, duration, usage = generate_response(model, lang_code, question)
+
+                # === Запись в журнал консультаций (consultations.sqlite3, фоновая запись) ===
+                log_consultation(
+                    question, source="vs_on_terminal", model=model, language=lang_code,
+                    answer=answer, latency=duration,
+                    prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None),
                 )
-                with open("report.txt", "a", encoding="utf-8") as f:
-                    f.write(report + "\n\n")
 
-                print(Fore.GREEN + "✅ Ответ получен и добавлен в report.txt\n")
+                print(Fore.GREEN + "✅ Ответ получен и записан в журнал консультаций\n")
                 print(Fore.WHITE + Style.BRIGHT + "Ответ модели:\n")
                 print(Fore.LIGHTYELLOW_EX + answer + "\n")
 
             except Exception as e:
+                log_consultation(question, source="vs_on_terminal", model=model, language=lang_code,
+                                 error=f"{type(e).__name__}: {e}")
                 print(Fore.RED + f"❌ Ошибка при обращении к API: {e}")
 
             # Меню после ответа
@@ -1,61 +1,52 @@
 # -*- coding: utf-8 -*-
-import os, re, sys
+import os, sys
 from datetime import datetime
-from collections import Counter
 from dotenv import load_dotenv
-from colorama import Fore, Style, init
-import openai
+from colorama import Fore, init
+
+from consultations.services.kb_index import index_for_question, question_language
+from consultations.services.context_builder import build_context
+from consultations.services.answer_cache import cached_answer, get_cache
+from consultations.services.openai_clients import get_client
+from consultations.services.consultation_log import log_consultation
+from consultations.services.metrics import REGISTRY, record_usage
+from consultations.services.pipeline import MODE, PipelineResult, Stage, fused_fields, run_graph, run_sync
 
 # ========== НАСТРОЙКИ ==========
 CLEAR = False  # не очищаем экран
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-KB_PATH = os.getenv("KB_PATH", "knowledge_base_aliyah_full.txt")
+KB_DB = "knowledge_base_aliyah_full.sqlite3"  # структурированная база, если уже собрана
+KB_PATH = os.getenv("KB_PATH", KB_DB if os.path.exists(KB_DB) else "knowledge_base_aliyah_full.txt")
 
 # ========== ИНИЦИАЛИЗАЦИЯ ==========
 init(autoreset=True)
 load_dotenv()
 
-client = openai.OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
-)
+client = get_client()  # OPENAI_BASE_URL и OPENAI_API_KEY берутся из окружения; OPENAI_STUB=1 — без сети
 
 def clear():
     if CLEAR:
         os.system("cls" if os.name == "nt" else "clear")
 
-def load_kb(path: str) -> str:
-    print(f"📄 Загружаю базу знаний: {os.path.abspath(path)}")
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"❌ KB not found: {path}")
-    with open(path, "r", encoding="utf-8") as f:
-        txt = f.read()
-    return re.sub(r"\r\n?", "\n", txt)
-
-def split_paragraphs(text: str):
-    parts = re.split(r"\n\s*\n", text)
-    return [p.strip() for p in parts if len(p.strip()) > 40]
-
-TOKEN_RE = re.compile(r"[A-Za-zА-Яа-яЁё0-9\-']+")
-def tok(s: str): return [t.lower() for t in TOKEN_RE.findall(s)]
-
-def retrieve(kb: str, question: str) -> str:
-    print("🔍 Выбираю релевантный контекст...")
-    paras = split_paragraphs(kb)
-    q = tok(question)
-    qset = set([t for t in q if len(t) > 2])
-    scored = []
-    for p in paras:
-        pt = tok(p)
-        score = sum(1 for t in pt if t in qset)
-        if score > 0:
-            scored.append((score, p))
-    selected = [p for _, p in sorted(scored, key=lambda x:x[0], reverse=True)[:10]]
-    ctx = "\n\n".join(selected)
-    print(f"📌 Контекст выбран: {len(ctx)} символов")
-    return ctx
+def load_index(path: str, question: str = ""):
+    """Индекс на языке вопроса (пустой или смешанный вопрос — вся база); при старте проверяет, что KB на месте."""
+    if not question:
+        print(f"📄 Загружаю базу знаний: {os.path.abspath(path)}")
+    return index_for_question(path, question)
 
-def call_model(role: str, question: str, context: str, previous: str = None):
+def retrieve(index, question: str):
+    print(f"🔍 Выбираю релевантный контекст (индекс {index.meta.get('lang') or 'всей базы'}, {index.n_docs} абзацев)...")
+    plan = build_context(index, question)
+    ctx = plan.contexts["analyst"]
+    print(f"📌 Контекст выбран: {len(ctx)} символов")
+    print(
+        "💰 Токены контекста: "
+        + ", ".join(f"{role} {n}" for role, n in plan.tokens.items())
+        + f" — сэкономлено {plan.tokens_saved} из {plan.baseline_tokens}"
+    )
+    return plan
+
+def call_model(role: str, question: str, context: str, previous: str = None, kb_version: str = ""):
     prompts = {
         "analyst": (
             "Ты — АНАЛИТИК Министерства алии и интеграции. "
@@ -68,12 +59,24 @@ def call_model(role: str, question: str, context: str, previous: str = None):
         "manager": (
             "Ты — МЕНЕДЖЕР. Объедини **факты** и **объяснение** в финальный "
             "10-строчный ответ для пользователя + чёткий план действий."
-        )
+        ),
+        "fused": (
+            "Ты — АНАЛИТИК, КОММУНИКАТОР и МЕНЕДЖЕР Министерства алии и интеграции в одном ответе. "
+            "Верни JSON-объект с ключами: \"facts\" — ключевые факты из КОНТЕКСТА списком; "
+            "\"explanation\" — объяснение простым языком + что делать дальше (чек-лист); "
+            "\"final\" — финальный 10-строчный ответ + чёткий план действий."
+        ),
     }
 
-    messages = [
-        {"role": "system", "content": "Используй только предоставленный КОНТЕКСТ."},
-        {"role": "system", "content": f"КОНТЕКСТ:\n{context}"},
+    if context:
+        messages = [
+            {"role": "system", "content": "Используй только предоставленный КОНТЕКСТ."},
+            {"role": "system", "content": f"КОНТЕКСТ:\n{context}"},
+        ]
+    else:
+        # коммуникатор и менеджер по умолчанию работают только по фактам аналитика
+        messages = [{"role": "system", "content": "Используй только переданные факты."}]
+    messages += [
         {"role": "system", "content": prompts[role]},
         {"role": "user", "content": question}
     ]
@@ -83,18 +86,56 @@ def call_model(role: str, question: str, context: str, previous: str = None):
 
     print(f"⏳ Отправляю запрос роли: {role.upper()}...")
 
+    def ask():
+        extra = {"response_format": {"type": "json_object"}} if role == "fused" else {}
+        r = client.chat.completions.create(model=MODEL, messages=messages, **extra)
+        record_usage(r, MODEL)
+        return r.choices[0].message.content.strip()
+
     try:
-        r = client.chat.completions.create(model=MODEL, messages=messages)
-        text = r.choices[0].message.content.strip()
+        # в ключ кэша входят промпт роли, контекст и ответы предыдущих ролей
+        key_prompt = "\n".join((prompts[role], context or "", previous or ""))
+        text = cached_answer(question, MODEL, key_prompt, kb_version, ask)
         print(f"✅ {role.upper()} ответил.\n")
         return text
     except Exception as e:
         print(f"❌ Ошибка у роли {role.upper()}: {e}")
         return f"Ошибка у роли {role.upper()}: данных недостаточно."
 
+def tokens_used():
+    """(prompt, completion) токенов MODEL с начала процесса — по счётчикам metrics."""
+    return tuple(int(REGISTRY.value("tokens_total", {"model": MODEL, "kind": kind})) for kind in ("prompt", "completion"))
+
+def role_stages(question: str, plan, kb_version: str = ""):
+    """Граф ролей: коммуникатору нужны факты аналитика, менеджеру — и факты, и объяснение."""
+    return [
+        Stage("analyst", lambda o: call_model("analyst", question, plan.contexts["analyst"], kb_version=kb_version)),
+        Stage("communicator", lambda o: call_model("communicator", o["analyst"], plan.contexts["communicator"],
+                                                   kb_version=kb_version), deps=("analyst",)),
+        Stage("manager", lambda o: call_model("manager", question, plan.contexts["manager"],
+                                              f"Факты:\n{o['analyst']}\n\nОбъяснение:\n{o['communicator']}",
+                                              kb_version=kb_version), deps=("analyst", "communicator")),
+    ]
+
+def run_roles(question: str, plan, kb_version: str = "") -> PipelineResult:
+    """Три роли по графу или, при PIPELINE_MODE=fused, одним вызовом модели."""
+    if MODE != "fused":
+        return run_sync(run_graph(role_stages(question, plan, kb_version)))
+
+    start = datetime.now()
+    raw = call_model("fused", question, plan.contexts["analyst"], kb_version=kb_version)
+    data = fused_fields(raw, fallback="final")
+    outputs = {
+        "analyst": data.get("facts", ""),
+        "communicator": data.get("explanation", ""),
+        "manager": data.get("final", ""),
+    }
+    elapsed = (datetime.now() - start).total_seconds()
+    return PipelineResult(outputs, {"fused": elapsed}, elapsed, "fused")
+
 def main():
     try:
-        kb = load_kb(KB_PATH)
+        index = load_index(KB_PATH)
     except Exception as e:
         print(f"Ошибка загрузки KB: {e}")
         sys.exit(1)
@@ -106,29 +147,37 @@ def main():
             print("⚠ Пустой вопрос, попробуйте снова.")
             continue
 
-        context = retrieve(kb, question)
-        if not context:
+        index = load_index(KB_PATH, question)
+        plan = retrieve(index, question)
+        if not plan.contexts["analyst"]:
             print("⚠ Нет данных по вопросу.")
             continue
 
-        # --- 3 модели последовательно ---
-        a_text = call_model("analyst", question, context)
-        c_text = call_model("communicator", a_text, context)
-        m_text = call_model("manager", question, context, f"Факты:\n{a_text}\n\nОбъяснение:\n{c_text}")
+        # --- 3 роли по графу зависимостей, у каждой роли свой бюджет контекста ---
+        tokens_before = tokens_used()
+        result = run_roles(question, plan, index.version)
+        prompt_tokens, completion_tokens = (after - before for after, before in zip(tokens_used(), tokens_before))
+        a_text, c_text, m_text = (result.outputs[r] for r in ("analyst", "communicator", "manager"))
 
         print("\n🔎 РЕЗУЛЬТАТ:\n")
         print(Fore.MAGENTA + "=== АНАЛИТИК ===\n" + a_text + "\n")
         print(Fore.GREEN + "=== КОММУНИКАТОР ===\n" + c_text + "\n")
         print(Fore.YELLOW + "=== МЕНЕДЖЕР (финальный) ===\n" + m_text + "\n")
+        print(result.report())
+
+        # токены — только реальные вызовы модели (ответы из кэша не тратят их)
+        log_consultation(
+            question, source="vs_on_terminal2", model=MODEL, language=question_language(question), answer=m_text,
+            roles={"analyst": a_text, "communicator": c_text, "manager": m_text},
+            timings=result.timings, latency=result.total,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        )
 
-        with open("report.txt", "a", encoding="utf-8") as f:
-            f.write(f"\nВопрос:\n{question}\n")
-            f.write("\nАНАЛИТИК:\n" + a_text + "\n")
-            f.write("\nКОММУНИКАТОР:\n" + c_text + "\n")
-            f.write("\nМЕНЕДЖЕР:\n" + m_text + "\n")
-            f.write("=" * 80 + "\n")
-
-        print("✅ Сохранено в report.txt\n")
+        print("✅ Записано в журнал консультаций\n")
+        cache = get_cache()
+        if cache is not None:
+            info = cache.info()
+            print(f"🗃 Кэш ответов: попаданий {info['memory_hits'] + info['disk_hits']}, промахов {info['misses']}")
 
 if __name__ == "__main__":
     main()